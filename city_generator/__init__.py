@@ -9,6 +9,8 @@ bl_info = {
 import imp
 import math
 import random
+import threading
+import time
 
 if 'bpy' in locals():
 	import imp
@@ -18,10 +20,18 @@ if 'bpy' in locals():
 	imp.reload(citycell)
 	imp.reload(util)
 	imp.reload(mcb)
+	imp.reload(dcel)
 	imp.reload(block)
 	imp.reload(building)
+	imp.reload(cache)
+	imp.reload(cityfile)
+	imp.reload(roadnet)
+	imp.reload(routing)
+	imp.reload(spatial)
+	imp.reload(batch)
+	imp.reload(metrics)
 else:
-	from . import city, terrain, assets, citycell, util, mcb, block, building
+	from . import city, terrain, assets, citycell, util, mcb, dcel, block, building, cache, cityfile, roadnet, routing, spatial, batch, metrics
 	import bpy
 
 
@@ -37,6 +47,21 @@ bpy.types.Scene.seed = bpy.props.StringProperty(
 	default="",
 )
 
+bpy.types.Scene.cache_directory = bpy.props.StringProperty(
+	name="Cache",
+	description="Directory where generated stages are cached and reused (empty for no cache). Used only with a random seed",
+	default="",
+	subtype='DIR_PATH'
+)
+
+bpy.types.Scene.workers = bpy.props.IntProperty(
+	name="Workers",
+	description="Number of processes used to generate city blocks. Does not change the result",
+	default=1,
+	min=1,
+	max=64
+)
+
 bpy.types.Scene.terrain_initial_height_max = bpy.props.FloatProperty(
 	name="Corner Elevation",
 	description="Maximal Z coordinate for city corner",
@@ -66,6 +91,17 @@ bpy.types.Scene.terrain_height = bpy.props.FloatProperty(
 )
 
 
+bpy.types.Scene.terrain_max_error = bpy.props.FloatProperty(
+	name="Mesh Max Error",
+	description="Max elevation error of adaptive terrain mesh, which has fewer triangles where terrain is flat. 0 for dense mesh",
+	default=0.0,
+	min=0.0,
+	soft_max=2.0,
+	subtype='DISTANCE',
+	unit='LENGTH'
+)
+
+
 bpy.types.Scene.plan_intersections = bpy.props.IntProperty(
 	name="Junctions",
 	description="Approximate number of primary street intersections",
@@ -85,6 +121,52 @@ bpy.types.Scene.plan_intersection_deviation = bpy.props.FloatProperty(
 )
 
 
+bpy.types.Scene.building_quantization = bpy.props.FloatProperty(
+	name="Building Quantization",
+	description="Building dimensions are rounded to multiples of this, so that similar buildings share one mesh. Larger is faster, 0 for exact buildings",
+	default=0.0,
+	min=0.0,
+	soft_max=5.0,
+	subtype='DISTANCE',
+	unit='LENGTH'
+)
+
+bpy.types.Scene.lazy = bpy.props.BoolProperty(
+	name="Lazy Cells",
+	description="Generate contents of city cells only when they are shown with more than flat detail",
+	default=False
+)
+
+bpy.types.Scene.road_planning_level = bpy.props.IntProperty(
+	name="Planning Level",
+	description="Primary roads are first traced on terrain downsampled this many times, then refined. 0 to trace at full resolution only",
+	default=0,
+	min=0,
+	max=6
+)
+
+bpy.types.Scene.bake_primary_roads = bpy.props.BoolProperty(
+	name="Bake Primary Roads",
+	description="Create primary roads as one static mesh, instead of objects with Array and Curve modifiers",
+	default=False
+)
+
+bpy.types.Scene.face_algorithm = bpy.props.EnumProperty(
+	name="Regions",
+	description="Algorithm used to find the regions enclosed by roads, which become city cells and blocks",
+	items=[
+		('MCB', "Minimal Cycle Basis", "Minimal cycle basis of the road graph"),
+		('DCEL', "DCEL Faces", "Faces of the planar road graph, found by following half-edges sorted by angle. Faster")
+	],
+	default='MCB'
+)
+
+bpy.types.Scene.use_lod = bpy.props.BoolProperty(
+	name="Level of Detail",
+	description="Show city cells far from the camera with less detail. Use Update LOD after moving the camera",
+	default=False
+)
+
 bpy.types.Scene.urbanization = bpy.props.FloatProperty(
 	name="Urbanization",
 	description="The higher the value, the more urbanized the city becomes.",
@@ -108,6 +190,8 @@ class CityGeneratorPanel(bpy.types.Panel):
 		
 		layout.prop(scene, 'city_name')
 		layout.prop(scene, 'seed')
+		layout.prop(scene, 'cache_directory')
+		layout.prop(scene, 'workers')
 		
 		box = layout.box()
 		box.label("Terrain")
@@ -116,49 +200,206 @@ class CityGeneratorPanel(bpy.types.Panel):
 		box.prop(scene, 'terrain_initial_height_max')
 		box.prop(scene, 'terrain_side_length')
 		box.prop(scene, 'terrain_height')
+		box.prop(scene, 'terrain_max_error')
 		
 		box = layout.box()
 		box.label("Primary Roads")
 		box.prop(scene, 'plan_intersections')
 		box.prop(scene, 'plan_intersection_deviation')
+		box.prop(scene, 'road_planning_level')
+		box.prop(scene, 'bake_primary_roads')
+		box.prop(scene, 'face_algorithm')
 		
 		box = layout.box()
 		box.label("Features")
 		box.prop(scene, 'urbanization')
+		box.prop(scene, 'building_quantization')
+		box.prop(scene, 'use_lod')
+		box.prop(scene, 'lazy')
 
 			
 		layout.operator('city.generate')
+		layout.operator('city.update_lod')
 		layout.operator('city.delete')
 
 
+cities = dict() # Generated cities, by name of their root object. Kept to switch level of detail.
+
+def camera_position(scene, city_root):
+	"""Position of scene camera in city coordinates, or None if there is no camera."""
+	if scene.camera is None:
+		return None
+	return city_root.matrix_world.inverted() * scene.camera.matrix_world.translation
+
+
+city_scale = 0.1 # Scale of city root object
+
+def city_from_scene(scene):
+	"""New city.City with the parameters set in the scene."""
+	cit = city.City()
+	if scene.seed != "":
+		cit.seed = int(scene.seed)
+	if scene.cache_directory != "":
+		cit.cache = cache.StageCache(bpy.path.abspath(scene.cache_directory))
+	cit.workers = scene.workers
+	cit.lazy = scene.lazy
+
+	cit.terrain.initial_height_range = (
+		0.0,
+		scene.terrain_initial_height_max
+	)
+	cit.terrain.side_length = scene.terrain_side_length
+	cit.terrain.elevation = scene.terrain_height
+	cit.terrain.mesh_max_error = scene.terrain_max_error
+	cit.approximate_number_of_intersection_points = scene.plan_intersections
+	cit.edges_deviation = scene.plan_intersection_deviation
+	cit.road_planning_level = scene.road_planning_level
+	cit.bake_primary_roads = scene.bake_primary_roads
+	cit.face_algorithm = scene.face_algorithm
+	cit.urbanization = scene.urbanization
+	cit.building_quantization = scene.building_quantization
+	return cit
+
+def new_city_camera_position(scene):
+	"""Camera position in coordinates of city about to be created, or None if level of detail is not used."""
+	if scene.use_lod and (scene.camera is not None):
+		return scene.camera.matrix_world.translation / city_scale
+	return None
+
+
 class OBJECT_OT_GenerateCity(bpy.types.Operator):
 	bl_idname = 'city.generate'
 	bl_label = "Generate new city"
-	bl_description = "Generate city with given parameters."
+	bl_description = "Generate city with given parameters. Press Esc to cancel."
+	
+	generation_stages = ('terrain', 'roads', 'cells', 'network')
+	generation_share = 0.7 # Part of progress bar for generation, the rest is for Blender object creation
+	step_duration = 0.05 # Time (in s) spent creating Blender objects on each timer event
+	
+	_city = None
+	_camera_position = None # Camera position in coordinates of the new city, or None
+	_thread = None # Thread running city.generate()
+	_error = None # Exception raised in generation thread
+	_progress = (None, 0.0) # Generation stage and fraction done, set by generation thread
+	_objects = None # Iterator of city.iter_create_blender_object(), once generation is done
+	_root = None
+	_timer = None
 		
 	def execute(self, context):	
 		scene = context.scene
-
-		if scene.seed != "":
-			random.seed(int(scene.seed))
-	
-		cit = city.City()
-		cit.terrain.initial_height_range = (
-			0.0,
-			scene.terrain_initial_height_max
-		)
-		cit.terrain.side_length = scene.terrain_side_length
-		cit.terrain.elevation = scene.terrain_height
-		cit.approximate_number_of_intersection_points = scene.plan_intersections
-		cit.edges_deviation = scene.plan_intersection_deviation
-		cit.urbanization = scene.urbanization
-		
+		cit = city_from_scene(scene)
 		cit.generate()
-		city_root = cit.create_blender_object(scene.city_name)
-		city_root.scale = (0.1, 0.1, 0.1)
+		city_root = cit.create_blender_object(scene.city_name, new_city_camera_position(scene))
+		city_root.scale = (city_scale, city_scale, city_scale)
 		bpy.context.scene.objects.link(city_root)
+		cities[city_root.name] = cit
+		self.__report_terrain(cit)
 				
 		return { 'FINISHED' }
+	
+	def invoke(self, context, event):
+		"""Generate city in background thread, then create Blender objects progressively on timer events."""
+		self._city = city_from_scene(context.scene)
+		self._city.progress_callback = self.__set_progress
+		# Forking worker processes from a thread inside Blender is not safe
+		self._city.workers = 1
+		self._camera_position = new_city_camera_position(context.scene)
+		self._thread = threading.Thread(target=self.__generate)
+		self._thread.daemon = True
+		self._thread.start()
+		
+		wm = context.window_manager
+		wm.progress_begin(0, 100)
+		self._timer = wm.event_timer_add(0.1, context.window)
+		wm.modal_handler_add(self)
+		return { 'RUNNING_MODAL' }
+	
+	def __report_terrain(self, cit):
+		self.report({'INFO'}, "Terrain mesh has {} triangles, dense grid has {}".format(*cit.terrain.triangle_counts))
+	
+	def __set_progress(self, stage, fraction):
+		self._progress = (stage, fraction)
+	
+	def __generate(self):
+		try:
+			self._city.generate()
+			# In lazy mode, also generate the visible cells here, and not on the main thread
+			self._city.generate_visible(self._camera_position)
+		except Exception as error:
+			self._error = error
+	
+	def __finish(self, context):
+		wm = context.window_manager
+		wm.event_timer_remove(self._timer)
+		wm.progress_end()
+		if context.area is not None:
+			context.area.header_text_set()
+	
+	def __show_progress(self, context, text, fraction):
+		context.window_manager.progress_update(int(100 * fraction))
+		if context.area is not None:
+			context.area.header_text_set("{} ({:d}%), Esc to cancel".format(text, int(100 * fraction)))
+	
+	def modal(self, context, event):
+		if event.type == 'ESC':
+			# Generation thread stops at its next progress report. Objects created so far are kept.
+			self._city.cancel_requested = True
+			self.__finish(context)
+			self.report({'WARNING'}, "City generation cancelled")
+			return { 'CANCELLED' }
+		if event.type != 'TIMER':
+			return { 'PASS_THROUGH' }
+		
+		# Generation
+		if self._thread.is_alive():
+			stage, fraction = self._progress
+			if stage is not None:
+				i = self.generation_stages.index(stage)
+				fraction = (i + fraction) / len(self.generation_stages)
+				self.__show_progress(context, "Generating " + stage, self.generation_share * fraction)
+			return { 'RUNNING_MODAL' }
+		if self._error is not None:
+			self.__finish(context)
+			self.report({'ERROR'}, "City generation failed: " + str(self._error))
+			return { 'CANCELLED' }
+		
+		# Blender objects
+		scene = context.scene
+		if self._objects is None:
+			self._objects = self._city.iter_create_blender_object(scene.city_name, self._camera_position)
+		end_time = time.time() + self.step_duration
+		while time.time() < end_time:
+			try:
+				root, fraction = next(self._objects)
+			except StopIteration:
+				self.__finish(context)
+				cities[self._root.name] = self._city
+				self.__report_terrain(self._city)
+				return { 'FINISHED' }
+			if self._root is None:
+				root.scale = (city_scale, city_scale, city_scale)
+				scene.objects.link(root)
+				self._root = root
+		self.__show_progress(context, "Creating objects", self.generation_share + (1.0 - self.generation_share) * fraction)
+		return { 'RUNNING_MODAL' }
+
+
+class OBJECT_OT_UpdateCityLOD(bpy.types.Operator):
+	bl_idname = 'city.update_lod'
+	bl_label = "Update LOD"
+	bl_description = "Set level of detail of city cells for current camera position."
+	
+	def execute(self, context):
+		scene = context.scene
+		cit = cities.get(scene.city_name)
+		city_root = bpy.data.objects.get(scene.city_name)
+		if (cit is None) or (city_root is None):
+			self.report({'WARNING'}, "City was not generated in this session")
+			return { 'CANCELLED' }
+		
+		camera = camera_position(scene, city_root) if scene.use_lod else None
+		cit.update_lod(camera)
+		return { 'FINISHED' }
 
 
 class OBJECT_OT_DeleteCity(bpy.types.Operator):
@@ -167,14 +408,11 @@ class OBJECT_OT_DeleteCity(bpy.types.Operator):
 	bl_description = "Delete city with the given name."
 	
 	def execute(self, context):
-		if context.scene.city_name in bpy.data.objects:
-			city = bpy.data.objects.get(context.scene.city_name)
-			bpy.ops.object.select_all(action='DESELECT')
-			bpy.context.scene.objects.active = city
-			city.select = True
-			bpy.ops.object.select_grouped(type='CHILDREN_RECURSIVE', extend=True)
-			#bpy.ops.object.select_hierarchy(direction='CHILD', extend=True)
-			bpy.ops.object.delete(use_global=False)
+		cities.pop(context.scene.city_name, None)
+		city_root = bpy.data.objects.get(context.scene.city_name)
+		if city_root is not None:
+			objects, datablocks = assets.delete_hierarchy(city_root)
+			self.report({'INFO'}, "Deleted {} objects and {} data blocks".format(objects, datablocks))
 		
 		return { 'FINISHED' }
 
@@ -1,6 +1,11 @@
 import os
-import bpy
 import random
+import numpy as np
+
+try:
+	import bpy
+except ImportError:
+	bpy = None # Outside Blender: the functions creating Blender data cannot be used
 
 def load_assets_library(link):
 	lib = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets.blend')
@@ -30,3 +35,139 @@ def choose_random_texture(dir):
 	while (file is None) or (file[0] == '.'):
 		file = random.choice(files)
 	return dir + '/' + file
+
+def create_mesh(name, vertices, face_offsets, face_indices):
+	"""Create Blender mesh from flat buffers, as produced by util.pack_meshes()."""
+	mesh = bpy.data.meshes.new(name)
+	mesh.vertices.add(len(vertices))
+	mesh.vertices.foreach_set('co', np.asarray(vertices, dtype=np.float32).ravel())
+	mesh.loops.add(len(face_indices))
+	mesh.loops.foreach_set('vertex_index', np.asarray(face_indices, dtype=np.int32))
+	mesh.polygons.add(len(face_offsets) - 1)
+	mesh.polygons.foreach_set('loop_start', np.asarray(face_offsets[:-1], dtype=np.int32))
+	mesh.polygons.foreach_set('loop_total', np.diff(face_offsets).astype(np.int32))
+	mesh.update(calc_edges=True)
+	return mesh
+
+
+def create_curve(name, polylines):
+	"""Create Blender curve with one poly spline for each polyline, given as (n, 3) points."""
+	curve = bpy.data.curves.new(name=name, type='CURVE')
+	curve.dimensions = '3D'
+	for points in polylines:
+		polyline = curve.splines.new('POLY')
+		polyline.points.add(len(points) - 1)
+		co = np.ones((len(points), 4), dtype=np.float32)
+		co[:, 0:3] = points
+		polyline.points.foreach_set('co', co.ravel())
+	return curve
+
+
+def get_material(name, color):
+	"""Plain material with given diffuse color, created on first use."""
+	if name in bpy.data.materials:
+		return bpy.data.materials[name]
+	mat = bpy.data.materials.new(name)
+	mat.diffuse_color = color
+	mat.specular_intensity = 0.0
+	return mat
+
+
+def get_textured_material(name, color, texture_name):
+	"""Material with given diffuse color, mixed with image texture mapped by UV coordinates. Created on first use."""
+	if name in bpy.data.materials:
+		return bpy.data.materials[name]
+	mat = get_material(name, color)
+	mtex = mat.texture_slots.add()
+	mtex.texture = load_texture(texture_name)
+	mtex.texture_coords = 'UV'
+	mtex.use_map_color_diffuse = True
+	mtex.diffuse_color_factor = 0.6
+	return mat
+
+
+def set_uvs(mesh, uvs):
+	"""Add UV layer to mesh, with one (u, v) pair per loop."""
+	mesh.uv_textures.new()
+	mesh.uv_layers[-1].data.foreach_set('uv', np.asarray(uvs, dtype=np.float32).ravel())
+
+
+def set_hidden(obj, hidden):
+	"""Hide or show object and all its descendants, in viewport and render."""
+	obj.hide = hidden
+	obj.hide_render = hidden
+	for child in obj.children:
+		set_hidden(child, hidden)
+
+
+
+def _data_collection(datablock):
+	"""Collection of bpy.data which datablock belongs to, or None for types not created by the city generator."""
+	for data_type, collection in (
+		(bpy.types.Mesh, bpy.data.meshes),
+		(bpy.types.Curve, bpy.data.curves),
+		(bpy.types.Material, bpy.data.materials),
+		(bpy.types.Texture, bpy.data.textures),
+		(bpy.types.Image, bpy.data.images)
+	):
+		if isinstance(datablock, data_type):
+			return collection
+	return None
+
+def _dependencies(datablock):
+	"""Datablocks used by datablock: materials of meshes and curves, textures of materials, images of textures."""
+	if isinstance(datablock, (bpy.types.Mesh, bpy.types.Curve)):
+		return [mat for mat in datablock.materials if mat is not None]
+	elif isinstance(datablock, bpy.types.Material):
+		return [slot.texture for slot in datablock.texture_slots if (slot is not None) and (slot.texture is not None)]
+	elif isinstance(datablock, bpy.types.Texture):
+		image = getattr(datablock, 'image', None)
+		return [image] if image is not None else []
+	return []
+
+def delete_hierarchy(root):
+	"""Delete root object and all its descendants, and the datablocks that are no longer used after that.
+	
+	Objects and datablocks are removed directly through bpy.data, without operators. Datablocks that are still
+	used elsewhere (shared meshes, linked assets) are kept. Returns (number of objects, number of datablocks) freed."""
+	# Children of each object, in one pass (Object.children scans all objects on each call)
+	children = dict()
+	for obj in bpy.data.objects:
+		if obj.parent is not None:
+			children.setdefault(obj.parent.name, []).append(obj)
+	
+	objects = []
+	stack = [root]
+	while stack:
+		obj = stack.pop()
+		objects.append(obj)
+		stack.extend(children.get(obj.name, ()))
+	
+	# Datablocks to check, each added once. Keys are taken before anything gets removed.
+	candidates = []
+	seen = set()
+	def add_candidates(datablocks):
+		for datablock in datablocks:
+			if datablock.as_pointer() not in seen:
+				seen.add(datablock.as_pointer())
+				candidates.append(datablock)
+	add_candidates(obj.data for obj in objects if obj.data is not None)
+	
+	for obj in objects:
+		bpy.data.objects.remove(obj, do_unlink=True)
+	
+	# Remove unused datablocks, then the ones they were the last user of
+	freed = 0
+	while candidates:
+		datablock = candidates.pop()
+		if (datablock.users > 0) or (datablock.library is not None):
+			continue
+		collection = _data_collection(datablock)
+		if collection is None:
+			continue
+		dependencies = _dependencies(datablock)
+		collection.remove(datablock)
+		freed += 1
+		add_candidates(dependencies)
+	
+	return (len(objects), freed)
@@ -0,0 +1,206 @@
+"""Headless generation of many cities, for example for datasets.
+
+Generates one city for each combination of the given parameters, across a process pool, and writes each to a
+file in binary city format (see cityfile). The file names contain all parameters of the city, and manifest.json in
+the output directory maps each file name to its parameters, and to the error if generation failed. Needs a Python in which bpy can be imported, e.g. Blender built as
+Python module. Usage:
+	python -m city_generator.batch --seeds 0-99 --intersections 25,40 --urbanization 0.3,0.6 --output cities/
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None # Not on Windows: memory limit is not applied
+
+from . import city, cityfile
+
+stages = ('terrain', 'roads', 'cells', 'network', 'write')
+
+
+def parse_list(text, type=float):
+	"""List of values from comma separated text. Integer ranges can be given as a-b (inclusive)."""
+	values = []
+	for item in text.split(','):
+		if (type is int) and ('-' in item[1:]):
+			first, last = item.rsplit('-', 1)
+			values.extend(range(int(first), int(last) + 1))
+		else:
+			values.append(type(item))
+	return values
+
+
+class Job(object):
+	"""Parameters of one city to generate."""
+	seed = None
+	intersections = None
+	urbanization = None
+	side_length = None
+	elevation = None
+	resolution = None
+	roughness = None
+	path = None # Output file
+
+	def __init__(self, seed, intersections, urbanization, side_length, elevation, resolution, roughness, output):
+		self.seed = seed
+		self.intersections = intersections
+		self.urbanization = urbanization
+		self.side_length = side_length
+		self.elevation = elevation
+		self.resolution = resolution
+		self.roughness = roughness
+		name = 'city_s{}_i{}_u{}_l{}_e{}_r{}_g{}.city'.format(seed, intersections, urbanization, side_length, elevation,
+			resolution, roughness)
+		self.path = os.path.join(output, name)
+	
+	def parameters(self):
+		"""Parameters as dict, for the manifest."""
+		return {
+			'seed': self.seed,
+			'intersections': self.intersections,
+			'urbanization': self.urbanization,
+			'terrain_size': self.side_length,
+			'terrain_elevation': self.elevation,
+			'terrain_resolution': self.resolution,
+			'terrain_roughness': self.roughness
+		}
+
+	def create_city(self):
+		cit = city.City()
+		cit.seed = self.seed
+		cit.approximate_number_of_intersection_points = self.intersections
+		cit.urbanization = self.urbanization
+		cit.terrain.side_length = self.side_length
+		cit.terrain.elevation = self.elevation
+		cit.terrain.resolution = self.resolution
+		cit.terrain.roughness = self.roughness
+		return cit
+
+
+def jobs_for_grid(args):
+	"""Job for each combination of the parameter lists in parsed command line arguments."""
+	grid = itertools.product(
+		parse_list(args.seeds, int),
+		parse_list(args.intersections, int),
+		parse_list(args.urbanization),
+		parse_list(args.terrain_size),
+		parse_list(args.terrain_elevation),
+		parse_list(args.terrain_resolution, int),
+		parse_list(args.terrain_roughness)
+	)
+	return [Job(*(parameters + (args.output,))) for parameters in grid]
+
+
+def _limit_memory(megabytes):
+	"""Pool worker initializer: limit address space of the worker process."""
+	if (resource is not None) and (megabytes > 0):
+		limit = megabytes * 1024 * 1024
+		resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _remove_partial_file(job):
+	if os.path.exists(job.path):
+		os.remove(job.path)
+
+
+def run_job(job):
+	"""Generate and write city for job, streaming the cells to the file. Returns (job, stage times dict, error).
+	
+	If generation fails, the partially written file is removed."""
+	times = dict()
+	current = [None, time.time()] # Current stage, and time it started
+	def enter_stage(stage, fraction=0.0):
+		if stage != current[0]:
+			now = time.time()
+			if current[0] is not None:
+				times[current[0]] = times.get(current[0], 0.0) + now - current[1]
+			current[:] = [stage, now]
+	
+	try:
+		cit = job.create_city()
+		cit.progress_callback = enter_stage
+		with cityfile.CityWriter(job.path) as writer:
+			for event in cit.iter_generate(flush=True):
+				if event.type == 'cell':
+					writer.write_cell(event.component)
+				elif event.type == 'terrain_final':
+					writer.write_terrain(event.component)
+			enter_stage('write')
+			writer.write_city_metadata(cit)
+			writer.write_primary_roads(cit)
+		enter_stage(None)
+		return (job, times, None)
+	except MemoryError:
+		_remove_partial_file(job)
+		return (job, times, "out of memory")
+	except Exception as error:
+		_remove_partial_file(job)
+		return (job, times, repr(error))
+
+
+def write_manifest(path, results):
+	"""Write JSON file mapping the file name of each job to its parameters, given list of (job, error)."""
+	manifest = dict()
+	for job, error in results:
+		entry = job.parameters()
+		entry['error'] = error
+		manifest[os.path.basename(job.path)] = entry
+	with open(path, 'w') as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Generate cities for all combinations of the given parameters.")
+	parser.add_argument('--seeds', default='0-9', help="Seeds, e.g. 0-99 or 1,5,7")
+	parser.add_argument('--intersections', default='25', help="Approximate numbers of primary road intersections")
+	parser.add_argument('--urbanization', default='0.5', help="Urbanization values in [0, 1]")
+	parser.add_argument('--terrain-size', default='1000.0', help="Terrain side lengths")
+	parser.add_argument('--terrain-elevation', default='10.0', help="Terrain elevation multipliers")
+	parser.add_argument('--terrain-resolution', default='7', help="Terrain resolutions (2^n + 1 pixels)")
+	parser.add_argument('--terrain-roughness', default='0.6', help="Terrain roughness values")
+	parser.add_argument('--output', default='cities', help="Output directory")
+	parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+	parser.add_argument('--memory-limit', type=int, default=0, help="Address space limit per worker in MB, 0 for none")
+	args = parser.parse_args(argv)
+	
+	jobs = jobs_for_grid(args)
+	if not os.path.isdir(args.output):
+		os.makedirs(args.output)
+	
+	# One job per worker process, so that the memory limit holds for each job and memory is returned after it
+	pool = multiprocessing.Pool(args.processes, _limit_memory, (args.memory_limit,), maxtasksperchild=1)
+	start_time = time.time()
+	totals = dict()
+	succeeded = 0
+	results = []
+	try:
+		for job, times, error in pool.imap_unordered(run_job, jobs):
+			results.append( (job, error) )
+			breakdown = ', '.join('{} {:.2f}s'.format(stage, times[stage]) for stage in stages if stage in times)
+			if error is None:
+				succeeded += 1
+				for stage, duration in times.items():
+					totals[stage] = totals.get(stage, 0.0) + duration
+				print("{}: {}".format(job.path, breakdown))
+			else:
+				print("{}: failed ({})".format(job.path, error))
+			sys.stdout.flush()
+	finally:
+		pool.close()
+		pool.join()
+		write_manifest(os.path.join(args.output, 'manifest.json'), results)
+	
+	elapsed = time.time() - start_time
+	print("{} of {} cities in {:.1f}s, {:.1f} cities/min".format(succeeded, len(jobs), elapsed, 60.0 * succeeded / max(elapsed, 1e-9)))
+	if succeeded > 0:
+		print("Mean stage times: " + ', '.join('{} {:.2f}s'.format(stage, totals[stage] / succeeded) for stage in stages if stage in totals))
+
+
+if __name__ == '__main__':
+	main()
@@ -3,9 +3,19 @@ import random
 import math
 import bpy
 import networkx as nx
+import multiprocessing
 
 from . import util, building
 
+def _rectangle_size(edges):
+	"""Side lengths (w, h) of near-rectangle with given 4 edges: mean distances between opposite edges."""
+	sizes = []
+	for e, f in ((edges[0], edges[2]), (edges[1], edges[3])):
+		sizes.append((util.line_to_point_distance(e, f[0]) + util.line_to_point_distance(e, f[1]) \
+			+ util.line_to_point_distance(f, e[0]) + util.line_to_point_distance(f, e[1])) / 4.0)
+	return tuple(sizes)
+
+
 class Lot(object):
 	city_cell = None
 	city = None
@@ -32,14 +42,9 @@ class Lot(object):
 	
 	def rectangle_pose(self):
 		edges = list(self.outline.edges_iter())
-		e, f = (edges[0], edges[2])
-		w = (util.line_to_point_distance(e, f[0]) + util.line_to_point_distance(e, f[1]) \
-			+ util.line_to_point_distance(f, e[0]) + util.line_to_point_distance(f, e[1])) / 4.0
+		e = edges[0]
 		rotation = math.atan2(e[1][1] - e[0][1], e[1][0] - e[0][0]) + np.pi
-		
-		e, f = (edges[1], edges[3])
-		h = (util.line_to_point_distance(e, f[0]) + util.line_to_point_distance(e, f[1]) \
-			+ util.line_to_point_distance(f, e[0]) + util.line_to_point_distance(f, e[1])) / 4.0
+		w, h = _rectangle_size(edges)
 		
 		position = (0.0, 0.0)
 		for x, y in self.outline.vertices_iter():
@@ -51,9 +56,18 @@ class Lot(object):
 	
 		return (w, h), position, rotation
 	
+	def footprint_size(self, dist):
+		"""Side lengths (w, h) of the near-rectangular lot contracted by dist, measured as in rectangle_pose()."""
+		footprint = self.outline.clone()
+		footprint.contract(dist)
+		# Contracted vertex i is the corner at outline vertex i+1
+		vertices = footprint.vertices[-1:] + footprint.vertices[:-1]
+		return _rectangle_size(list(util.Polygon(vertices).edges_iter()))
+	
 	
 	def generate(self):
 		if not self.outline.is_simple():
+			self.city.metrics.count('lots_not_simple')
 			return
 	
 		building_types = self.city_cell.building_types[:]
@@ -67,6 +81,7 @@ class Lot(object):
 		self.building = Class(self) 
 		
 		self.building.generate()
+		self.city.metrics.count('buildings')
 	
 	def create_blender_object(self, parent, name):
 		if self.building is not None:
@@ -93,47 +108,59 @@ class Block(object):
 		self.sidewalk_width = self.city_cell.sidewalk_width
 			
 	
-	def __split_lot_recursive(self, lot, outer_edges, depth):
+	def __split_lots(self):
+		"""Subdivide contracted cycle into lots, using an explicit work stack.
+		
+		Each stack entry holds a polygon with one bool per edge, telling whether the edge (from vertex i to
+		vertex i+1) lies on the outline of the block, i.e. is adjacent to a road. Entries are processed in
+		depth-first order, first half before second half."""
 		max_iterations = 20
-		minimal_area = 100
-		minimal_ratio = 0.3
+		min_lot_area, max_lot_area = self.city_cell.lot_area_range
+		metrics = self.city_cell.city.metrics
 	
 		vec = lambda edge: (edge[1][0] - edge[0][0], edge[1][1] - edge[0][1])
-	
-		edges = list(lot.edges_iter())
-
-		# Drop this lot if it is not adjacent to road
-		locked_in = True
-		for edge in edges:
-			if edge in outer_edges:
-				locked_in = False
-				break
+		center = lambda edge: ((edge[0][0] + edge[1][0])/2.0, (edge[0][1] + edge[1][1])/2.0)
+
+		def angle(edge_pair):
+			e1, e2 = edge_pair
+			v1, v2 = vec(e1), vec(e2)
+			dot = v1[0]*v2[0] + v1[1]*v2[1]
+			dot /= (util.distance(*e1) * util.distance(*e2))
+			return np.arccos(dot)
 		
-		if locked_in or lot.area() < self.city_cell.lot_area_range[0]:
-			return
-		elif lot.area() < self.city_cell.lot_area_range[1] and lot.is_simple():
-			def angle(edge_pair):
-				e1, e2 = edge_pair
-				v1, v2 = vec(e1), vec(e2)
-				dot = v1[0]*v2[0] + v1[1]*v2[1]
-				dot /= (util.distance(*e1) * util.distance(*e2))
-				return np.arccos(dot)
+		cycle = self.contracted_cycle
+		stack = [ (cycle, [True] * len(cycle), 1) ]
+		while stack:
+			lot, outer, depth = stack.pop()
+			
+			# Drop this lot if it is not adjacent to road
+			if not any(outer):
+				metrics.count('lots_dropped_not_on_road')
+				continue
+			
+			area = lot.area()
+			if area < min_lot_area:
+				metrics.count('lots_dropped_too_small')
+				continue
+			
+			edges = list(lot.edges_iter())
+			if area < max_lot_area and lot.is_simple():
+				if min(angle(pair) for pair in util.cycle_pairs(edges)) > 0.3*np.pi:
+					lot_outer = [edge for edge, is_outer in zip(edges, outer) if is_outer]
+					self.lots.append(Lot(self.city_cell, lot, lot_outer))
+				else:
+					metrics.count('lots_dropped_acute')
+				continue
+			
+			if lot.number_of_vertices() < 3 or depth > max_iterations:
+				metrics.count('lots_dropped_max_iterations')
+				continue
 			
-			min_angle = min(util.cycle_pairs(edges), key=angle)
-			if angle(min_angle) > 0.3*np.pi:
-				lot_outer = [edge for edge in edges if (edge in outer_edges)]
-				lot_obj = Lot(self.city_cell, lot, lot_outer)
-				self.lots.append(lot_obj)
-				
-		elif lot.number_of_vertices() >= 3 and depth <= max_iterations:
 			# Cutting the lot in two...
 			# First choose 2 edges to cut through
-			last_i = len(edges) - 1
-		
 			# First = longest
 			length = lambda i: util.distance_sq(*edges[i])
 			longest_i = max(range(len(lot)), key=length)
-			longest_j = longest_i + 1 if longest_i != last_i else 0
 			longest_edge = edges[longest_i]
 			longest_edge_vec = vec(longest_edge)
 			longest_edge_len = util.distance(*longest_edge)
@@ -151,58 +178,25 @@ class Block(object):
 					
 			other_is = [i for i in range(len(edges)) if i != longest_i]
 			opposed_i = max(other_is, key=parallelity)
-			opposed_j = opposed_i + 1 if opposed_i != last_i else 0
 
 			# Cut edges at center point
-			longest_edge = edges[longest_i]
-			opposed_edge = edges[opposed_i]
-			center = lambda edge: ((edge[0][0] + edge[1][0])/2.0, (edge[0][1] + edge[1][1])/2.0)
-			longest_p = center(longest_edge)
-			opposed_p = center(opposed_edge)
-			
-			# Adjust outer_edges
-			if longest_edge in outer_edges:
-				outer_edges.remove(longest_edge)
-				outer_edges.append( (lot[longest_i], longest_p) )
-				outer_edges.append( (longest_p, lot[longest_j]) )
-			if opposed_edge in outer_edges:
-				outer_edges.remove(opposed_edge)
-				outer_edges.append( (lot[opposed_i], opposed_p) )
-				outer_edges.append( (opposed_p, lot[opposed_j]) )
-
-			# Create two halves of lot
-			sublot1 = []
-			sublot2 = []
-			if longest_i < opposed_i:
-				first_i, first_p = longest_i, longest_p
-				second_i, second_p = opposed_i, opposed_p
-			else:
-				first_i, first_p = opposed_i, opposed_p
-				second_i, second_p = longest_i, longest_p
-
-			n = len(lot)
-			sublot1.append(second_p)
-			for i in range(second_i + 1, n):
-				sublot1.append(lot[i])
-			for i in range(0, first_i + 1):
-				sublot1.append(lot[i])
-			sublot1.append(first_p)
-			
-			sublot2.append(first_p)
-			for i in range(first_i + 1, second_i + 1):
-				sublot2.append(lot[i])
-			sublot2.append(second_p)
+			first_i, second_i = min(longest_i, opposed_i), max(longest_i, opposed_i)
+			first_p, second_p = center(edges[first_i]), center(edges[second_i])
 
+			# Create two halves of lot. Halves of the cut edges keep their flag, the cut itself is inner.
+			vertices = lot.vertices
+			sublot1 = [second_p] + vertices[second_i+1:] + vertices[:first_i+1] + [first_p]
+			outer1 = [outer[second_i]] + outer[second_i+1:] + outer[:first_i] + [outer[first_i], False]
+			sublot2 = [first_p] + vertices[first_i+1:second_i+1] + [second_p]
+			outer2 = [outer[first_i]] + outer[first_i+1:second_i] + [outer[second_i], False]
 
-			# Recurse into two lots
-			self.__split_lot_recursive(util.Polygon(sublot1), outer_edges[:], depth + 1)
-			self.__split_lot_recursive(util.Polygon(sublot2), outer_edges[:], depth + 1)
+			stack.append( (util.Polygon(sublot2), outer2, depth + 1) )
+			stack.append( (util.Polygon(sublot1), outer1, depth + 1) )
 	
 	
 	def __make_lots(self):
-		self.lots = []		
-		outer_edges = list(self.contracted_cycle.edges_iter())
-		self.__split_lot_recursive(self.contracted_cycle, outer_edges, 1)
+		self.lots = []
+		self.__split_lots()
 
 	def __create_blender_outline(self, root, cyc):
 		if len(self.cycle) < 2:
@@ -227,8 +221,12 @@ class Block(object):
 
 
 	def generate(self):
+		metrics = self.city_cell.city.metrics
+		metrics.count('blocks')
 		if self.cycle.area() <= self.city_cell.lot_area_range[0]:
 			self.valid = False
+			metrics.count('blocks_invalid')
+			metrics.count('blocks_too_small')
 			return
 		
 		self.contracted_cycle = self.cycle.clone()
@@ -240,9 +238,11 @@ class Block(object):
 			and self.contracted_cycle.area() > self.city_cell.lot_area_range[0]
 		
 		if not self.valid:
+			metrics.count('blocks_invalid')
 			return
 			
 		self.__make_lots()
+		metrics.count('lots', len(self.lots))
 		for lot in self.lots:
 			lot.generate()
 
@@ -260,4 +260,152 @@ class Block(object):
 		for lot in self.lots:
 			lot.create_blender_object(parent, 'lot_'+str(i))
 			i += 1
-		
+
+
+
+def _generate_block(city_cell, cycle, seed):
+	block = Block(city_cell, util.Polygon(cycle))
+	random.seed(seed)
+	block.generate()
+	return block
+
+
+building_types = ('Skyscraper', 'Office', 'House') # Building classes, by index in packed blocks
+
+
+def pack_blocks(blocks):
+	"""Generated blocks, with their lots and the parameters of their buildings, as dict name -> array.
+	
+	Block polygons, lot outlines and skyscraper tiers are packed as in util.pack_sequences(). Lot i has one
+	lot_outer flag per edge, telling whether it is one of its outer_edges. Buildings are given by their type
+	(index in building_types, -1 for none), rectangle pose (w, h, x, y, rotation), height, roof height and
+	iterations, with NaN (-1 for ints) where unset. Meshes are not included: see unpack_blocks()."""
+	lots = [lot for block in blocks if block.lots is not None for lot in block.lots]
+	buildings = [lot.building for lot in lots]
+	arrays = dict()
+	arrays['valid'] = np.array([block.valid for block in blocks], dtype=bool)
+	arrays['contracted'] = np.array([block.contracted_cycle is not None for block in blocks], dtype=bool)
+	arrays['contracted_offsets'], arrays['contracted_cycles'] = util.pack_sequences(
+		[block.contracted_cycle.vertices for block in blocks if block.contracted_cycle is not None])
+	arrays['lot_counts'] = np.array([len(block.lots) if block.lots is not None else 0 for block in blocks], dtype=np.int64)
+	arrays['lot_offsets'], arrays['lot_outlines'] = util.pack_sequences([lot.outline.vertices for lot in lots])
+	outer = []
+	for lot in lots:
+		# outer_edges are a subsequence of the outline edges
+		k = 0
+		for edge in lot.outline.edges_iter():
+			is_outer = (k < len(lot.outer_edges)) and (edge == lot.outer_edges[k])
+			outer.append(is_outer)
+			k += is_outer
+	arrays['lot_outer'] = np.array(outer, dtype=bool)
+	
+	value = lambda building, name: getattr(building, name, None) if building is not None else None
+	number = lambda x: float('nan') if x is None else x
+	poses = [value(building, 'rectangle_pose') for building in buildings]
+	arrays['building_type'] = np.array([building_types.index(type(building).__name__) if building is not None else -1
+		for building in buildings], dtype=np.int8)
+	arrays['rectangle_pose'] = np.array([pose[0] + pose[1] + (pose[2],) if pose is not None else (np.nan,) * 5
+		for pose in poses], dtype=float).reshape(-1, 5)
+	arrays['height'] = np.array([number(value(building, 'height')) for building in buildings], dtype=float)
+	arrays['roof_height'] = np.array([number(value(building, 'roof_height')) for building in buildings], dtype=float)
+	arrays['iterations'] = np.array([value(building, 'iterations') or -1 for building in buildings], dtype=np.int64)
+	arrays['prototype'] = np.array([value(building, 'prototype') is not None for building in buildings], dtype=bool)
+	tiers = [value(building, 'tiers') for building in buildings]
+	arrays['tier_offsets'], arrays['tiers'] = util.pack_sequences(
+		[np.column_stack(t) if t is not None else [] for t in tiers], dimensions=5)
+	return arrays
+
+
+def unpack_blocks(city_cell, cycles, arrays):
+	"""Blocks of city_cell for given cycles, from the arrays of the generated blocks given by pack_blocks().
+	
+	Buildings which are instances of a prototype get its meshes from the city's PrototypeLibrary, which creates
+	them if needed. Other buildings get their geometry from building.generate_batches(), as usual."""
+	library = city_cell.city.building_prototypes
+	contracted = iter(util.unpack_sequences(arrays['contracted_offsets'], arrays['contracted_cycles'].tolist()))
+	lot_outlines = util.unpack_sequences(arrays['lot_offsets'], arrays['lot_outlines'].tolist())
+	lot_outer = util.unpack_sequences(arrays['lot_offsets'], arrays['lot_outer'].tolist())
+	tiers = util.unpack_sequences(arrays['tier_offsets'], arrays['tiers'])
+	poses = arrays['rectangle_pose'].tolist()
+	number = lambda x: None if math.isnan(x) else float(x)
+	
+	lot_starts = np.cumsum(arrays['lot_counts']) - arrays['lot_counts']
+	blocks = []
+	for cycle, valid, has_contracted, start, count in zip(cycles, arrays['valid'].tolist(),
+		arrays['contracted'].tolist(), lot_starts.tolist(), arrays['lot_counts'].tolist()):
+		block = Block(city_cell, util.Polygon(cycle))
+		block.valid = valid
+		if has_contracted:
+			block.contracted_cycle = util.Polygon([tuple(p) for p in next(contracted)])
+		if valid:
+			block.lots = []
+		for i in range(start, start + count):
+			outline = util.Polygon([tuple(p) for p in lot_outlines[i]])
+			outer_edges = [edge for edge, is_outer in zip(outline.edges_iter(), lot_outer[i]) if is_outer]
+			lot = Lot(city_cell, outline, outer_edges)
+			block.lots.append(lot)
+			if arrays['building_type'][i] < 0:
+				continue
+			Class = getattr(building, building_types[arrays['building_type'][i]])
+			lot.building = Class(lot)
+			w, h, x, y, rotation = poses[i]
+			if not math.isnan(w):
+				lot.building.rectangle_pose = ((w, h), (x, y), rotation)
+			lot.building.height = number(arrays['height'][i])
+			if Class is building.Skyscraper:
+				if lot.building.height is not None:
+					lot.building.iterations = int(arrays['iterations'][i])
+					lot.building.tiers = (tiers[i][:, 0:2], tiers[i][:, 2:4], tiers[i][:, 4])
+			else:
+				lot.building.roof_height = number(arrays['roof_height'][i])
+				if arrays['prototype'][i]:
+					lot.building.make_instance(library)
+		blocks.append(block)
+	return blocks
+
+
+# Inputs of generate_blocks() for worker processes, which inherit them when forked
+_worker_inputs = None
+
+def _generate_blocks_in_worker(chunk):
+	"""Generate the blocks with given indices in worker process.
+	
+	Returns their arrays from pack_blocks(), and the counts added to the city metrics."""
+	city_cell, cycles, seeds = _worker_inputs
+	metrics = city_cell.city.metrics
+	counters = metrics.as_dict()
+	blocks = [_generate_block(city_cell, cycles[i], seeds[i]) for i in chunk]
+	return (pack_blocks(blocks), metrics.difference(counters))
+
+
+def generate_blocks(city_cell, cycles, workers=1):
+	"""Create and generate one Block for each cycle of city_cell. Returns list of blocks.
+	
+	Each block is generated with its own seed, drawn from the random generator beforehand. So the result
+	does not depend on the number of workers. With workers > 1, blocks are generated in that many forked
+	processes, in one contiguous chunk each. Each chunk is sent back as the compact arrays of pack_blocks(), from which
+	the blocks are rebuilt here. The counts added to the city metrics in the workers are added to the city."""
+	global _worker_inputs
+	
+	seeds = [random.getrandbits(32) for cycle in cycles]
+	state = random.getstate()
+	
+	parallel = (workers > 1) and (len(cycles) > 1) and ('fork' in multiprocessing.get_all_start_methods())
+	if parallel:
+		workers = min(workers, len(cycles))
+		chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(cycles)), workers) if len(chunk) > 0]
+		_worker_inputs = (city_cell, cycles, seeds)
+		try:
+			with multiprocessing.get_context('fork').Pool(workers) as pool:
+				results = pool.map(_generate_blocks_in_worker, chunks)
+		finally:
+			_worker_inputs = None
+		blocks = []
+		for chunk, (arrays, counts) in zip(chunks, results):
+			city_cell.city.metrics.add(counts)
+			blocks += unpack_blocks(city_cell, [cycles[i] for i in chunk], arrays)
+	else:
+		blocks = [_generate_block(city_cell, cycle, seed) for cycle, seed in zip(cycles, seeds)]
+	
+	random.setstate(state)
+	return blocks
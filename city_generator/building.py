@@ -1,13 +1,15 @@
 import numpy as np
 import random
 import math
-import bpy
-import networkx as nx
-import bmesh
-
+try:
+	import bpy
+except ImportError:
+	bpy = None # Outside Blender: the functions creating Blender data cannot be used
 
 from . import util, assets
 
+footprint_setback = 2.0 # Distance of building footprints from the lot outline (in m)
+
 def cuboid_without_bottom(x_range, y_range, z_range):
 	vertices = [
 		# Top
@@ -31,10 +33,256 @@ def cuboid_without_bottom(x_range, y_range, z_range):
 	return (vertices, faces)
 
 
+def rectangle(x_size, y_size):
+	"""Polygon for rectangle with given side lengths, centered at origin, with first edge along X axis."""
+	x, y = x_size / 2.0, y_size / 2.0
+	return util.Polygon([(-x, -y), (x, -y), (x, y), (-x, y)])
+
+
+def band_meshes(offsets, lower, upper, lower_z, upper_z, caps_before=(), caps_after=()):
+	"""Meshes made of a band of quads joining two rings of vertices, packed into flat buffers.
+	
+	Ring k has the vertices offsets[k] to offsets[k+1] of the (n, 2) arrays lower and upper, and of the (n,)
+	arrays lower_z and upper_z. Mesh k has the lower ring vertices, followed by the upper ring vertices. Its faces
+	are the caps in caps_before, then one quad for each ring edge, then the caps in caps_after. A cap is
+	'lower' or 'upper', the face closing that ring.
+	Returns (vertices, face_offsets, face_indices, mesh_vertex_offsets, mesh_face_offsets), see BuildingBatch."""
+	offsets = np.asarray(offsets, dtype=np.int64)
+	counts = np.diff(offsets)
+	rings, nxt = util.packed_polygon_successors(offsets)
+	local = np.arange(offsets[-1]) - offsets[rings]
+	
+	# Vertices, lower ring of mesh k starts at 2*offsets[k]
+	lower_i = np.arange(offsets[-1]) + offsets[rings]
+	upper_i = lower_i + counts[rings]
+	vertices = np.empty((2 * offsets[-1], 3))
+	vertices[lower_i, 0:2] = lower
+	vertices[lower_i, 2] = lower_z
+	vertices[upper_i, 0:2] = upper
+	vertices[upper_i, 2] = upper_z
+	
+	# Number of faces and length of each face
+	number_of_caps = (len(caps_before) + len(caps_after)) * (counts > 0)
+	mesh_face_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+	np.cumsum(counts + number_of_caps, out=mesh_face_offsets[1:])
+	first_face = mesh_face_offsets[:-1]
+	cap_faces = [(cap, first_face + c) for c, cap in enumerate(caps_before)]
+	cap_faces += [(cap, first_face + len(caps_before) + counts + c) for c, cap in enumerate(caps_after)]
+	
+	lengths = np.full(mesh_face_offsets[-1], 4, dtype=np.int64)
+	nonempty = (counts > 0)
+	for cap, faces in cap_faces:
+		lengths[faces[nonempty]] = counts[nonempty]
+	face_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+	np.cumsum(lengths, out=face_offsets[1:])
+	
+	# Quads [i, j, j+n, i+n], and caps
+	face_indices = np.empty(face_offsets[-1], dtype=np.int64)
+	quad_starts = face_offsets[first_face[rings] + len(caps_before) + local]
+	face_indices[quad_starts[:, np.newaxis] + np.arange(4)] = \
+		np.stack([lower_i, lower_i[nxt], upper_i[nxt], upper_i], axis=1)
+	for cap, faces in cap_faces:
+		ring_i = lower_i if (cap == 'lower') else upper_i
+		face_indices[face_offsets[faces[rings]] + local] = ring_i
+	
+	return (vertices, face_offsets, face_indices, 2 * offsets, mesh_face_offsets)
+
+
+def concatenate_meshes(parts):
+	"""Concatenate packed mesh buffers from band_meshes() or tower_buffers() into one."""
+	vertices = np.concatenate([part[0] for part in parts])
+	face_offsets, face_indices, mesh_vertex_offsets, mesh_face_offsets = [np.zeros(1, dtype=np.int64)], [], \
+		[np.zeros(1, dtype=np.int64)], [np.zeros(1, dtype=np.int64)]
+	vertex_base, face_base, index_base = 0, 0, 0
+	for part_vertices, part_face_offsets, part_face_indices, part_mesh_vertex_offsets, part_mesh_face_offsets in parts:
+		face_offsets.append(part_face_offsets[1:] + index_base)
+		face_indices.append(part_face_indices + vertex_base)
+		mesh_vertex_offsets.append(part_mesh_vertex_offsets[1:] + vertex_base)
+		mesh_face_offsets.append(part_mesh_face_offsets[1:] + face_base)
+		vertex_base += len(part_vertices)
+		face_base += len(part_face_offsets) - 1
+		index_base += len(part_face_indices)
+	return (vertices, np.concatenate(face_offsets), np.concatenate(face_indices),
+		np.concatenate(mesh_vertex_offsets), np.concatenate(mesh_face_offsets))
+
+
+def _single_mesh(buffers, m=0):
+	"""Mesh m of packed buffers, as (vertices, faces) with faces as list of index lists."""
+	vertices, face_offsets, face_indices, mesh_vertex_offsets, mesh_face_offsets = buffers
+	v0, v1 = mesh_vertex_offsets[m], mesh_vertex_offsets[m+1]
+	offsets = face_offsets[mesh_face_offsets[m]:mesh_face_offsets[m+1]+1]
+	indices = (face_indices - v0).tolist()
+	faces = [indices[offsets[f]:offsets[f+1]] for f in range(len(offsets) - 1)]
+	return ([tuple(v) for v in vertices[v0:v1].tolist()], faces)
+
+
+def office_buffers(offsets, outlines, bottoms, heights):
+	"""Packed meshes of office buildings. Walls from outline with Z coordinates bottoms, to height, and flat roof.
+	
+	offsets, outlines are packed outline polygons in building coordinates, bottoms has one Z coordinate per outline
+	vertex, and heights one per building."""
+	rings = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+	return band_meshes(offsets, outlines, outlines, bottoms, np.asarray(heights)[rings], caps_after=('upper',))
+
+
+def house_buffers(offsets, outlines, bottoms, heights, roof_heights):
+	"""Packed meshes of houses, as (walls, roofs) buffers. Arguments like for office_buffers().
+	
+	The roof base is the outline expanded by 0.3, and its top the roof base shrunk by 30% towards its center."""
+	heights, roof_heights = np.asarray(heights, dtype=float), np.asarray(roof_heights, dtype=float)
+	rings = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+	walls = band_meshes(offsets, outlines, outlines, bottoms, heights[rings])
+	
+	roof_offsets, roof = util.contract_packed_polygons(offsets, outlines, -0.3)
+	roof_rings = np.repeat(np.arange(len(roof_offsets) - 1), np.diff(roof_offsets))
+	centers = util.packed_centers(roof_offsets, roof)
+	r = 0.3
+	roof_top = roof + r * (centers[roof_rings] - roof)
+	roofs = band_meshes(roof_offsets, roof, roof_top, heights[roof_rings], (heights + roof_heights)[roof_rings],
+		caps_before=('lower', 'upper'))
+	return (walls, roofs)
+
+
+def office_mesh(outline, bottom, height):
+	"""Mesh of office building with given outline Polygon, in building coordinates.
+	
+	bottom is list of Z coordinates for the vertices of the outline."""
+	offsets, outlines = util.pack_sequences([outline.vertices])
+	return _single_mesh(office_buffers(offsets, outlines, bottom, [height]))
+
+
+def house_meshes(outline, bottom, height, roof_height):
+	"""Walls and roof meshes of house with given outline Polygon, in building coordinates.
+	
+	bottom is list of Z coordinates for the vertices of the outline."""
+	offsets, outlines = util.pack_sequences([outline.vertices])
+	walls, roofs = house_buffers(offsets, outlines, bottom, [height], [roof_height])
+	return (_single_mesh(walls), _single_mesh(roofs))
+
+
+
+class PrototypeLibrary(object):
+	"""Meshes shared by buildings of same type and same quantized dimensions.
+	
+	Dimensions of buildings on near-rectangular lots are rounded to multiples of step. Then the mesh is generated
+	only once for each distinct combination, and the buildings become instances of it, placed with their own
+	location and rotation. In Blender, all instances share the same mesh data. A step of 0 disables this."""
+	step = 0.0 # Quantization step for building dimensions (in m)
+	meshes = None # Dict prototype key -> list of (vertices, faces) meshes in building coordinates
+	blender_meshes = None # Dict (prototype key, mesh index) -> Blender mesh
+	
+	def __init__(self, step=0.0):
+		self.step = step
+		self.meshes = dict()
+		self.blender_meshes = dict()
+	
+	def enabled(self):
+		return self.step > 0.0
+	
+	def quantize(self, value):
+		"""Value rounded to multiple of step, at least step."""
+		return max(self.step, round(value / self.step) * self.step)
+	
+	def get(self, key, generate):
+		"""Meshes of prototype with given key. generate() creates them if the prototype is new."""
+		if key not in self.meshes:
+			self.meshes[key] = generate()
+		return self.meshes[key]
+	
+	def blender_mesh(self, key, i, name, mesh):
+		"""Blender mesh for mesh i of prototype with given key. Created from (vertices, faces) mesh on first use."""
+		if (key, i) not in self.blender_meshes:
+			vertices, faces = mesh
+			blender_mesh = bpy.data.meshes.new(name)
+			blender_mesh.from_pydata(vertices, [], faces)
+			blender_mesh.update(calc_edges=True)
+			self.blender_meshes[(key, i)] = blender_mesh
+		return self.blender_meshes[(key, i)]
+
+
+
+class BuildingBatch(object):
+	"""Geometry of all buildings of one type in a city cell, packed into one vertex and one index buffer.
+	
+	Mesh m has the vertices mesh_vertex_offsets[m] to mesh_vertex_offsets[m+1], and the faces mesh_face_offsets[m]
+	to mesh_face_offsets[m+1]. Face f has the vertex indices face_indices[face_offsets[f]:face_offsets[f+1]],
+	which refer to the whole vertices array. Building i of buildings has the meshes building_meshes[i]."""
+	type = None # Name of building class
+	buildings = None # List of buildings
+	vertices = None # (n, 3) array, in building coordinates of each building
+	face_offsets = None
+	face_indices = None
+	mesh_vertex_offsets = None
+	mesh_face_offsets = None
+	building_meshes = None # (number of buildings, meshes per building) array of mesh indices
+	
+	def __init__(self, type, buildings, buffers, building_meshes):
+		self.type = type
+		self.buildings = buildings
+		self.vertices, self.face_offsets, self.face_indices, self.mesh_vertex_offsets, self.mesh_face_offsets = buffers
+		self.building_meshes = building_meshes
+		for i, building in enumerate(buildings):
+			building.batch = self
+			building.batch_index = i
+	
+	def mesh_buffers(self, m):
+		"""Mesh m as (vertices, face_offsets, face_indices) views, with indices into its own vertices."""
+		v0, v1 = self.mesh_vertex_offsets[m], self.mesh_vertex_offsets[m+1]
+		face_offsets = self.face_offsets[self.mesh_face_offsets[m]:self.mesh_face_offsets[m+1]+1]
+		face_indices = self.face_indices[face_offsets[0]:face_offsets[-1]] - v0
+		return (self.vertices[v0:v1], face_offsets - face_offsets[0], face_indices)
+	
+	def mesh(self, m):
+		"""Mesh m as (vertices, faces), with faces as list of index arrays."""
+		vertices, face_offsets, face_indices = self.mesh_buffers(m)
+		faces = [face_indices[face_offsets[f]:face_offsets[f+1]] for f in range(len(face_offsets) - 1)]
+		return (vertices, faces)
+	
+	def building_mesh(self, i, k):
+		"""Mesh k of building i, as (vertices, faces)."""
+		return self.mesh(self.building_meshes[i, k])
+	
+	def create_blender_mesh(self, name, i, k):
+		"""Blender mesh for mesh k of building i."""
+		return assets.create_mesh(name, *self.mesh_buffers(self.building_meshes[i, k]))
+
+
+def generate_batches(buildings):
+	"""Batch building stage: generate geometry of given buildings (usually all of one cell), grouped by type.
+	
+	The buildings must have been generated before, which chooses their random parameters. Buildings which are
+	instances of a prototype, or that got no geometry, are skipped. Returns dict type name -> BuildingBatch."""
+	groups = dict()
+	for building in buildings:
+		if (building.prototype is None) and building.has_geometry():
+			groups.setdefault(type(building).__name__, []).append(building)
+	return dict((name, globals()[name].generate_batch(group)) for name, group in groups.items())
+
+
+def _lot_footprints(buildings, dist):
+	"""Outlines of lots of buildings contracted by dist, in building coordinates around the lot center.
+	
+	Returns (centers, offsets, outlines, bottoms), with bottoms the terrain elevations of the outline vertices."""
+	offsets, outlines = util.pack_sequences([building.lot.outline.vertices for building in buildings])
+	centers = util.packed_centers(offsets, outlines)
+	offsets, outlines = util.contract_packed_polygons(offsets, outlines, dist)
+	bottoms = buildings[0].terrain.elevations_at(outlines)
+	rings = np.repeat(np.arange(len(buildings)), np.diff(offsets))
+	outlines -= centers[rings]
+	for i, building in enumerate(buildings):
+		building.center = tuple(centers[i].tolist())
+		building.outline = util.Polygon([tuple(p) for p in outlines[offsets[i]:offsets[i+1]].tolist()])
+	return (centers, offsets, outlines, bottoms)
+
+
+
 class Building(object):
 	lot = None
 	rectangle_pose = None
 	terrain = None
+	prototype = None # Key in city's PrototypeLibrary if building is instance of prototype, else None
+	batch = None # BuildingBatch holding the geometry of the building, if it was generated in a batch
+	batch_index = None # Index of building in its batch
 		
 	def __init__(self, lot):
 		self.lot = lot
@@ -46,67 +294,146 @@ class Building(object):
 	
 	def create_blender_object(self, parent, name='building'):
 		pass
+	
+	def meshes(self):
+		"""Meshes of the building, as list of (vertices, faces) in building coordinates."""
+		return []
+	
+	def has_geometry(self):
+		"""Whether generate_batch() must create meshes for this building."""
+		return False
+	
+	def transform(self):
+		"""Placement of building coordinates in city: (location, rotation around Z axis)."""
+		return ((0.0, 0.0, 0.0), 0.0)
+	
+	def prototypes(self):
+		"""PrototypeLibrary to use for this building, or None if it must get its own meshes."""
+		library = self.lot.city.building_prototypes
+		if (self.rectangle_pose is None) or (library is None) or not library.enabled():
+			return None
+		return library
+	
+	def _create_blender_mesh(self, name, i, mesh):
+		"""Blender mesh for mesh i of the building, shared with other instances of its prototype."""
+		if self.prototype is not None:
+			return self.lot.city.building_prototypes.blender_mesh(self.prototype, i, name, mesh)
+		if self.batch is not None:
+			return self.batch.create_blender_mesh(name, self.batch_index, i)
+		vertices, faces = mesh
+		blender_mesh = bpy.data.meshes.new(name)
+		blender_mesh.from_pydata(vertices, [], faces)
+		blender_mesh.update(calc_edges=True)
+		return blender_mesh
+	
+	def _place_blender_object(self, obj):
+		location, rotation = self.transform()
+		obj.location = location
+		if rotation != 0.0:
+			obj.rotation_mode = 'AXIS_ANGLE'
+			obj.rotation_axis_angle = (rotation, 0.0, 0.0, 1.0)
 
-class Skyscraper(Building):
-	"""Skyscraper-like structure generated from fractal algorithm on rectangular base."""
-	mesh = None
-	height = None
-	iterations = None
+# Faces of one tier of fractal tower. Tier i has vertices 8*i to 8*i+7, as given by cuboid_without_bottom().
+_tower_top_face = np.array([[0, 1, 2, 3]])
+_tower_side_faces = np.array([[0, 3, 7, 4], [1, 2, 6, 5], [3, 2, 6, 7], [0, 1, 5, 4]])
+_tower_joint_faces = np.array([[0, 1, 8+5, 8+4], [1, 2, 8+6, 8+5], [2, 3, 8+7, 8+6], [3, 0, 8+4, 8+7]])
+
+
+def tower_tiers(x_range, y_range, height, iterations):
+	"""Randomly choose the tiers of fractal tower with given base rectangle and height.
 	
-	def __transform(self, box, iterations_left):
-		if iterations_left == 0:
-			return
-			
-		vertices, faces = box
-				
-		x_range = (vertices[0][0], vertices[1][0])
-		x_diff = x_range[1] - x_range[0]
-		y_range = (vertices[0][1], vertices[3][1])
-		y_diff = y_range[1] - y_range[0]
+	Each tier is a cuboid standing on a rectangle chosen on top of the previous one. Returns arrays
+	(x_ranges, y_ranges, bases), each with one row per tier (iterations + 1 tiers)."""
+	x_ranges = np.empty((iterations + 1, 2))
+	y_ranges = np.empty((iterations + 1, 2))
+	bases = np.empty(iterations + 1)
+	x_ranges[0], y_ranges[0], bases[0] = x_range, y_range, 0.0
+	
+	r = 0.1
+	for i in range(iterations):
+		(x0, x1), (y0, y1), base = x_ranges[i], y_ranges[i], bases[i]
+		x_diff, y_diff = x1 - x0, y1 - y0
 		
 		# Choose rectangle on top face
-		r = 0.1
-		x_subrange = (
-			random.uniform(x_range[0], x_range[0] + r*x_diff),
-			random.uniform(x_range[1] - r*x_diff, x_range[1])
-		)
-		y_subrange = (
-			random.uniform(y_range[0], y_range[0] + r*y_diff),
-			random.uniform(y_range[1] - r*y_diff, y_range[1])
-		)
+		x_ranges[i+1] = (random.uniform(x0, x0 + r*x_diff), random.uniform(x1 - r*x_diff, x1))
+		y_ranges[i+1] = (random.uniform(y0, y0 + r*y_diff), random.uniform(y1 - r*y_diff, y1))
 		
-		height = vertices[0][2]
-		base = vertices[4][2]
-		if iterations_left > (self.iterations // 2):
-			new_base = base + random.uniform(0.05, 0.10)*(height - base)
+		if (iterations - i) > (iterations // 2):
+			bases[i+1] = base + random.uniform(0.05, 0.10)*(height - base)
 		else:
-			new_base = base + random.uniform(0.7, 0.85)*(height - base)
+			bases[i+1] = base + random.uniform(0.7, 0.85)*(height - base)
+	return (x_ranges, y_ranges, bases)
+
 
-		# New cuboid which will be recursively modified		
-		new_cuboid = cuboid_without_bottom(x_subrange, y_subrange, (new_base, height))
+def tower_buffers(tier_offsets, x_ranges, y_ranges, bases, heights):
+	"""Packed meshes of fractal towers, from the concatenated tiers of all towers.
+	
+	Tower k has the tiers tier_offsets[k] to tier_offsets[k+1] of the arrays from tower_tiers(), and height
+	heights[k]. Each tier is extruded down to the one below it, and only the top tier keeps its top face.
+	Returns (vertices, face_offsets, face_indices, mesh_vertex_offsets, mesh_face_offsets), see BuildingBatch."""
+	tier_offsets = np.asarray(tier_offsets, dtype=np.int64)
+	counts = np.diff(tier_offsets)
+	towers = np.repeat(np.arange(len(counts)), counts)
+	number_of_tiers = len(bases)
+	is_top = np.zeros(number_of_tiers, dtype=bool)
+	is_top[tier_offsets[1:][counts > 0] - 1] = True
+	tops = np.where(is_top, np.asarray(heights, dtype=float)[towers], np.append(bases[1:], 0.0))
+	
+	# Tier t has vertices 8*t to 8*t+7
+	vertices = np.empty((number_of_tiers, 8, 3))
+	vertices[:, [0, 3, 4, 7], 0] = x_ranges[:, 0:1]
+	vertices[:, [1, 2, 5, 6], 0] = x_ranges[:, 1:2]
+	vertices[:, [0, 1, 4, 5], 1] = y_ranges[:, 0:1]
+	vertices[:, [2, 3, 6, 7], 1] = y_ranges[:, 1:2]
+	vertices[:, 0:4, 2] = tops[:, np.newaxis]
+	vertices[:, 4:8, 2] = bases[:, np.newaxis]
+	
+	# 8 faces for lower tiers, 5 for top tier
+	tier_face_counts = np.where(is_top, 5, 8)
+	tier_first_face = np.cumsum(tier_face_counts) - tier_face_counts
+	faces = np.empty((tier_face_counts.sum(), 4), dtype=np.int64)
+	for selected, tier_faces in (
+		(np.flatnonzero(~is_top), np.concatenate([_tower_side_faces, _tower_joint_faces])),
+		(np.flatnonzero(is_top), np.concatenate([_tower_top_face, _tower_side_faces]))
+	):
+		rows = tier_first_face[selected, np.newaxis] + np.arange(len(tier_faces))
+		faces[rows] = tier_faces[np.newaxis] + 8*selected[:, np.newaxis, np.newaxis]
+	
+	mesh_face_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+	np.cumsum(np.bincount(towers, weights=tier_face_counts, minlength=len(counts)).astype(np.int64),
+		out=mesh_face_offsets[1:])
+	face_offsets = 4 * np.arange(len(faces) + 1, dtype=np.int64)
+	return (vertices.reshape(-1, 3), face_offsets, faces.ravel(), 8 * tier_offsets, mesh_face_offsets)
 
-		# Recursively transform new cuboid
-		self.__transform(new_cuboid, iterations_left - 1)
-		new_vertices, new_faces = new_cuboid
 
-		# Extrude remaining surface downwards
-		del faces[0] # Remove old top face
-		for i in range(0, 4): # Adjust old's height
-			vertices[i] = (vertices[i][0], vertices[i][1], new_base)
-		
-		# Merge
-		offset = len(vertices)
-		vertices.extend(new_vertices)
-		for i, face in enumerate(new_faces):
-			for j, _ in enumerate(face):
-				new_faces[i][j] += offset
-		faces.extend([
-			[0, 1, 8+5, 8+4],
-			[1, 2, 8+6, 8+5],
-			[2, 3, 8+7, 8+6],
-			[3, 0, 8+4, 8+7]
-		])
-		faces.extend(new_faces)
+def tower_mesh(x_ranges, y_ranges, bases, height):
+	"""Mesh of fractal tower with given tiers, as (vertices, faces) arrays.
+	
+	For k = len(bases) - 1, vertices has shape (8+8k, 3), and faces (5+8k, 4)."""
+	vertices, face_offsets, face_indices, _, _ = tower_buffers([0, len(bases)], x_ranges, y_ranges, bases, [height])
+	return (vertices, face_indices.reshape(-1, 4))
+
+
+def pack_tower_meshes(meshes):
+	"""Pack list of tower meshes from tower_mesh() into flat buffers (vertices, face_offsets, face_indices).
+	
+	Same result as util.pack_meshes(), but done with array operations, using that all faces are quads."""
+	if len(meshes) == 0:
+		return (np.empty((0, 3)), np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64))
+	vertex_offsets = np.cumsum([0] + [len(vertices) for vertices, faces in meshes[:-1]])
+	vertices = np.concatenate([vertices for vertices, faces in meshes])
+	face_indices = np.concatenate([faces + offset for (vertices, faces), offset in zip(meshes, vertex_offsets)])
+	face_offsets = 4 * np.arange(len(face_indices) + 1, dtype=np.int64)
+	return (vertices, face_offsets, face_indices.ravel())
+
+
+
+class Skyscraper(Building):
+	"""Skyscraper-like structure generated from fractal algorithm on rectangular base."""
+	mesh = None # (vertices, faces) mesh, set by generate_batch()
+	height = None
+	iterations = None
+	tiers = None # (x_ranges, y_ranges, bases) arrays from tower_tiers()
 		
 	def generate(self):
 		super(Skyscraper, self).generate()
@@ -119,19 +446,38 @@ class Skyscraper(Building):
 		
 		dimensions, position, rotation = self.rectangle_pose
 		sx, sy = dimensions
-		self.mesh = cuboid_without_bottom((-sx/2, sx/2), (-sy/2, sy/2), (0, self.height))
-		self.__transform(self.mesh, self.iterations)
-
+		self.tiers = tower_tiers((-sx/2, sx/2), (-sy/2, sy/2), self.height, self.iterations)
+	
+	def has_geometry(self):
+		return self.tiers is not None
+	
+	@staticmethod
+	def generate_batch(buildings):
+		tier_offsets = np.zeros(len(buildings) + 1, dtype=np.int64)
+		np.cumsum([len(building.tiers[2]) for building in buildings], out=tier_offsets[1:])
+		x_ranges, y_ranges, bases = [np.concatenate(arrays) for arrays in zip(*[building.tiers for building in buildings])]
+		heights = [building.height for building in buildings]
+		buffers = tower_buffers(tier_offsets, x_ranges, y_ranges, bases, heights)
+		batch = BuildingBatch('Skyscraper', buildings, buffers, np.arange(len(buildings))[:, np.newaxis])
+		for i, building in enumerate(buildings):
+			building.mesh = batch.building_mesh(i, 0)
+		return batch
+	
+	def meshes(self):
+		if self.mesh is None:
+			return []
+		return [self.mesh]
+	
+	def transform(self):
+		dimensions, position, rotation = self.rectangle_pose
+		return ((position[0], position[1], self.terrain.elevation_at(*position)), rotation)
 	
 	def create_blender_object(self, parent, name='skyscraper'):
 		if self.mesh is None:
 			return
 		
 		dimensions, position, rotation = self.rectangle_pose
-		vertices, faces = self.mesh
-		mesh = bpy.data.meshes.new(name)
-		mesh.from_pydata(vertices, [], faces)
-		mesh.update(calc_edges=True)
+		mesh = self._create_blender_mesh(name, 0, self.mesh)
 
 		skyscraper_obj = bpy.data.objects.new(name, mesh)
 		skyscraper_obj.parent = parent
@@ -143,52 +489,59 @@ class Skyscraper(Building):
 
 
 class Office(Building):
-	center = None
-	outline = None
+	center = None # Center of lot, origin of building coordinates
+	outline = None # Footprint Polygon, in building coordinates
+	rotation = 0.0
+	mesh = None
 
 	def generate(self):
 		super(Office, self).generate()
-		
-		self.outline = self.lot.outline.clone()
-		self.center = self.outline.center()
-		self.outline.contract(2.0)		
-		center_x, center_y = self.center
 
 		self.height = random.uniform(8.0, 15.0)
 		self.roof_height = random.uniform(1.0, 3.0)
-
-		# Vertices and faces for walls
-		vertices_bottom, vertices_top = [], []
-		for p in self.outline:
-			x, y = p[0] - center_x, p[1] - center_y
-			vertices_bottom.append( (x, y, self.terrain.elevation_at(*p)) )
-			vertices_top.append( (x, y, self.height) )
 		
-		vertices = vertices_bottom + vertices_top
-		faces = []
-		n = self.outline.number_of_vertices()
-		t = 0.4
-		for i, j in util.cycle_pairs(list(range(n))):
-			face = [i, j, j + n, i + n]
-			faces.append(face)
-			w = util.distance(vertices[i], vertices[j]) * t
-			h = self.height * t
-		
-		faces.append(list(range(n, 2*n)))
-		
-		self.mesh = vertices, faces
+		prototypes = self.prototypes()
+		if prototypes is not None:
+			self.height = prototypes.quantize(self.height)
+			self.make_instance(prototypes)
+		# Otherwise the geometry is made by generate_batch(), for all buildings of the cell at once
+	
+	def make_instance(self, prototypes):
+		"""Make the building an instance of a prototype in PrototypeLibrary prototypes. height must be quantized."""
+		# Rectangular footprint, first edge along lot's first edge, set back like the footprints of generate_batch()
+		_, self.center, self.rotation = self.rectangle_pose
+		w, h = self.lot.footprint_size(footprint_setback)
+		h, w = prototypes.quantize(h), prototypes.quantize(w)
+		self.prototype = ('Office', h, w, self.height)
+		self.outline = rectangle(h, w)
+		self.mesh = prototypes.get(self.prototype,
+			lambda: [office_mesh(self.outline, [0.0] * 4, self.height)])[0]
+	
+	def has_geometry(self):
+		return True
+	
+	@staticmethod
+	def generate_batch(buildings):
+		centers, offsets, outlines, bottoms = _lot_footprints(buildings, footprint_setback)
+		buffers = office_buffers(offsets, outlines, bottoms, [building.height for building in buildings])
+		batch = BuildingBatch('Office', buildings, buffers, np.arange(len(buildings))[:, np.newaxis])
+		for i, building in enumerate(buildings):
+			building.mesh = batch.building_mesh(i, 0)
+		return batch
+	
+	def meshes(self):
+		return [self.mesh]
+	
+	def transform(self):
+		center_x, center_y = self.center
+		return ((center_x, center_y, self.terrain.elevation_at(center_x, center_y)), self.rotation)
 	
 	def create_blender_object(self, parent, name='office'):		
-		vertices, faces = self.mesh
-		mesh = bpy.data.meshes.new(name)
-		mesh.from_pydata(vertices, [], faces)
-		mesh.update(calc_edges=True)
-
+		mesh = self._create_blender_mesh(name, 0, self.mesh)
 		house_obj = bpy.data.objects.new(name, mesh)
 		
 		house_obj.parent = parent
-		center_x, center_y = self.center
-		house_obj.location = (center_x, center_y, self.terrain.elevation_at(center_x, center_y))
+		self._place_blender_object(house_obj)
 		bpy.context.scene.objects.link(house_obj)
 		return house_obj
 
@@ -196,8 +549,9 @@ class Office(Building):
 
 
 class House(Building):
-	center = None
-	outline = None
+	center = None # Center of lot, origin of building coordinates
+	outline = None # Footprint Polygon, in building coordinates
+	rotation = 0.0
 	wall_texture = None
 	roof_texture = None
 	wall_mesh = None
@@ -205,99 +559,66 @@ class House(Building):
 
 	def generate(self):
 		super(House, self).generate()
-		
-		self.outline = self.lot.outline.clone()
-		self.center = self.outline.center()
-		self.outline.contract(2.0)		
-		center_x, center_y = self.center
 
 		self.height = random.uniform(8.0, 15.0)
 		self.roof_height = random.uniform(1.0, 3.0)
-
-		# Vertices and faces for walls
-		vertices_bottom, vertices_top, faces = [], [], []
-		for p in self.outline:
-			x, y = p[0] - center_x, p[1] - center_y
-			vertices_bottom.append( (x, y, self.terrain.elevation_at(*p)) )
-			vertices_top.append( (x, y, self.height) )
-		
-		vertices = vertices_bottom + vertices_top
-		faces = []
-		t = 0.1
-		n = self.outline.number_of_vertices()
-		for i, j in util.cycle_pairs(list(range(n))):
-			face = [i, j, j + n, i + n]
-			faces.append(face)
-			w = util.distance(vertices[i], vertices[j]) * t
-			h = self.height * t
-			
-		self.wall_mesh = vertices, faces	
-	
-	
-		# Vertices and 1 face for base of roof
-		vertices, faces = [], []
-		roof = self.outline.clone()
-		roof.expand(0.3)
-		faces.append(list(range( 0, roof.number_of_vertices() )))
-		roof_vertices_offset = len(vertices)
-		for p in roof:
-			x, y = p[0] - center_x, p[1] - center_y
-			vertices.append( (x, y, self.height) )
-	
-		# Make roof top: move points towards center
-		roof_top = roof.clone()
-		c = roof_top.center()
-		r = 0.3
-		for i, p in enumerate(roof_top.vertices):
-			pc = (c[0] - p[0], c[1] - p[1])
-			p = (p[0] + r*pc[0], p[1] + r*pc[1])
-			roof_top.vertices[i] = p
-			
-		# Add vertices and face for roof top
-		for p in roof_top:
-			x, y = p[0] - center_x, p[1] - center_y
-			vertices.append( (x, y, self.height + self.roof_height) )
-		faces.append(list(range( roof_top.number_of_vertices() )))
 		
-		# Connect roof base to roof top
-		for i, j in util.cycle_pairs(list(range(n))):
-			face = [
-				i,
-				j,
-				j + n,
-				i + n
-			]
-			faces.append(face)
+		prototypes = self.prototypes()
+		if prototypes is not None:
+			self.height = prototypes.quantize(self.height)
+			self.roof_height = prototypes.quantize(self.roof_height)
+			self.make_instance(prototypes)
+		# Otherwise the geometry is made by generate_batch(), for all buildings of the cell at once
 	
-		self.roof_mesh = vertices, faces
-
+	def make_instance(self, prototypes):
+		"""Make the building an instance of a prototype in PrototypeLibrary prototypes. height and roof_height
+		must be quantized."""
+		# Rectangular footprint, first edge along lot's first edge, set back like the footprints of generate_batch()
+		_, self.center, self.rotation = self.rectangle_pose
+		w, h = self.lot.footprint_size(footprint_setback)
+		h, w = prototypes.quantize(h), prototypes.quantize(w)
+		self.prototype = ('House', h, w, self.height, self.roof_height)
+		self.outline = rectangle(h, w)
+		self.wall_mesh, self.roof_mesh = prototypes.get(self.prototype,
+			lambda: list(house_meshes(self.outline, [0.0] * 4, self.height, self.roof_height)))
 	
-	def create_blender_object(self, parent, name):	
+	def has_geometry(self):
+		return True
+	
+	@staticmethod
+	def generate_batch(buildings):
+		centers, offsets, outlines, bottoms = _lot_footprints(buildings, footprint_setback)
+		walls, roofs = house_buffers(offsets, outlines, bottoms,
+			[building.height for building in buildings], [building.roof_height for building in buildings])
+		n = len(buildings)
+		building_meshes = np.stack([np.arange(n), n + np.arange(n)], axis=1)
+		batch = BuildingBatch('House', buildings, concatenate_meshes([walls, roofs]), building_meshes)
+		for i, building in enumerate(buildings):
+			building.wall_mesh = batch.building_mesh(i, 0)
+			building.roof_mesh = batch.building_mesh(i, 1)
+		return batch
+	
+	def meshes(self):
+		return [self.wall_mesh, self.roof_mesh]
+	
+	def transform(self):
 		center_x, center_y = self.center
+		return ((center_x, center_y, self.terrain.elevation_at(center_x, center_y)), self.rotation)
+	
+	def create_blender_object(self, parent, name):	
 		house_obj = bpy.data.objects.new(name, object_data=None)
 		house_obj.parent = parent
-		center_x, center_y = self.center
-		house_obj.location = (center_x, center_y, self.terrain.elevation_at(center_x, center_y))
+		self._place_blender_object(house_obj)
 		bpy.context.scene.objects.link(house_obj)
 	
-		vertices, faces = self.wall_mesh
-		mesh = bpy.data.meshes.new(name)
-		mesh.from_pydata(vertices, [], faces)
-		mesh.update(calc_edges=True)
-		
+		mesh = self._create_blender_mesh(name, 0, self.wall_mesh)
 		house_walls_obj = bpy.data.objects.new(name+'_walls', mesh)
 		bpy.context.scene.objects.link(house_walls_obj)
 		house_walls_obj.parent = house_obj
 
-
-
-		vertices, faces = self.roof_mesh
-		mesh = bpy.data.meshes.new(name)
-		mesh.from_pydata(vertices, [], faces)
-		mesh.update(calc_edges=True)
-		
+		mesh = self._create_blender_mesh(name, 1, self.roof_mesh)
 		house_roof_obj = bpy.data.objects.new(name+'_roof', mesh)
 		bpy.context.scene.objects.link(house_roof_obj)
 		house_roof_obj.parent = house_obj
 		
-		return house_obj
\ No newline at end of file
+		return house_obj
@@ -0,0 +1,90 @@
+import os
+import io
+import pickle
+import hashlib
+import numpy as np
+
+version = 7 # Bumped whenever the stored stage results change meaning
+
+
+class _Pickler(pickle.Pickler):
+	"""Pickler which stores references to given objects by name instead of by value."""
+	def __init__(self, file, references):
+		super(_Pickler, self).__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+		self.__names = dict((id(obj), name) for name, obj in references.items())
+
+	def persistent_id(self, obj):
+		return self.__names.get(id(obj))
+
+
+class _Unpickler(pickle.Unpickler):
+	"""Unpickler which resolves the named references stored by _Pickler."""
+	def __init__(self, file, references):
+		super(_Unpickler, self).__init__(file)
+		self.__references = references
+
+	def persistent_load(self, name):
+		return self.__references[name]
+
+
+def dumps(obj, references={}):
+	"""Serialize obj, storing only the names of objects in references (dict name -> object)."""
+	file = io.BytesIO()
+	_Pickler(file, references).dump(obj)
+	return file.getvalue()
+
+def loads(data, references={}):
+	"""Deserialize data produced by dumps(), reattaching the named references."""
+	return _Unpickler(io.BytesIO(data), references).load()
+
+
+class StageCache(object):
+	"""Content-addressed on-disk cache for results of city generation stages.
+
+	Each stage result is stored in one compressed .npz file, named after the stage and a key that hashes
+	all parameters affecting that stage (including the key of the stage it depends on). NumPy arrays are
+	stored as such, other Python objects are pickled into the same file. Objects shared with the city
+	which is being generated (the city itself, its terrain) are stored by name only, and given back
+	on loading."""
+	directory = None # Directory where the stage files are stored
+
+	def __init__(self, directory):
+		self.directory = directory
+
+	@staticmethod
+	def key(*parameters):
+		"""Key for stage result determined by given parameters."""
+		return hashlib.sha1(repr((version,) + parameters).encode('utf-8')).hexdigest()
+
+	def path(self, stage, key):
+		return os.path.join(self.directory, stage + '-' + key + '.npz')
+
+	def load(self, stage, key, references={}):
+		"""Load stage result. Returns (arrays, objects), or None if not cached."""
+		path = self.path(stage, key)
+		if not os.path.isfile(path):
+			return None
+		with np.load(path) as data:
+			arrays = dict((name, data[name]) for name in data.files if name != '__objects__')
+			objects = loads(data['__objects__'].tobytes(), references)
+		return (arrays, objects)
+
+	def store(self, stage, key, arrays, objects, references={}):
+		"""Store stage result. arrays is dict of NumPy arrays, objects is any picklable object."""
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		data = dict(arrays)
+		data['__objects__'] = np.frombuffer(dumps(objects, references), dtype=np.uint8)
+
+		# Write to temporary file first, so that interrupted writes never leave a corrupt stage behind
+		path = self.path(stage, key)
+		temp_path = path + '.tmp'
+		with open(temp_path, 'wb') as file:
+			np.savez_compressed(file, **data)
+		os.replace(temp_path, path)
+
+	def clear(self):
+		"""Remove all stored stage results."""
+		for name in os.listdir(self.directory):
+			if name.endswith('.npz'):
+				os.remove(os.path.join(self.directory, name))
@@ -3,8 +3,26 @@ import random
 import math
 import bpy
 import networkx as nx
+import json
+
+from . import assets, citycell, util, mcb, dcel, terrain, cache, roadnet, routing, building, spatial, metrics
+
+class GenerationCancelled(Exception):
+	"""Raised by City.generate() when City.cancel_requested was set while it was running."""
+	pass
+
+
+class GenerationEvent(object):
+	"""Component of the city that is ready, yielded by City.iter_generate()."""
+	type = None # 'terrain', 'road', 'block', 'building', 'cell' or 'terrain_final'
+	component = None # The Terrain, road (list of points), Block, Building or Cell
+	cell = None # City cell the component belongs to, for 'block', 'building' and 'cell'
+
+	def __init__(self, type, component, cell=None):
+		self.type = type
+		self.component = component
+		self.cell = cell
 
-from . import assets, citycell, util, mcb, terrain
 
 class City(object):
 	"""City consisting of terrain, primary road network and city cells with content.
@@ -28,7 +46,22 @@ class City(object):
 	road_number_of_samples = 15
 	road_snap_distance = 15.0
 	road_deviation_angle = math.radians(8.0)
+	road_planning_level = 0 # Terrain pyramid level on which primary roads are first traced, before they get refined at full resolution. 0 to trace at full resolution only.
 	urbanization = 0.5
+	face_algorithm = 'MCB' # Algorithm for the regions enclosed by roads: 'MCB' (mcb.planar_graph_cycles) or 'DCEL' (dcel.planar_graph_faces)
+	
+	seed = None # Seed for random number generation, or None to not seed it
+	cache = None # cache.StageCache where generated stages are stored and reused, or None
+	workers = 1 # Number of processes used to generate the blocks of each city cell
+	building_quantization = 0.0 # Step (in m) to which building dimensions are rounded so that they can share meshes. 0 to disable.
+	building_prototypes = None # building.PrototypeLibrary with the shared building meshes
+	lazy = False # If True, the contents of city cells are generated only when first needed, see ensure_generated(). No random walk curve is created then.
+	progress_callback = None # Called with (stage name, fraction of stage done) during generate(), or None
+	cancel_requested = False # Set (e.g. from another thread) to make generate() stop with GenerationCancelled
+	bake_primary_roads = False # If True, primary roads are created as one static mesh, instead of asset objects with modifiers
+	primary_road_cross_section = ((-6.0, -0.4), (-4.5, 0.1), (4.5, 0.1), (6.0, -0.4)) # (offset to the left, height) points of baked primary roads, from right to left
+	metrics = None # metrics.Metrics counting events during generation, see metrics_report()
+	lod_distances = (400.0, 1000.0) # Distances from camera (in m) beyond which cells are shown as 'BLOCKS', and as 'FLAT'
 	
 	# Primary roads are represented on two levels:
 	# High-level = Graph connecting intersection points
@@ -39,11 +72,17 @@ class City(object):
 	graph = None # NetworkX undirected connecting intersections of primary roads. (High-level graph)
 	roads = None # Dict where key = frozenset(A,B), value = list of points forming polyline from road from A to B
 	city_cells = None # List of city cells.
+	base_terrain_image = None # Terrain height map after the primary roads, before the cells modify it. See update_terrain().
+	edited_terrain_pixels = None # Sorted flat indices of the height map pixels edited by the generated cells
 
 	__original_elevations = None
+	__full_network = None # Cached merged road network of all cells
+	__router = None # Cached routing.Router on the full network
+	__spatial_index = None # Cached spatial.SpatialIndex of the cells, blocks and lots
 
 	def __init__(self):
 		self.terrain = terrain.Terrain()
+		self.metrics = metrics.Metrics()
 		
 	
 	def __create_high_level_graph(self):
@@ -120,43 +159,45 @@ class City(object):
 				last = c
 
 
-	def __create_road(self, src, dst):
-		"""Create road shape between two intersection points, according to terrain."""
-	
-		pos = src
-		if self.road_snap_distance < self.road_step_distance:
-			deviation_angle = min(deviation_angle, math.acos(self.road_snap_distance / self.road_step_distance)) 
+	def __trace_road(self, src, dst, level=0):
+		"""Trace road between two points, according to terrain elevations on given pyramid level.
+		
+		Steps and snap distance are scaled with the pixel size of the level. Returns (road points, complete),
+		where complete is False if tracing stopped at max_iterations before reaching dst."""
+		scale = 2**level
+		step_distance = self.road_step_distance * scale
+		snap_distance = self.road_snap_distance * scale
+		deviation_angle = self.road_deviation_angle
+		if snap_distance < step_distance:
+			deviation_angle = min(deviation_angle, math.acos(snap_distance / step_distance)) 
 		
-		dst_height = self.terrain.elevation_at(*dst)
+		dst_height = self.terrain.elevations_at([dst], level)[0]
 		
 		def choose_sample(samples):
-			min_diff = np.inf
-			best = None
-			for p in samples:
-				covered_distance = util.distance(src, p)
-				remaining_distance = util.distance(p, dst)
-				p_height = self.terrain.elevation_at(*p)
-				
-				diff = abs(p_height/covered_distance - dst_height/remaining_distance)
-				if diff < min_diff:
-					min_diff = diff
-					best = p
-			
-			return best
+			# First sample with minimal difference of slope from src and slope to dst
+			samples = np.array(samples)
+			covered_distance = np.sqrt((samples[:, 0] - src[0])**2 + (samples[:, 1] - src[1])**2)
+			remaining_distance = np.sqrt((dst[0] - samples[:, 0])**2 + (dst[1] - samples[:, 1])**2)
+			heights = self.terrain.elevations_at(samples, level)
+			diff = np.abs(heights/covered_distance - dst_height/remaining_distance)
+			best = samples[np.argmin(diff)]
+			return (float(best[0]), float(best[1]))
 		
+		pos = src
 		road_points = [src]
 		max_iterations = 1000
 		iterations = 0
+		complete = True
 			
-		while util.distance(pos, dst) > self.road_snap_distance:			
+		while util.distance(pos, dst) > snap_distance:			
 			straight_angle = math.atan2(dst[1] - pos[1], dst[0] - pos[0])
-			min_angle = straight_angle - self.road_deviation_angle
-			angle_difference = (2.0*self.road_deviation_angle) / self.road_number_of_samples
+			min_angle = straight_angle - deviation_angle
+			angle_difference = (2.0*deviation_angle) / self.road_number_of_samples
 			samples = []
 			for i in range(self.road_number_of_samples):
 				angle = min_angle + i*angle_difference
-				sample_x = pos[0] + math.cos(angle) * self.road_step_distance
-				sample_y = pos[1] + math.sin(angle) * self.road_step_distance
+				sample_x = pos[0] + math.cos(angle) * step_distance
+				sample_y = pos[1] + math.sin(angle) * step_distance
 				samples.append((sample_x, sample_y))
 				
 			sample = choose_sample(samples)
@@ -166,9 +207,30 @@ class City(object):
 		   
 			iterations = iterations + 1
 			if iterations >= max_iterations:
+				complete = False
 				break
 
 		road_points.append(dst)
+		return road_points, complete
+
+	def __create_road(self, src, dst):
+		"""Create road shape between two intersection points, according to terrain.
+		
+		If road_planning_level > 0, the road is first traced on that level of the terrain pyramid, with
+		correspondingly longer steps. Then each of its segments gets traced at full resolution, so that the
+		fine road stays near the coarse one."""
+		if self.road_planning_level <= 0:
+			road_points, complete = self.__trace_road(src, dst)
+		else:
+			waypoints, complete = self.__trace_road(src, dst, self.road_planning_level)
+			road_points = [src]
+			for a, b in util.list_pairs(waypoints):
+				segment_points, segment_complete = self.__trace_road(a, b)
+				road_points.extend(segment_points[1:])
+				complete = complete and segment_complete
+		
+		if not complete:
+			self.metrics.count('primary_roads_max_iterations')
 		return road_points
 
 
@@ -197,7 +259,11 @@ class City(object):
 		
 		Fills self.roads with roads for all intersection point pairs."""
 		self.roads = dict()
-		for a, b in self.graph.edges_iter():
+		if self.road_planning_level > 0:
+			self.terrain.build_pyramid(self.road_planning_level)
+		edges = self.graph.edges()
+		for i, (a, b) in enumerate(edges):
+			self.__report_progress('roads', i / float(len(edges)))
 			road = self.__create_road(a, b)
 			self.roads[self.__road_key(a, b)] = road
 	
@@ -235,12 +301,21 @@ class City(object):
 		return low_level_cycle
 
 	
+	def enclosed_cycles(self, graph):
+		"""Cycles of regions enclosed by the roads of graph, using the algorithm set in face_algorithm."""
+		if self.face_algorithm == 'DCEL':
+			return dcel.planar_graph_faces(graph)
+		else:
+			return mcb.planar_graph_cycles(graph)
+
+
 	def __create_city_cells(self):
-		"""Create city cell for each region enclosed by primary roads."""
+		"""Create city cell for each region enclosed by primary roads. Their contents are not generated yet."""
+		self.invalidate_full_network()
 	
 		# Get cycles in primary road network
 		# = minimum cycle basis of graph
-		cycles = mcb.planar_graph_cycles(self.graph)
+		cycles = self.enclosed_cycles(self.graph)
 	
 		# Randomly choose point representing city center near terrain center point
 		half_w = self.terrain.side_length / 2
@@ -258,9 +333,45 @@ class City(object):
 			remoteness = util.distance(center, city_center) / self.terrain.side_length
 		
 			city_cell = self.__create_city_cell(hi_cycle, lo_cycle, remoteness)
-			city_cell.generate()
+			city_cell.seed = random.getrandbits(32)
 			self.city_cells.append(city_cell)
 	
+	def ensure_generated(self, cells=None):
+		"""Generate contents of given city cells (default all), if not done yet.
+		
+		Generating a cell can modify the terrain, so this must be done before the terrain is exported."""
+		cells = self.city_cells if cells is None else cells
+		for i, cell in enumerate(cells):
+			self.__report_progress('cells', i / float(len(cells)))
+			cell.ensure_generated()
+	
+	def generate_visible(self, camera_position):
+		"""Generate the cells which get shown with more than 'FLAT' detail from camera_position, see cell_lod().
+		
+		Done by create_blender_object(), but can be called beforehand, e.g. from a background thread in lazy mode."""
+		self.ensure_generated([cell for cell in self.city_cells if self.cell_lod(cell, camera_position) != 'FLAT'])
+	
+	def update_terrain(self, cell=None):
+		"""Compose terrain height map from base_terrain_image and the edits of all generated cells, applied in cell order.
+		
+		Each cell is generated on the base terrain and records its own edits, see Cell.ensure_generated(). Applying
+		them in order of the cells gives the same terrain as making them one cell after the other, whatever order the
+		cells were generated in, e.g. in lazy mode. If cell is given, it was just generated, and only the pixels it
+		edited are composed again."""
+		all_edits = [c.terrain_edits for c in self.city_cells if c.terrain_edits is not None]
+		if cell is None:
+			self.terrain.set_image(self.base_terrain_image.copy())
+			indices = np.unique(np.concatenate([edits[0] for edits in all_edits] + [np.zeros(0, dtype=np.int64)]))
+			self.edited_terrain_pixels = indices
+		else:
+			indices = cell.terrain_edits[0]
+			self.edited_terrain_pixels = np.union1d(self.edited_terrain_pixels, indices)
+		heights = self.base_terrain_image.flat[indices]
+		for edits in all_edits:
+			terrain.apply_edits(heights, indices, edits)
+		self.terrain.image.flat[indices] = heights
+		self.terrain.pyramid = None
+	
 
 	@staticmethod
 	def __road_length(road):
@@ -270,6 +381,11 @@ class City(object):
 		return len
 
 
+	def road_with_elevations(self, road):
+		"""Points of road with their original terrain elevation, as (n, 3) array."""
+		return np.array([(p[0], p[1], self.__original_elevations[p]) for p in road])
+
+
 	def __create_blender_curve_for_road(self, parent, name, road):
 		curve = bpy.data.curves.new(name=name, type='CURVE')
 		curve.dimensions = '3D'
@@ -290,6 +406,60 @@ class City(object):
 		return curve_obj
 
 	
+	def bake_primary_roads_mesh(self):
+		"""All primary roads as one mesh, given as buffers (vertices, face_offsets, face_indices).
+		
+		The cross-section is swept along each road, at the original terrain elevation. Roads are cut short at the
+		intersection points, where the road surfaces get joined by a triangle fan. Roads shorter than twice the road
+		radius are cut by a third of their length at each end instead, so that they still connect their intersections."""
+		profile = np.array(self.primary_road_cross_section, dtype=float)
+		k = len(profile)
+		radius = np.max(np.abs(profile[:, 0]))
+		surface = np.flatnonzero(profile[:, 1] == np.max(profile[:, 1])) # Right and left edge of road surface
+		right, left = surface[0], surface[-1]
+		
+		# Swept roads, without the part within radius around the intersection points
+		roads = []
+		for road in self.roads.values():
+			points = self.road_with_elevations(road)
+			length = np.sum(np.linalg.norm(np.diff(points, axis=0), axis=1))
+			trim = min(radius, length / 3.0)
+			trimmed = util.trim_polyline(points, trim, length - trim)
+			if trimmed is not None:
+				roads.append( (road[0], road[-1], trimmed) )
+		if len(roads) == 0:
+			return (np.zeros((0, 3)), np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64))
+		offsets, coordinates = util.pack_sequences([trimmed for a, b, trimmed in roads], dimensions=3)
+		vertices, face_offsets, face_indices = util.sweep_packed_polylines(offsets, coordinates, profile)
+		
+		# First vertex of the cross-section at each road end, by intersection point
+		ends = dict()
+		for i, (a, b, trimmed) in enumerate(roads):
+			ends.setdefault(a, []).append(offsets[i] * k)
+			ends.setdefault(b, []).append((offsets[i+1] - 1) * k)
+		
+		# Triangle fan around each intersection point, through the road surface edges of the road ends
+		centers = []
+		fans = []
+		for p, sections in ends.items():
+			if len(sections) < 2:
+				continue
+			center = len(vertices) + len(centers)
+			centers.append( (p[0], p[1], self.__original_elevations[p] + profile[right, 1]) )
+			ring = np.array([s + right for s in sections] + [s + left for s in sections])
+			angles = np.arctan2(vertices[ring, 1] - p[1], vertices[ring, 0] - p[0])
+			order = np.argsort(angles)
+			ring, angles = ring[order], angles[order]
+			gaps = (np.roll(angles, -1) - angles) % (2.0 * math.pi)
+			for m in np.flatnonzero(gaps < math.pi): # Wider gaps would give flipped triangles
+				fans.append( (center, ring[m], ring[(m+1) % len(ring)]) )
+		
+		fans = np.array(fans, dtype=np.int64).reshape(-1, 3)
+		vertices = np.concatenate([vertices, np.array(centers).reshape(-1, 3)])
+		face_offsets = np.concatenate([face_offsets, face_offsets[-1] + 3 * np.arange(1, len(fans) + 1)])
+		face_indices = np.concatenate([face_indices, fans.ravel()])
+		return (vertices, face_offsets, face_indices)
+
 	def __create_blender_road(self, parent, name, road):
 		curve = self.__create_blender_curve_for_road(parent, name, road)
 		road_len = self.__road_length(road)
@@ -312,28 +482,112 @@ class City(object):
 		return road
 
 
+	def full_network(self):
+		"""Road network of all primary and secondary roads in the city, as roadnet.RoadNetwork.
+		
+		Built in one pass over the cells, roads shared between cells appear once. The result is cached
+		until invalidate_full_network() gets called. Generates the contents of all cells in lazy mode."""
+		if self.__full_network is None:
+			# Flushed cells still have their roads
+			self.ensure_generated([cell for cell in self.city_cells if not cell.generated])
+			builder = roadnet.NetworkBuilder()
+			for cell in self.city_cells:
+				cell.add_to_network(builder)
+			self.__full_network = builder.network()
+		return self.__full_network
+	
+	def invalidate_full_network(self):
+		"""Must be called when city cells or their roads are modified after generate(). Also resets spatial_index()."""
+		self.__full_network = None
+		self.__router = None
+		self.__spatial_index = None
+	
+	def spatial_index(self):
+		"""spatial.SpatialIndex of the cells, blocks and lots, for point and rectangle queries. Cached like full_network()."""
+		if self.__spatial_index is None:
+			self.ensure_generated()
+			self.__spatial_index = spatial.SpatialIndex(self.city_cells)
+		return self.__spatial_index
+	
+	def router(self):
+		"""routing.Router for shortest path queries on the full network. Cached like full_network()."""
+		if self.__router is None:
+			self.__router = routing.Router(self.full_network())
+		return self.__router
+
 	def full_graph_low(self):
-		graph = nx.Graph()
-		for cell in self.city_cells:
-			cell_graph = cell.full_graph_low()
-			graph = nx.compose(graph, cell_graph)
-		return graph
+		"""Road network of all primary and secondary roads in the city, as NetworkX graph."""
+		return self.full_network().to_networkx()
 	
 	
 	def random_walk(self, n):
-		src = self.intersection_points[self.intersection_point_grid[0, 0]]
-		dst = self.intersection_points[self.intersection_point_grid[-1, -1]]
-		paths = nx.all_simple_paths(self.full_graph_low(), source=src, target=dst)
-		path = next(paths)
-		return path
+		"""Shortest path along roads between opposite corners of the primary road grid, as list of points."""
+		router = self.router()
+		src = router.nearest_node(self.intersection_points[self.intersection_point_grid[0, 0]])
+		dst = router.nearest_node(self.intersection_points[self.intersection_point_grid[-1, -1]])
+		path = router.shortest_path(src, dst)
+		return [self.full_network().point(i) for i in path]
+	
+	
+	def traffic_paths(self, n):
+		"""Shortest paths between n random pairs of road network nodes.
+		
+		Returns (paths, usage): paths is list of paths, each list of node ids in full_network(), or None if not
+		connected. usage is dict (i, j) -> number of paths using edge i-j, with i < j."""
+		router = self.router()
+		nodes = self.full_network().nodes()
+		pairs = [tuple(random.sample(nodes, 2)) for i in range(n)]
+		paths = router.shortest_paths(pairs)
+		return (paths, router.edge_usage(paths))
+	
+	
 					
 			
-	def generate(self):
-		"""Generate internal representation of whole city."""
-	
-		# Generate the terrain
-		self.terrain.generate()
+	def __cache_references(self):
+		"""Objects which cached stage results refer to by name."""
+		return { 'city': self, 'terrain': self.terrain }
+
+
+	def __uses_cache(self):
+		return (self.cache is not None) and (self.seed is not None)
+
+	def __load_stage(self, stage, key, restore):
+		"""Restore result of stage from the stage cache using restore(arrays, objects), if it is there.
 		
+		Returns whether it was restored. The random generator state is restored along."""
+		if not self.__uses_cache():
+			return False
+		entry = self.cache.load(stage, key, self.__cache_references())
+		if entry is None:
+			return False
+		arrays, objects = entry
+		restore(arrays, objects)
+		random.setstate(objects['random_state'])
+		return True
+
+	def __store_stage(self, stage, key, dump):
+		"""Store result of stage given by dump() in the stage cache, with the current random generator state."""
+		if not self.__uses_cache():
+			return
+		arrays, objects = dump()
+		objects['random_state'] = random.getstate()
+		self.cache.store(stage, key, arrays, objects, self.__cache_references())
+
+	def __run_stage(self, stage, key, generate, dump, restore):
+		"""Run generation stage, or restore its result from the stage cache.
+		
+		dump() returns (arrays, objects) representing the stage result, and restore(arrays, objects) sets it back.
+		The random generator state after the stage is stored along, so that the following stages
+		get the same results as when the stage was run."""
+		if not self.__load_stage(stage, key, restore):
+			generate()
+			self.__store_stage(stage, key, dump)
+
+
+	def __generate_terrain(self):
+		self.terrain.generate(lambda fraction: self.__report_progress('terrain', fraction))
+
+	def __generate_primary_roads(self):
 		# High and low level graph for primary roads
 		self.__create_high_level_graph()
 		self.__create_low_level_graph()
@@ -346,47 +600,248 @@ class City(object):
 		for key in self.roads:
 			for a, b in util.list_pairs(self.roads[key]):
 				self.terrain.flatten_segment(a, b, self.__original_elevations[a], self.__original_elevations[b])
+
+	def __dump_primary_roads(self):
+		arrays = {
+			'image': self.terrain.image,
+			'intersection_point_grid': self.intersection_point_grid
+		}
+		objects = {
+			'intersection_points': self.intersection_points,
+			'graph': self.graph,
+			'roads': self.roads,
+			'original_elevations': self.__original_elevations,
+			'metrics': self.metrics.as_dict()
+		}
+		return (arrays, objects)
+
+	def __restore_primary_roads(self, arrays, objects):
+		self.terrain.set_image(arrays['image'])
+		self.intersection_point_grid = arrays['intersection_point_grid']
+		self.intersection_points = objects['intersection_points']
+		self.graph = objects['graph']
+		self.roads = objects['roads']
+		self.__original_elevations = objects['original_elevations']
+		self.metrics.reset(objects.get('metrics'))
+
+	def __restore_city_cells(self, arrays, objects):
+		self.city_cells = objects['city_cells']
+		self.metrics.reset(objects.get('metrics'))
+		self.update_terrain()
+		self.invalidate_full_network()
+
+
+	def __report_progress(self, stage, fraction):
+		if self.cancel_requested:
+			raise GenerationCancelled()
+		if self.progress_callback is not None:
+			self.progress_callback(stage, fraction)
+
+
+	def generate(self):
+		"""Generate internal representation of whole city.
+		
+		If self.seed is set, the random number generator is seeded with it first. If in addition self.cache
+		is set, the results of the terrain, primary roads and city cells stages are stored in it, and reused
+		by later calls whose parameters affecting that stage are the same.
+		Progress is reported to self.progress_callback, and setting self.cancel_requested makes it stop.
+		If self.lazy is set, city cells are only created with their cycles and profile. Their contents get generated
+		when first needed: by create_blender_object(), update_lod(), full_network() or ensure_generated()."""
+		for event in self.iter_generate():
+			pass
+	
+	def iter_generate(self, flush=False):
+		"""Generate city like generate(), yielding GenerationEvent for each component as soon as it is ready.
+		
+		Events come in order: 'terrain', 'road' for each primary road, then for each city cell 'block' and
+		'building' events for its contents followed by the 'cell' event, and finally 'terrain_final'. In lazy mode,
+		cells yield no events. Cells can modify the terrain, so it is final only at the 'terrain_final' event (in lazy
+		mode, cells generated later still modify it).
+		If flush is set, blocks, lots and buildings of each cell are dropped once its 'cell' event has been
+		consumed, so that memory stays bounded. They get generated again if needed later, see Cell.flush().
+		The city cells stage is then not stored in the stage cache."""
+
+		if self.seed is not None:
+			random.seed(self.seed)
+		self.metrics.reset()
+	
+		# Generate the terrain
+		self.__report_progress('terrain', 0.0)
+		t = self.terrain
+		terrain_key = cache.StageCache.key('terrain', self.seed, t.initial_height_range, t.roughness, t.resolution)
+		self.__run_stage('terrain', terrain_key,
+			self.__generate_terrain,
+			lambda: ({ 'image': t.image }, {}),
+			lambda arrays, objects: t.set_image(arrays['image'])
+		)
+		yield GenerationEvent('terrain', t)
 		
+		# Primary roads, and terrain flattened along them
+		self.__report_progress('roads', 0.0)
+		roads_key = cache.StageCache.key('roads', terrain_key, t.side_length, t.elevation,
+			self.approximate_number_of_intersection_points, self.edges_deviation,
+			self.road_step_distance, self.road_number_of_samples, self.road_snap_distance, self.road_deviation_angle,
+			self.road_planning_level)
+		self.__run_stage('roads', roads_key,
+			self.__generate_primary_roads,
+			self.__dump_primary_roads,
+			self.__restore_primary_roads
+		)
+		for road in self.roads.values():
+			yield GenerationEvent('road', road)
 
-		# Create the city cells with their contents
-		self.__create_city_cells()
+		# Create the city cells, then generate their contents one by one
+		self.__report_progress('cells', 0.0)
+		self.building_prototypes = building.PrototypeLibrary(self.building_quantization)
+		cells_key = cache.StageCache.key('cells', roads_key, self.urbanization, self.building_quantization, self.face_algorithm)
+		self.base_terrain_image = t.image.copy()
+		self.edited_terrain_pixels = np.zeros(0, dtype=np.int64)
+		dump_cells = lambda: ({}, { 'city_cells': self.city_cells, 'metrics': self.metrics.as_dict() })
+		restored = self.__load_stage('cells', cells_key, self.__restore_city_cells)
+		if not restored:
+			self.__create_city_cells()
+		
+		if not self.lazy:
+			for i, cell in enumerate(self.city_cells):
+				self.__report_progress('cells', i / float(len(self.city_cells)))
+				cell.ensure_generated()
+				for event in self.__cell_events(cell):
+					yield event
+				if flush:
+					cell.flush()
+		
+		if not (restored or (flush and not self.lazy)):
+			self.__store_stage('cells', cells_key, dump_cells)
+		yield GenerationEvent('terrain_final', t)
+		
+		# Merged road network, for whole-city queries. In lazy mode, built on first query.
+		self.__report_progress('network', 0.0)
+		if not self.lazy:
+			self.full_network()
+		self.__report_progress('network', 1.0)
+	
+	@staticmethod
+	def __cell_events(cell):
+		blocks = getattr(cell, 'blocks', None) or []
+		for blk in blocks:
+			yield GenerationEvent('block', blk, cell)
+		for blk in blocks:
+			if blk.valid:
+				for lot in blk.lots:
+					if lot.building is not None:
+						yield GenerationEvent('building', lot.building, cell)
+		yield GenerationEvent('cell', cell, cell)
+	
+	
+	def metrics_report(self):
+		"""Sizes of the generated city and counters of self.metrics, as dict { 'sizes': ..., 'counters': ... }.
+		
+		Counters cover the contents generated so far, so in lazy mode only the cells generated until now.
+		Network sizes are included only once full_network() was built."""
+		sizes = {
+			'intersections': self.graph.number_of_nodes(),
+			'primary_roads': len(self.roads),
+			'primary_road_points': sum(len(road) for road in self.roads.values()),
+			'city_cells': len(self.city_cells),
+			'generated_city_cells': sum(1 for cell in self.city_cells if cell.generated)
+		}
+		for cell in self.city_cells:
+			key = 'city_cells_' + type(cell).__name__
+			sizes[key] = sizes.get(key, 0) + 1
+		if self.__full_network is not None:
+			sizes['network_nodes'] = self.__full_network.number_of_nodes()
+			sizes['network_edges'] = self.__full_network.number_of_edges()
+		return { 'sizes': sizes, 'counters': self.metrics.as_dict() }
+	
+	def metrics_json(self):
+		"""metrics_report() as JSON string."""
+		return json.dumps(self.metrics_report(), indent=1, sort_keys=True)
 			
 	
-	def create_blender_object(self, name):
+	def cell_lod(self, cell, camera_position):
+		"""Level of detail for city cell, depending on distance of its center to camera position (in city coordinates).
+		
+		Full detail for all cells if camera position is None."""
+		if camera_position is None:
+			return 'FULL'
+		center = np.array(cell.lo_cycle.center())
+		distance = np.linalg.norm(center - np.asarray(camera_position)[0:2])
+		if distance > self.lod_distances[1]:
+			return 'FLAT'
+		elif distance > self.lod_distances[0]:
+			return 'BLOCKS'
+		else:
+			return 'FULL'
+	
+	def update_lod(self, camera_position):
+		"""Switch city cells to the level of detail for new camera position, without regenerating them.
+		
+		Must be called after create_blender_object(). In lazy mode, cells that get shown in more detail are
+		generated now, but changes they make to the terrain do not appear on the already created terrain object."""
+		for cell in self.city_cells:
+			cell.set_lod(self.cell_lod(cell, camera_position))
+	
+	def create_blender_object(self, name, camera_position=None):
 		"""Create blender objects for the whole city.
 		
 		Must be called after generate(). Creates hiearchy of Blender objects,
-		where root is given the provided name."""
+		where root is given the provided name. If camera position (in city coordinates) is given, distant
+		city cells get created with less detail, see cell_lod()."""
+		for root, fraction in self.iter_create_blender_object(name, camera_position):
+			pass
+		return root
+	
+	def iter_create_blender_object(self, name, camera_position=None):
+		"""Create blender objects for the whole city step by step, like create_blender_object().
+		
+		Generator which yields (root, fraction done) after each step, so that the caller can let the scene
+		get updated in between. Root is not linked to the scene. In lazy mode, the random walk curve is not
+		created, because it needs the road network of all cells."""
 	
 		scene = bpy.context.scene
 						
 		# Root
 		root = bpy.data.objects.new(name=name, object_data=None)
 		
+		# Cells shown in more than 'FLAT' detail get generated before the terrain, which they can modify
+		lods = [self.cell_lod(cell, camera_position) for cell in self.city_cells]
+		self.generate_visible(camera_position)
+		
 		# Terrain
 		self.terrain.create_blender_object(root)
+		number_of_steps = 2.0 + len(self.city_cells)
+		yield (root, 1.0 / number_of_steps)
 		
 		# Primary Roads
 		parent = bpy.data.objects.new('primary_roads', None)
 		parent.parent = root
 		bpy.context.scene.objects.link(parent)
 	
-		i = 0
-		for key in self.roads:
-			i += 1
-			road = self.roads[key]
-			self.__create_blender_road(parent, 'primary_road_' + str(i), road)
+		if self.bake_primary_roads:
+			mesh = assets.create_mesh('primary_roads', *self.bake_primary_roads_mesh())
+			mesh.materials.append(assets.get_material('primary_road', (0.15, 0.15, 0.15)))
+			road_obj = bpy.data.objects.new('primary_roads_mesh', mesh)
+			road_obj.parent = parent
+			bpy.context.scene.objects.link(road_obj)
+		else:
+			i = 0
+			for key in self.roads:
+				i += 1
+				road = self.roads[key]
+				self.__create_blender_road(parent, 'primary_road_' + str(i), road)
+		yield (root, 2.0 / number_of_steps)
 			
 		# City Cells		
 		i = 0
-		for cell in self.city_cells:
+		for cell, lod in zip(self.city_cells, lods):
 			i += 1
 			cell_parent = bpy.data.objects.new('city_cell_' + str(i), None)
 			bpy.context.scene.objects.link(cell_parent)
 			cell_parent.parent = root
-			cell.create_blender_object(cell_parent)
+			cell.create_blender_object(cell_parent, lod)
+			yield (root, (2.0 + i) / number_of_steps)
 
-		self.__create_blender_curve_for_road(root, 'random walk', self.random_walk(10))
-
-		
-		return root
+		# Random walk needs the full road network, which would generate all cells in lazy mode
+		if not self.lazy:
+			self.__create_blender_curve_for_road(root, 'random walk', self.random_walk(10))
+		yield (root, 1.0)
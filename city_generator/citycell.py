@@ -4,7 +4,7 @@ import math
 import bpy
 import networkx as nx
 
-from . import assets, util, mcb, block
+from . import assets, util, block, building, roadnet
 
 class Cell(object):
 	"""City cell enclosed by primary road cycle."""
@@ -14,6 +14,17 @@ class Cell(object):
 	# Cycles = The primary roads enclosing this city cell. Given as Polygon object.
 	hi_cycle = None # High level: straight edges between primary road intersections
 	lo_cycle = None # Low level: actual flow of primary roads instead of straight edges
+	
+	seed = None # Seed for random generation of the cell contents, so that they do not depend on the order cells are generated in
+	generated = False # Whether the cell contents were generated, see ensure_generated()
+	flushed = False # Whether the contents were dropped by flush() since. Roads and terrain edits are kept.
+	terrain_edits = None # Changes the cell made to the terrain height map, see terrain.Terrain.recorded_edits()
+	
+	flat_texture = 'terrain.jpg' # Image in textures directory for the face shown at 'FLAT' level of detail, or None for plain color
+	flat_texture_size = 50.0 # Side length (in m) covered by one repetition of flat_texture
+	lod = None # Level of detail of the Blender objects: 'FULL', 'BLOCKS' or 'FLAT'
+	__lod_root = None # Blender object under which the objects of all levels of detail are created
+	__lod_objects = None # Dict level of detail -> Blender parent object of the objects for that level
 
 	def __init__(self, city, hi_cycle, lo_cycle):
 		self.hi_cycle = hi_cycle
@@ -24,17 +35,110 @@ class Cell(object):
 		self.hi_cycle.make_clockwise()
 		self.lo_cycle.make_clockwise()
 
-	def create_blender_object(self, root):
-		pass
+	def create_blender_object(self, root, lod='FULL'):
+		"""Create Blender objects for the cell under root, at given level of detail.
+		
+		Levels of detail are 'FULL' (all roads, lots and buildings), 'BLOCKS' (each block as a prism with the
+		average height of its buildings) and 'FLAT' (only the cell outline, as one flat colored face).
+		The level can be changed later using set_lod()."""
+		self.__lod_root = root
+		self.__lod_objects = dict()
+		self.set_lod(lod)
+	
+	def set_lod(self, lod):
+		"""Show given level of detail, and hide the others.
+		
+		The Blender objects for a level are created the first time it is shown, from the generated cell."""
+		if lod not in self.__lod_objects:
+			if lod != 'FLAT':
+				self.ensure_generated()
+			parent = bpy.data.objects.new('lod_' + lod.lower(), None)
+			parent.parent = self.__lod_root
+			bpy.context.scene.objects.link(parent)
+			self._create_lod_objects(parent, lod)
+			self.__lod_objects[lod] = parent
+		for level, parent in self.__lod_objects.items():
+			assets.set_hidden(parent, level != lod)
+		self.lod = lod
+	
+	def _create_lod_objects(self, parent, lod):
+		"""Create Blender objects for given level of detail under parent."""
+		self._create_flat_object(parent)
+	
+	def _create_flat_object(self, parent, color=(0.5, 0.5, 0.5)):
+		"""Flat face covering the cell, following the terrain elevation at its outline.
+		
+		Textured with flat_texture, repeated along X and Y in city coordinates."""
+		vertices = np.zeros((len(self.lo_cycle), 3))
+		vertices[:, 0:2] = self.lo_cycle.vertices
+		vertices[:, 2] = self.terrain.elevations_at(vertices[:, 0:2]) + 0.1
+		mesh = assets.create_mesh('cell', vertices, np.array([0, len(vertices)]), np.arange(len(vertices)))
+		material_name = 'cell_' + type(self).__name__
+		if self.flat_texture is None:
+			mesh.materials.append(assets.get_material(material_name, color))
+		else:
+			assets.set_uvs(mesh, vertices[:, 0:2] / self.flat_texture_size)
+			mesh.materials.append(assets.get_textured_material(material_name, color, self.flat_texture))
+		
+		cell_obj = bpy.data.objects.new('cell', mesh)
+		cell_obj.parent = parent
+		bpy.context.scene.objects.link(cell_obj)
+		return cell_obj
 	
 	def generate(self):
 		pass
 	
+	def ensure_generated(self):
+		"""Generate cell contents, if not done yet.
+		
+		Contents are generated with the cell seed, and the random generator state is restored afterwards.
+		The cell sees the terrain as it was before any cell modified it (City.base_terrain_image), and its own
+		modifications are recorded in terrain_edits. So the result does not depend on which cells were generated
+		before. The terrain then gets the edits of the cells applied in order of the cells, see City.update_terrain().
+		Flushed contents are generated again, the same way, without counting them in the city metrics again."""
+		if self.generated and not self.flushed:
+			return
+		counters = self.city.metrics.as_dict() if self.flushed else None
+		state = random.getstate()
+		random.seed(self.seed)
+		
+		# Only the pixels edited by other cells differ from the base terrain
+		terrain = self.terrain
+		base_image = self.city.base_terrain_image
+		edited = self.city.edited_terrain_pixels
+		composed = terrain.image.flat[edited]
+		terrain.image.flat[edited] = base_image.flat[edited]
+		terrain.record_edits()
+		try:
+			self.generate()
+		finally:
+			edits = terrain.recorded_edits()
+			terrain.image.flat[edits[0]] = base_image.flat[edits[0]]
+			terrain.image.flat[edited] = composed
+		self.terrain_edits = edits
+		
+		random.setstate(state)
+		if counters is not None:
+			self.city.metrics.reset(counters)
+		self.generated = True
+		self.flushed = False
+		self.city.update_terrain(self)
+		self.city.invalidate_full_network()
+	
+	def flush(self):
+		"""Drop the bulk of the generated contents to free memory, see City.iter_generate(). Roads are kept.
+		
+		The cell gets marked as flushed, so that ensure_generated() generates the contents again when needed."""
+		if self.generated:
+			self.flushed = True
+	
 	def full_graph_low(self):
-		graph = nx.Graph()
-		for edge in self.lo_cycle.edges_iter():
-			graph.add_edge(*edge)
-		return graph
+		"""Road network of the primary roads enclosing the cell."""
+		return roadnet.RoadNetwork.from_polygon(self.lo_cycle)
+	
+	def add_to_network(self, builder):
+		"""Add roads of the cell to roadnet.NetworkBuilder, without copying them first."""
+		builder.add_polyline(self.lo_cycle.vertices, closed=True)
 
 
 class LakeCell(Cell):
@@ -42,6 +146,8 @@ class LakeCell(Cell):
 	level = None
 	basins = None
 	water_outline = None
+	outline_samples = 100 # Number of points sampled on circle around each basin, for the water outline
+	flat_texture = None # Plain water color before the lake is generated
 	
 	def __init__(self, city, hi_cycle, lo_cycle):
 		super(LakeCell, self).__init__(city, hi_cycle, lo_cycle)
@@ -66,28 +172,18 @@ class LakeCell(Cell):
 		
 	
 	def __create_outline(self):
-		samples = 100
+		samples = self.outline_samples
 		expand = 3.0
 		
-		angle_step = (2.0 * np.pi) / (samples + 1)
-
-		self.level = +np.inf
-		points = []
-		for basin in self.basins:
-			center, radius, depth = basin
-			angle = 0.0
-			for i in range(samples):
-				x = center[0] + (radius + expand)*math.cos(angle)
-				y = center[1] + (radius + expand)*math.sin(angle)
-				angle += angle_step
-				pt = (x, y)
-				points.append(pt)
-				
-				z = self.terrain.elevation_at(x, y)
-				self.level = min(self.level, z)
+		# Sample circle around each basin
+		angles = np.arange(samples) * ((2.0 * np.pi) / (samples + 1))
+		circle = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+		centers = np.array([center for center, radius, depth in self.basins], dtype=float)
+		radii = np.array([radius for center, radius, depth in self.basins], dtype=float)
+		points = (centers[:, np.newaxis, :] + (radii + expand)[:, np.newaxis, np.newaxis] * circle).reshape(-1, 2)
 		
+		self.level = np.min(self.terrain.elevations_at(points)) - 0.5
 		self.water_outline = util.convex_hull(points)
-		self.level = self.level - 0.5
 			
 
 
@@ -121,11 +217,16 @@ class LakeCell(Cell):
 				d = self.hi_cycle.point_distance(p)
 				noise = random.uniform(-1.0, 1.0) * (d / maxd) * 10.0
 				
-				self.terrain.image[im_y][im_x] += (emboss + noise) / self.terrain.elevation
+				self.terrain.add_to_pixel(im_x, im_y, (emboss + noise) / self.terrain.elevation)
 
 
 
-	def create_blender_object(self, root):
+	def _create_lod_objects(self, root, lod):
+		# Lake not generated yet: only on 'FLAT' level, shown as flat face with water color
+		if not self.generated:
+			return self._create_flat_object(root, (0.1, 0.3, 0.6))
+		
+		# Water surface is the same on all levels of detail
 		# Mesh
 		vertices = []
 		for p in self.water_outline.vertices_iter():
@@ -157,6 +258,7 @@ class RoadsCell(Cell):
 
 	med_cycle = None # Primary road cycle, hi level + intersections with secondary roads
 	graph = None # Graph of secondary roads
+	profile = None # 'URBAN', 'SUBURBAN' or 'RURAL'
 
 	segment_size = None
 	snap_size = None
@@ -171,6 +273,7 @@ class RoadsCell(Cell):
 
 	def __init__(self, city, hi_cycle, lo_cycle, profile):
 		super(RoadsCell, self).__init__(city, hi_cycle, lo_cycle)
+		self.profile = profile
 		
 		if profile == 'URBAN':
 			self.starting_points = 2
@@ -242,7 +345,7 @@ class RoadsCell(Cell):
 
 
 	def generate(self):
-		self.graph = nx.Graph()
+		self.graph = roadnet.RoadNetwork()
 		
 		# __in_med_cycle: list of lists of bools.
 		# __in_med_cycle[i][j] indicates if point j of road i is included in med cycle graph
@@ -252,6 +355,7 @@ class RoadsCell(Cell):
 			self.__mark_in_med_cycle(a, b, 0)
 		
 		# Select starting points and grow in first segments
+		# Extremities are node ids in self.graph
 		starting_points = self.__select_starting_junctions(self.starting_points)
 		extremities = []
 		for edge in starting_points:
@@ -261,8 +365,10 @@ class RoadsCell(Cell):
 			len_ap = math.sqrt(ap[0]**2 + ap[1]**2)
 			ap = (self.segment_size * ap[0] / len_ap, self.segment_size * ap[1] / len_ap)
 			p = (a[0] + ap[0], a[1] + ap[1])
-			self.graph.add_edge(a, p)
-			extremities.append(p)
+			a_id = self.graph.node_for_point(a)
+			p_id = self.graph.node_for_point(p)
+			self.graph.add_edge(a_id, p_id)
+			extremities.append(p_id)
 		
 		# Grow secondary roads
 		grow = True
@@ -278,8 +384,13 @@ class RoadsCell(Cell):
 					new_extremities = new_extremities + add_extremities
 			extremities = new_extremities
 			i += 1
-			if i > max_iterations:
-				grow = False	
+			if grow and i > max_iterations:
+				self.city.metrics.count('roads_cell_growths_max_iterations')
+				grow = False
+		self.city.metrics.count('roads_cell_growths')
+		self.city.metrics.count('roads_cell_growth_iterations', i)
+		self.city.metrics.count('secondary_road_nodes', self.graph.number_of_nodes())
+		self.city.metrics.count('secondary_road_edges', self.graph.number_of_edges())
 
 		# Make med cycle
 		med_cycle = []
@@ -291,21 +402,20 @@ class RoadsCell(Cell):
 		self.med_cycle = util.Polygon(med_cycle)
 		
 		# Flatten terrain
-		self.__original_elevations = dict()
-		for p in self.graph.nodes_iter():
-			self.__original_elevations[p] = self.terrain.elevation_at(*p)
-		for a, b in self.graph.edges_iter():
-			self.terrain.flatten_segment(a, b, self.__original_elevations[a], self.__original_elevations[b])
+		# __original_elevations: array indexed by node id
+		coordinates = self.graph.coordinates
+		self.__original_elevations = np.array([self.terrain.elevation_at(x, y) for x, y in coordinates])
+		for i, j in self.graph.edges():
+			a, b = self.graph.point(i), self.graph.point(j)
+			self.terrain.flatten_segment(a, b, self.__original_elevations[i], self.__original_elevations[j])
 		
 		
-	def __grow_from(self, pt):
-		"""Grow secondary roads from given extremity point."""
+	def __grow_from(self, pt_id):
+		"""Grow secondary roads from given extremity node. Returns list of new extremity nodes."""
 		new_extremities = []
 	
-		prev = None
-		for p in nx.all_neighbors(self.graph, pt):
-			prev = p
-			break
+		prev = self.graph.point(self.graph.neighbors(pt_id)[0])
+		pt = self.graph.point(pt_id)
 		
 		region_per_branch = self.span_angle / self.degree
 		for i in range(self.degree):
@@ -321,12 +431,13 @@ class RoadsCell(Cell):
 			dx = self.segment_size * np.cos(angle)
 			dy = self.segment_size * np.sin(angle)
 			new_pt = (pt[0] + dx, pt[1] + dy)
-			new_edge = (pt, new_pt)
+			new_edge = (pt_id, new_pt)
 			join = (random.uniform(0.0, 1.0) < self.join_probability)
 			snap = self.__snap(new_edge, join)
 			if not snap:
-				self.graph.add_edge(*new_edge)
-				new_extremities.append(new_pt)
+				new_pt_id = self.graph.node_for_point(new_pt)
+				self.graph.add_edge(pt_id, new_pt_id)
+				new_extremities.append(new_pt_id)
 		
 		return new_extremities
 	
@@ -334,9 +445,9 @@ class RoadsCell(Cell):
 	def __snap(self, new_edge, join):
 		"""Span algorithm.
 		
-		Returns True if the proposed new edge should be added. If not it should be rejected.
-		If join is set, the algorithm adds a connecting segment to previously existing roads
-		before returning False."""
+		new_edge is given as (start node id, end point). Returns True if the proposed new edge should be added.
+		If not it should be rejected. If join is set, the algorithm adds a connecting segment to previously
+		existing roads before returning False."""
 		if not self.__inside_cycle_test(new_edge, join):
 			return True
 		elif not self.__edge_intersection_test(new_edge, join):
@@ -348,73 +459,78 @@ class RoadsCell(Cell):
 		else:
 			return False
 		
+	
+	def __split_edge(self, edge, a, b):
+		"""Split edge (node id pair) at projection of point b, and connect node a to it."""
+		c, d = edge
+		proj = self.graph.node_for_point(util.project_on_line((self.graph.point(c), self.graph.point(d)), b))
+		self.graph.remove_edge(c, d)
+		self.graph.add_edge(c, proj)
+		self.graph.add_edge(proj, d)
+		self.graph.add_edge(a, proj)
+		
 		
 	def __node_distance_test(self, new_edge, join):
 		a, b = new_edge
+		pa = self.graph.point(a)
 		snap_size_sq = self.snap_size**2
-			
-		new_edge_len_sq = (a[0] - b[0])**2 + (a[1] - b[1])**2
-			
-		for c in self.graph.nodes_iter():
-			if c is a:
-				continue
 		
-			r = (c[0] - a[0])*(b[0] - a[0]) + (c[1] - a[1])*(b[1] - a[1])
-			r /= new_edge_len_sq
-						
-			dist_sq = np.inf
-			if r < 0.0:
-				continue
-			elif r < 1.0:
-				dist_sq = util.line_to_point_distance_sq(new_edge, c)
-			else:
-				dist_sq = (b[0] - c[0])**2 + (b[1] - c[1])**2
-				
-			if dist_sq < snap_size_sq:
-				if join and (c not in nx.all_neighbors(self.graph, a)):
-					self.graph.add_edge(a, c)
-				return False
-	
-		return True
+		# Squared distance of all nodes to new edge, vectorized
+		ids = self.graph.node_ids()
+		c = self.graph.coordinates[ids]
+		ab = (b[0] - pa[0], b[1] - pa[1])
+		new_edge_len_sq = ab[0]**2 + ab[1]**2
+		r = ((c[:, 0] - pa[0])*ab[0] + (c[:, 1] - pa[1])*ab[1]) / new_edge_len_sq
+		
+		line_dist_sq = (ab[1]*c[:, 0] - ab[0]*c[:, 1] + b[0]*pa[1] - b[1]*pa[0])**2 / new_edge_len_sq
+		end_dist_sq = (b[0] - c[:, 0])**2 + (b[1] - c[:, 1])**2
+		dist_sq = np.where(r < 1.0, line_dist_sq, end_dist_sq)
+		
+		close = (r >= 0.0) & (dist_sq < snap_size_sq) & (ids != a)
+		if not np.any(close):
+			return True
+		
+		c = int(ids[np.argmax(close)])
+		if join and not self.graph.has_edge(a, c):
+			self.graph.add_edge(a, c)
+		return False
 	
 	
 	def __edge_distance_test(self, new_edge, join):
+		"""Returns False if end point b of new_edge is within snap_size of an edge of the graph onto which it projects.
+		
+		All edges are checked, so that the result does not depend on the order of the edges. If join is set, the
+		first such edge not ending at a gets split at the projection of b, and connected to a."""
 		a, b = new_edge
 		snap_size_sq = self.snap_size**2
 
-		for edge in self.graph.edges_iter():
-			if not util.projection_is_on_segment(edge, b):
-				break
-			dist_sq = util.line_to_point_distance_sq(edge, b)	
+		for edge in self.graph.edges():
+			seg = (self.graph.point(edge[0]), self.graph.point(edge[1]))
+			if not util.projection_is_on_segment(seg, b):
+				continue
+			dist_sq = util.line_to_point_distance_sq(seg, b)	
 			if dist_sq < snap_size_sq:
 				if join and (a != edge[0]) and (a != edge[1]):
-					proj = util.project_on_line(edge, b)
-					c, d = edge
-					self.graph.remove_edge(c, d)
-					self.graph.add_edge(c, proj)
-					self.graph.add_edge(proj, d)
-					self.graph.add_edge(a, proj)
+					self.__split_edge(edge, a, b)
 				return False
 
 		return True
 	
 	def __edge_intersection_test(self, new_edge, join):
 		a, b = new_edge
-		for edge in self.graph.edges_iter():
-			if util.segment_intersection(edge, new_edge):
-				if join and (edge[0] not in nx.all_neighbors(self.graph, a)) and (edge[1] not in nx.all_neighbors(self.graph, a)):
-					proj = util.project_on_line(edge, b)
-					c, d = edge
-					self.graph.remove_edge(c, d)
-					self.graph.add_edge(c, proj)
-					self.graph.add_edge(proj, d)
-					self.graph.add_edge(a, proj)
+		new_seg = (self.graph.point(a), b)
+		for edge in self.graph.edges():
+			seg = (self.graph.point(edge[0]), self.graph.point(edge[1]))
+			if util.segment_intersection(seg, new_seg):
+				if join and not self.graph.has_edge(a, edge[0]) and not self.graph.has_edge(a, edge[1]):
+					self.__split_edge(edge, a, b)
 				return False
 		return True
 
 		
 	def __inside_cycle_test(self, new_edge, join):
 		a, b = new_edge
+		pa = self.graph.point(a)
 		vec = lambda a, b: (b[0] - a[0], b[1] - a[1])
 		snap_size_sq = self.snap_size**2
 
@@ -427,40 +543,54 @@ class RoadsCell(Cell):
 					road = self.city.oriented_road_for_edge(*cycle_edge)
 					def dist(i):
 						p = road[i]
-						return (p[0] - a[0])**2 + (p[1] - a[1])**2
+						return (p[0] - pa[0])**2 + (p[1] - pa[1])**2
 						
 					i = min(range(len(road)), key=dist)
-					self.graph.add_edge(a, road[i])
+					self.graph.add_edge(a, self.graph.node_for_point(road[i]))
 					self.__mark_in_med_cycle(cycle_edge[0], cycle_edge[1], i)
 					
 				return False
 		return True
 	
 
+	def road_segments(self):
+		"""Secondary road segments with original terrain elevation at their ends, as (n, 2, 3) array."""
+		edges = np.array(list(self.graph.edges()), dtype=np.int64).reshape(-1, 2)
+		segments = np.empty((len(edges), 2, 3))
+		segments[:, :, 0:2] = self.graph.coordinates[edges]
+		segments[:, :, 2] = self.__original_elevations[edges]
+		return segments
+
+
 	def full_graph_med(self):
-		"""Graph combining secondary roads and surrounding primary road cycle."""
+		"""Road network combining secondary roads and surrounding primary road cycle."""
 		graph = self.graph.copy()
-		for edge in self.med_cycle.edges_iter():
-			graph.add_edge(*edge)
+		for a, b in self.med_cycle.edges_iter():
+			graph.add_edge(graph.node_for_point(a), graph.node_for_point(b))
 		return graph
 		
 	def full_graph_low(self):
-		"""Graph combining secondary roads and surrounding primary road cycle, including shape of primary roads."""
+		"""Road network combining secondary roads and surrounding primary road cycle, including shape of primary roads."""
 		graph = self.graph.copy()
-		for edge in self.lo_cycle.edges_iter():
-			graph.add_edge(*edge)
+		for a, b in self.lo_cycle.edges_iter():
+			graph.add_edge(graph.node_for_point(a), graph.node_for_point(b))
 		return graph
+	
+	def add_to_network(self, builder):
+		builder.add_network(self.graph)
+		super(RoadsCell, self).add_to_network(builder)
 
 
 	def __create_blender_road(self, name, parent, edge):
 		curve = bpy.data.curves.new(name=name, type='CURVE')
 		curve.dimensions = '3D'
 		
-		a, b = edge
+		i, j = edge
+		a, b = self.graph.point(i), self.graph.point(j)
 		polyline = curve.splines.new('POLY')
 		polyline.points.add(1)
-		polyline.points[0].co = (a[0], a[1], self.__original_elevations[a], 1.0)
-		polyline.points[1].co = (b[0], b[1], self.__original_elevations[b], 1.0)
+		polyline.points[0].co = (a[0], a[1], self.__original_elevations[i], 1.0)
+		polyline.points[1].co = (b[0], b[1], self.__original_elevations[j], 1.0)
 		
 		curve_obj = bpy.data.objects.new(name + '_curve', curve)
 		curve_obj.parent = parent
@@ -469,7 +599,7 @@ class RoadsCell(Cell):
 		road.name = name
 		road.parent = parent
 		
-		length = util.distance(*edge)
+		length = util.distance(a, b)
 		segment_length = road.dimensions.x
 
 		extra_length = segment_length * 0.7
@@ -489,13 +619,24 @@ class RoadsCell(Cell):
 		return road
 
 	
-	def create_blender_object(self, root):
+	def _create_lod_objects(self, root, lod):
+		if lod == 'FLAT':
+			return super(RoadsCell, self)._create_lod_objects(root, lod)
+		
+		elif lod == 'BLOCKS':
+			# All roads as one plain curve
+			curve = assets.create_curve('secondary_roads', self.road_segments())
+			curve_obj = bpy.data.objects.new('secondary_roads', curve)
+			curve_obj.parent = root
+			bpy.context.scene.objects.link(curve_obj)
+			return curve_obj
+		
 		parent = bpy.data.objects.new('secondary_roads', None)
 		parent.parent = root
 		bpy.context.scene.objects.link(parent)
 
 		i = 0
-		for edge in self.graph.edges_iter():
+		for edge in self.graph.edges():
 			self.__create_blender_road('secondary_road_'+str(i), parent, edge)
 			i += 1
 		
@@ -505,6 +646,8 @@ class RoadsCell(Cell):
 class BlocksCell(RoadsCell):
 	"""Roads city cell with city blocks containing buildings."""
 	blocks = None # List of CityBlock objects
+	building_batches = None # Dict building type name -> building.BuildingBatch, geometry of the buildings
+	flat_texture = 'secondary_road.jpg' # Paved surface
 	
 	lot_area_range = None
 	building_types = None
@@ -532,18 +675,56 @@ class BlocksCell(RoadsCell):
 
 		# Blocks = areas enclosed by road graph
 		full_graph = self.full_graph_low()
-		block_cycles = mcb.planar_graph_cycles(full_graph)
+		block_cycles = self.city.enclosed_cycles(full_graph)
 
+		self.blocks = block.generate_blocks(self, block_cycles, self.city.workers)
+
+		# Geometry of all buildings of the cell, generated in one batch per building type
+		buildings = [lot.building for blk in self.blocks if blk.valid for lot in blk.lots if lot.building is not None]
+		self.building_batches = building.generate_batches(buildings)
+		
+
+	def flush(self):
+		super(BlocksCell, self).flush()
 		self.blocks = []
-		for cycle in block_cycles:
-			poly = util.Polygon(cycle)
-			blk = block.Block(self, poly)
-			blk.generate()
-			self.blocks.append(blk)
+		self.building_batches = dict()
 		
 
-	def create_blender_object(self, root):
-		super(BlocksCell, self).create_blender_object(root)
+	def __create_blender_block_prisms(self, root):
+		"""One mesh with each block extruded to the average height of its buildings."""
+		outlines, heights = [], []
+		for blk in self.blocks:
+			if not blk.valid:
+				continue
+			block_heights = [lot.building.height for lot in blk.lots
+				if (lot.building is not None) and (getattr(lot.building, 'height', None) is not None)]
+			if len(block_heights) > 0:
+				outlines.append(blk.contracted_cycle.vertices)
+				heights.append(np.mean(block_heights))
+		if len(outlines) == 0:
+			return None
+		
+		offsets, coordinates = util.pack_sequences(outlines)
+		bottoms = self.terrain.elevations_at(coordinates)
+		counts = np.diff(offsets)
+		rings = np.repeat(np.arange(len(outlines)), counts)
+		tops = np.bincount(rings, weights=bottoms) / counts + np.array(heights)
+		vertices, face_offsets, face_indices, _, _ = building.band_meshes(offsets, coordinates, coordinates,
+			bottoms, tops[rings], caps_after=('upper',))
+		
+		mesh = assets.create_mesh('blocks', vertices, face_offsets, face_indices)
+		blocks_obj = bpy.data.objects.new('blocks', mesh)
+		blocks_obj.parent = root
+		bpy.context.scene.objects.link(blocks_obj)
+		return blocks_obj
+	
+	def _create_lod_objects(self, root, lod):
+		super(BlocksCell, self)._create_lod_objects(root, lod)
+		if lod == 'FLAT':
+			return
+		elif lod == 'BLOCKS':
+			self.__create_blender_block_prisms(root)
+			return
 		
 		parent = bpy.data.objects.new('blocks', None)
 		parent.parent = root
@@ -0,0 +1,317 @@
+import numpy as np
+import math
+import json
+import mmap
+import struct
+try:
+	import bpy
+except ImportError:
+	bpy = None # Outside Blender: files can be written and read, but not turned into Blender objects
+
+from . import assets, util, terrain
+
+# Binary city format:
+# Header = magic (4 bytes) + format version (uint32)
+# Then raw data of all arrays, each aligned to `alignment` bytes
+# Then table of contents = UTF-8 JSON, giving offset, dtype and shape of each array, and metadata
+# Footer = offset and length of table of contents (2x uint64) + end magic (4 bytes)
+
+magic = b'CITY'
+end_magic = b'CEND'
+format_version = 1
+alignment = 64
+
+_header = struct.Struct('<4sI')
+_footer = struct.Struct('<QQ4s')
+
+
+def _to_city_coordinates(vertices, location, rotation):
+	"""Rotate (n, 3) vertices around Z axis, and translate them by location."""
+	c, s = math.cos(rotation), math.sin(rotation)
+	result = np.empty_like(vertices)
+	result[:, 0] = c*vertices[:, 0] - s*vertices[:, 1] + location[0]
+	result[:, 1] = s*vertices[:, 0] + c*vertices[:, 1] + location[1]
+	result[:, 2] = vertices[:, 2] + location[2]
+	return result
+
+
+class CityWriter(object):
+	"""Writes city to file in binary city format.
+
+	Arrays are written out as soon as they are given, only the small table of contents is kept in memory.
+	So a city can be streamed out cell by cell, while it is being generated. Usage:
+		with CityWriter(path) as writer:
+			for event in city.iter_generate(flush=True):
+				if event.type == 'cell':
+					writer.write_cell(event.component)
+				elif event.type == 'terrain_final':
+					writer.write_terrain(event.component)
+			writer.write_primary_roads(city)
+	"""
+	metadata = None # Dict with metadata for whole city, stored in table of contents
+
+	__file = None
+	__arrays = None
+	__cells = None
+
+	def __init__(self, path):
+		self.metadata = dict()
+		self.__arrays = dict()
+		self.__cells = []
+		self.__file = open(path, 'wb')
+		self.__file.write(_header.pack(magic, format_version))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def write_array(self, name, array):
+		"""Write NumPy array under given name."""
+		array = np.ascontiguousarray(array)
+		position = self.__file.tell()
+		padding = (-position) % alignment
+		self.__file.write(b'\0' * padding)
+		self.__arrays[name] = (position + padding, array.dtype.str, array.shape)
+		self.__file.write(array.tobytes())
+
+	def write_terrain(self, terrain):
+		self.metadata['terrain'] = {
+			'side_length': terrain.side_length,
+			'elevation': terrain.elevation
+		}
+		self.write_array('terrain/image', terrain.image.astype(np.float32))
+
+	def write_primary_roads(self, city):
+		"""Write primary roads polylines, with their original terrain elevations."""
+		roads = [city.road_with_elevations(road) for road in city.roads.values()]
+		offsets, coordinates = util.pack_sequences(roads, 3)
+		self.write_array('roads/offsets', offsets)
+		self.write_array('roads/coordinates', coordinates)
+
+	def write_cell(self, cell):
+		"""Write one city cell with all its contents."""
+		cell.ensure_generated()
+		i = len(self.__cells)
+		prefix = 'cells/' + str(i) + '/'
+		cell_metadata = { 'type': type(cell).__name__ }
+		self.__cells.append(cell_metadata)
+
+		self.write_array(prefix + 'outline', np.array(cell.lo_cycle.vertices))
+
+		if hasattr(cell, 'water_outline'):
+			cell_metadata['level'] = cell.level
+			self.write_array(prefix + 'water', np.array(cell.water_outline.vertices))
+
+		if hasattr(cell, 'profile'):
+			cell_metadata['profile'] = cell.profile
+			self.write_array(prefix + 'roads', cell.road_segments())
+
+		if hasattr(cell, 'blocks'):
+			self.__write_blocks(prefix, cell.blocks)
+
+	def __write_blocks(self, prefix, blocks):
+		blocks = [blk for blk in blocks if blk.valid]
+		lots = [lot for blk in blocks for lot in blk.lots]
+		lot_blocks = [i for i, blk in enumerate(blocks) for lot in blk.lots]
+
+		offsets, coordinates = util.pack_sequences([blk.contracted_cycle.vertices for blk in blocks])
+		self.write_array(prefix + 'blocks/offsets', offsets)
+		self.write_array(prefix + 'blocks/coordinates', coordinates)
+
+		offsets, coordinates = util.pack_sequences([lot.outline.vertices for lot in lots])
+		self.write_array(prefix + 'lots/offsets', offsets)
+		self.write_array(prefix + 'lots/coordinates', coordinates)
+		self.write_array(prefix + 'lots/block', np.array(lot_blocks, dtype=np.int64))
+
+		# Building meshes in city coordinates, packed into one vertex and index buffer
+		# buildings/offsets gives range of faces for each building, and buildings/lot its lot index
+		meshes = []
+		building_faces = [0]
+		building_lots = []
+		for lot_i, lot in enumerate(lots):
+			if lot.building is None:
+				continue
+			location, rotation = lot.building.transform()
+			number_of_faces = 0
+			for vertices, faces in lot.building.meshes():
+				vertices = np.asarray(vertices, dtype=float).reshape(-1, 3)
+				meshes.append( (_to_city_coordinates(vertices, location, rotation), faces) )
+				number_of_faces += len(faces)
+			building_faces.append(building_faces[-1] + number_of_faces)
+			building_lots.append(lot_i)
+
+		vertices, face_offsets, face_indices = util.pack_meshes(meshes)
+		self.write_array(prefix + 'buildings/vertices', vertices.astype(np.float32))
+		self.write_array(prefix + 'buildings/face_offsets', face_offsets)
+		self.write_array(prefix + 'buildings/face_indices', face_indices.astype(np.uint32))
+		self.write_array(prefix + 'buildings/offsets', np.array(building_faces, dtype=np.int64))
+		self.write_array(prefix + 'buildings/lot', np.array(building_lots, dtype=np.int64))
+
+	def write_city_metadata(self, city):
+		"""Store the city generation parameters, and the City.metrics_report() of its generation in the metadata."""
+		self.metadata['seed'] = city.seed
+		self.metadata['urbanization'] = city.urbanization
+		self.metadata['metrics'] = city.metrics_report()
+
+	def write_city(self, city):
+		"""Write whole city. Must be called after city.generate()."""
+		city.ensure_generated()
+		self.write_city_metadata(city)
+		self.write_terrain(city.terrain)
+		self.write_primary_roads(city)
+		for cell in city.city_cells:
+			self.write_cell(cell)
+
+	def close(self):
+		"""Write table of contents, and close the file."""
+		if self.__file is None:
+			return
+		toc = {
+			'metadata': self.metadata,
+			'cells': self.__cells,
+			'arrays': self.__arrays
+		}
+		data = json.dumps(toc).encode('utf-8')
+		position = self.__file.tell()
+		self.__file.write(data)
+		self.__file.write(_footer.pack(position, len(data), end_magic))
+		self.__file.close()
+		self.__file = None
+
+
+def write_city(city, path):
+	"""Write whole city to file in binary city format."""
+	with CityWriter(path) as writer:
+		writer.write_city(city)
+
+
+
+class CityFile(object):
+	"""Reader for the binary city format.
+
+	The file is memory-mapped, and arrays are returned as read-only views into it. So opening even a large city
+	file is fast, and only the parts which are accessed get loaded."""
+	metadata = None # Dict with metadata for whole city
+	cells = None # List of dicts with metadata for each cell
+
+	__file = None
+	__map = None
+	__arrays = None
+
+	def __init__(self, path):
+		self.__file = open(path, 'rb')
+		self.__map = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		file_magic, version = _header.unpack_from(self.__map, 0)
+		if file_magic != magic:
+			raise Exception("Not a city file.")
+		if version != format_version:
+			raise Exception("Unsupported city file version.")
+		toc_position, toc_length, file_end_magic = _footer.unpack_from(self.__map, len(self.__map) - _footer.size)
+		if file_end_magic != end_magic:
+			raise Exception("Incomplete city file.")
+
+		toc = json.loads(self.__map[toc_position:toc_position+toc_length].decode('utf-8'))
+		self.metadata = toc['metadata']
+		self.cells = toc['cells']
+		self.__arrays = toc['arrays']
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+	def close(self):
+		"""Unmap the file. Arrays obtained from it must no longer be in use."""
+		if self.__map is not None:
+			self.__map.close()
+			self.__file.close()
+			self.__map = None
+			self.__file = None
+
+	def has_array(self, name):
+		return name in self.__arrays
+
+	def array(self, name):
+		"""Read-only array view for given array name."""
+		offset, dtype, shape = self.__arrays[name]
+		dtype = np.dtype(dtype)
+		count = int(np.prod(shape))
+		return np.frombuffer(self.__map, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+	def cell_array(self, i, name):
+		return self.array('cells/' + str(i) + '/' + name)
+
+	def terrain(self):
+		"""Terrain object with the stored height map."""
+		ter = terrain.Terrain()
+		ter.side_length = self.metadata['terrain']['side_length']
+		ter.elevation = self.metadata['terrain']['elevation']
+		ter.set_image(self.array('terrain/image'))
+		return ter
+
+	def primary_roads(self):
+		"""List of (n, 3) arrays, points of each primary road with elevation."""
+		return util.unpack_sequences(self.array('roads/offsets'), self.array('roads/coordinates'))
+
+	def blocks(self, i):
+		"""List of contracted block outlines of cell i, as (n, 2) arrays."""
+		return util.unpack_sequences(self.cell_array(i, 'blocks/offsets'), self.cell_array(i, 'blocks/coordinates'))
+
+	def lots(self, i):
+		"""List of lot outlines of cell i, as (n, 2) arrays."""
+		return util.unpack_sequences(self.cell_array(i, 'lots/offsets'), self.cell_array(i, 'lots/coordinates'))
+
+
+	@staticmethod
+	def __create_blender_curve(name, parent, polylines):
+		curve = assets.create_curve(name, polylines)
+		curve_obj = bpy.data.objects.new(name, curve)
+		curve_obj.parent = parent
+		bpy.context.scene.objects.link(curve_obj)
+		return curve_obj
+
+	def __create_blender_cell(self, i, parent):
+		cell = self.cells[i]
+		if 'level' in cell:
+			water = self.cell_array(i, 'water')
+			vertices = np.empty((len(water), 3))
+			vertices[:, 0:2] = water
+			vertices[:, 2] = cell['level']
+			mesh = assets.create_mesh('water', vertices, np.array([0, len(water)]), np.arange(len(water)))
+			water_obj = bpy.data.objects.new('water', mesh)
+			water_obj.parent = parent
+			bpy.context.scene.objects.link(water_obj)
+
+		if 'profile' in cell:
+			self.__create_blender_curve('secondary_roads', parent, self.cell_array(i, 'roads'))
+
+		if self.has_array('cells/' + str(i) + '/buildings/vertices'):
+			mesh = assets.create_mesh('buildings',
+				self.cell_array(i, 'buildings/vertices'),
+				self.cell_array(i, 'buildings/face_offsets'),
+				self.cell_array(i, 'buildings/face_indices')
+			)
+			buildings_obj = bpy.data.objects.new('buildings', mesh)
+			buildings_obj.parent = parent
+			bpy.context.scene.objects.link(buildings_obj)
+
+	def create_blender_object(self, name):
+		"""Create Blender objects for the stored city.
+
+		Roads are created as plain curves, and the buildings of each cell as one single mesh."""
+		root = bpy.data.objects.new(name=name, object_data=None)
+
+		self.terrain().create_blender_object(root)
+		self.__create_blender_curve('primary_roads', root, self.primary_roads())
+
+		for i in range(len(self.cells)):
+			cell_parent = bpy.data.objects.new('city_cell_' + str(i + 1), None)
+			bpy.context.scene.objects.link(cell_parent)
+			cell_parent.parent = root
+			self.__create_blender_cell(i, cell_parent)
+
+		return root
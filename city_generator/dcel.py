@@ -0,0 +1,198 @@
+# Face extraction on a doubly connected edge list (DCEL), alternative to mcb
+
+import numpy as np
+
+from . import roadnet, mcb
+
+
+def _half_edges(network):
+	"""Half-edges of the network as arrays (source, destination, twin).
+
+	Each undirected edge gives two half-edges, twin[h] is the index of the opposite half-edge of h."""
+	indptr, indices = network.csr()
+	n = len(indptr) - 1
+	src = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+	dst = indices
+	keys = src * n + dst
+	order = np.argsort(keys)
+	twin = order[np.searchsorted(keys[order], dst * n + src)]
+	return src, dst, twin
+
+
+def _bridges(network, twin):
+	"""Bool array indicating for each half-edge whether its edge is a bridge.
+
+	Bridges are the edges which lie on no cycle (filaments, and edges connecting otherwise separate parts).
+	Uses iterative depth-first search (Tarjan)."""
+	indptr, indices = network.csr()
+	indptr, indices, twin = indptr.tolist(), indices.tolist(), twin.tolist()
+	n = len(indptr) - 1
+	is_bridge = [False] * len(indices)
+	discovery = [-1] * n
+	low = [0] * n
+	position = list(indptr[:-1])
+	time = 0
+
+	for root in range(n):
+		if discovery[root] >= 0 or indptr[root] == indptr[root + 1]:
+			continue
+		discovery[root] = low[root] = time
+		time += 1
+		stack = [(root, -1)] # (vertex, half-edge through which it was reached)
+		while stack:
+			v, via = stack[-1]
+			h = position[v]
+			if h < indptr[v + 1]:
+				position[v] += 1
+				if via >= 0 and h == twin[via]:
+					continue
+				w = indices[h]
+				if discovery[w] < 0:
+					discovery[w] = low[w] = time
+					time += 1
+					stack.append((w, h))
+				elif discovery[w] < low[v]:
+					low[v] = discovery[w]
+			else:
+				stack.pop()
+				if via >= 0:
+					u = stack[-1][0]
+					if low[v] < low[u]:
+						low[u] = low[v]
+					if low[v] > discovery[u]:
+						is_bridge[via] = is_bridge[twin[via]] = True
+
+	return np.array(is_bridge, dtype=bool)
+
+
+def _faces_with_holes(faces, edge_faces, p, q, areas, coordinates):
+	"""Indices of the bounded faces which contain another part of the network.
+
+	Each part has one outer face (negative area). A bounded face contains the part if it contains the first vertex of
+	the outer face, and does not have that vertex on its boundary. Edges p->q of the faces are given as arrays,
+	edge_faces holds the face of each edge. Uses crossings of a horizontal ray from the vertex."""
+	holes = set()
+	outer = np.flatnonzero(areas < 0.0)
+	if len(outer) < 2:
+		return []
+	for f in outer.tolist():
+		v = faces[f][0]
+		x, y = coordinates[v]
+		straddles = (p[:, 1] > y) != (q[:, 1] > y)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			crossing_x = p[:, 0] + (y - p[:, 1]) * (q[:, 0] - p[:, 0]) / (q[:, 1] - p[:, 1])
+		crossings = np.bincount(edge_faces[straddles & (crossing_x > x)], minlength=len(faces))
+		for g in np.flatnonzero((crossings % 2 == 1) & (areas > 0.0)).tolist():
+			if v not in faces[g]:
+				holes.add(g)
+	return sorted(holes)
+
+
+def planar_network_faces(network):
+	"""Bounded faces of the planar embedding of roadnet.RoadNetwork.
+
+	Bridges are removed first, so that like with mcb.planar_network_cycles() filaments are not part of the faces.
+	Then the outgoing half-edges of each vertex are sorted by angle, which gives the next-pointers of the DCEL, and
+	the faces are enumerated by following them. This takes O(E log d) instead of the repeated clockwise-most searches
+	of the minimal cycle basis. Faces which contain another part of the network, or touch it from inside at a vertex,
+	are dropped: they would need holes, and blocks made from them would overlap those of the inner part.
+	Returns list of cycles, each given as list of node ids, starting at its leftmost vertex. The network is not
+	modified."""
+	src, dst, twin = _half_edges(network)
+	if len(src) == 0:
+		return []
+	kept = np.flatnonzero(~_bridges(network, twin))
+	if len(kept) == 0:
+		return []
+
+	coordinates = network.coordinates
+	d = coordinates[dst[kept]] - coordinates[src[kept]]
+	angles = np.arctan2(d[:, 1], d[:, 0])
+
+	# Outgoing half-edges of each vertex in counter-clockwise order
+	order = kept[np.lexsort((angles, src[kept]))]
+	sorted_src = src[order]
+	first = np.flatnonzero(np.r_[True, sorted_src[1:] != sorted_src[:-1]])
+	last = np.r_[first[1:], len(order)] - 1
+	block_start = np.repeat(first, last - first + 1)
+	block_end = np.repeat(last, last - first + 1)
+
+	# Next outgoing half-edge in clockwise order around the same vertex
+	positions = np.arange(len(order))
+	previous = np.where(positions == block_start, block_end, positions - 1)
+	clockwise_next = np.full(len(src), -1, dtype=np.int64)
+	clockwise_next[order] = order[previous]
+
+	# Face to the left of u->v continues with the edge after v->u in clockwise order around v
+	next_edge = np.full(len(src), -1, dtype=np.int64)
+	next_edge[kept] = clockwise_next[twin[kept]]
+
+	face = np.full(len(src), -1, dtype=np.int64)
+	next_list, src_list = next_edge.tolist(), src.tolist()
+	faces = []
+	for h in kept.tolist():
+		if face[h] >= 0:
+			continue
+		face_id = len(faces)
+		cycle = []
+		while face[h] < 0:
+			face[h] = face_id
+			cycle.append(src_list[h])
+			h = next_list[h]
+		faces.append(cycle)
+
+	# Signed area of each face: bounded faces are counter-clockwise, the outer face of each component clockwise
+	p, q = coordinates[src[kept]], coordinates[dst[kept]]
+	areas = np.bincount(face[kept], weights=p[:, 0]*q[:, 1] - q[:, 0]*p[:, 1], minlength=len(faces))
+	bounded = areas > 0.0
+	bounded[_faces_with_holes(faces, face[kept], p, q, areas, coordinates)] = False
+	# Boundary passing twice through a vertex: another part touches the face from inside
+	bounded &= np.array([len(set(cycle)) == len(cycle) for cycle in faces], dtype=bool)
+
+	point = network.point
+	cycles = []
+	for cycle, is_bounded in zip(faces, bounded):
+		if not is_bounded:
+			continue
+		start = min(range(len(cycle)), key=lambda i: point(cycle[i]))
+		cycles.append(cycle[start:] + cycle[:start])
+	cycles.sort(key=lambda cycle: point(cycle[0]))
+	return cycles
+
+
+def planar_graph_faces(graph):
+	"""Bounded faces of graph embedding, same cycles as mcb.planar_graph_cycles().
+
+	graph is given as roadnet.RoadNetwork, or as undirected NetworkX Graph object whose nodes are (float, float)
+	tuples. Returns list of cycles, each given as list of (float, float) points. The order of the cycles and
+	of their vertices can differ from that of mcb.planar_graph_cycles().
+	The results differ where the graph is not a proper planar embedding (crossing or overlapping edges, zero-area
+	cycles), and for faces containing a nested part: these are always dropped here, while mcb.planar_graph_cycles()
+	keeps or drops them depending on where the nested part is attached. Use cross_check() to compare both on a
+	given graph."""
+	if isinstance(graph, roadnet.RoadNetwork):
+		network = graph
+	else:
+		network = roadnet.RoadNetwork.from_networkx(graph)
+
+	cycles = planar_network_faces(network)
+	return [[network.point(v) for v in cycle] for cycle in cycles]
+
+
+def _cycle_edges(cycle):
+	"""Cycle as set of undirected edges, independent of its starting vertex and direction."""
+	return frozenset(frozenset((a, b)) for a, b in zip(cycle, cycle[1:] + cycle[:1]))
+
+
+def cross_check(graph):
+	"""Compare planar_graph_faces() with mcb.planar_graph_cycles() on the same graph.
+
+	Returns (missing, extra): cycles of the minimal cycle basis which were not found as faces, and faces which are
+	not in the minimal cycle basis. Both are empty if the two agree."""
+	if not isinstance(graph, roadnet.RoadNetwork):
+		graph = roadnet.RoadNetwork.from_networkx(graph)
+	mcb_cycles = {_cycle_edges(cycle): cycle for cycle in mcb.planar_graph_cycles(graph)}
+	faces = {_cycle_edges(cycle): cycle for cycle in planar_graph_faces(graph)}
+	missing = [cycle for key, cycle in mcb_cycles.items() if key not in faces]
+	extra = [cycle for key, cycle in faces.items() if key not in mcb_cycles]
+	return missing, extra
@@ -1,7 +1,6 @@
 # based on 'The Minimal Cycle Basis for a Planar Graph', David Eberly
 
-import networkx as nx
-import functools
+from . import roadnet
 
 class Primitive:
 	type = None # Can be 'ISOLATED_VERTEX', 'FILAMENT', 'MINIMAL_CYCLE'
@@ -10,248 +9,275 @@ class Primitive:
 	def __init__(self, type):
 		self.vertices = []
 		self.type = type
-	
-	def mark_cycle_edges(self, graph):
-		v0 = self.vertices[0]
-		for v1 in self.vertices[1:]:
-			graph.edge[v0][v1]['cycle_edge'] = True
-			v0 = v1
-		graph.edge[v0][self.vertices[0]]['cycle_edge'] = True
 
-def vertex_cmp(a, b):
-	lower = (a[0] < b[0]) or ((a[0] == b[0]) and (a[1] < b[1]))
-	return 1 if lower else -1
 
+def dot_perp(v0, v1):
+	x0, y0 = v0
+	x1, y1 = v1
+	return x0*y1 - x1*y0
 
-def num_adjacent(graph, vertex):
-	if not graph.has_node(vertex):
-		return 0
-	else:
-		neighbors = nx.all_neighbors(graph, vertex)
-		return len(list(neighbors))
 
-def adjacent(graph, vertex):
-	if not graph.has_node(vertex):
-		return None
-	else:
-		neighbors = nx.all_neighbors(graph, vertex)
-		return list(neighbors)
+class _Extractor(object):
+	"""Extraction of primitives from road network. Removes nodes and edges from the network."""
+	graph = None # roadnet.RoadNetwork, vertices are integer node ids
+	heap = None # Remaining vertices, sorted such that last one is the leftmost
+	primitives = None
+	cycle_edges = None # Set of (v0, v1) vertex pairs marked as cycle edges, in both orders
 
+	def __init__(self, graph):
+		self.graph = graph
+		self.primitives = []
+		self.cycle_edges = set()
+		point = graph.point
+		self.heap = sorted(graph.nodes(), key=lambda v: point(v), reverse=True)
 
-def extract_isolated_vertex(graph, v0, heap, primitives):
-	primitive = Primitive('ISOLATED_VERTEX')
-	primitive.vertices.append(v0)
-	heap.remove(v0)
-	graph.remove_node(v0)
-	primitives.append(v0)
+	def num_adjacent(self, vertex):
+		if not self.graph.has_node(vertex):
+			return 0
+		else:
+			return self.graph.degree(vertex)
 
-def is_cycle_edge(graph, v0, v1):
-	return 'cycle_edge' in graph.edge[v0][v1]
+	def adjacent(self, vertex):
+		if not self.graph.has_node(vertex):
+			return None
+		else:
+			return self.graph.neighbors(vertex)
 
-def extract_filament(graph, v0, v1, heap, primitives):
-	if is_cycle_edge(graph, v0, v1):
-		if num_adjacent(graph, v0) >= 3:
-			graph.remove_edge(v0, v1)
+	def mark_cycle_edges(self, primitive):
+		v0 = primitive.vertices[0]
+		for v1 in primitive.vertices[1:] + [v0]:
+			self.cycle_edges.add((v0, v1))
+			self.cycle_edges.add((v1, v0))
 			v0 = v1
-			if num_adjacent(graph, v0) == 1:
-				v1 = adjacent(graph, v0)[0]
-		
-		while num_adjacent(graph, v0) == 1:
-			v1 = adjacent(graph, v0)[0]
-			if is_cycle_edge(graph, v0, v1):
-				heap.remove(v0)
+
+	def is_cycle_edge(self, v0, v1):
+		return (v0, v1) in self.cycle_edges
+
+	def extract_isolated_vertex(self, v0):
+		primitive = Primitive('ISOLATED_VERTEX')
+		primitive.vertices.append(v0)
+		self.heap.remove(v0)
+		self.graph.remove_node(v0)
+		self.primitives.append(primitive)
+
+	def extract_filament(self, v0, v1):
+		graph, heap = self.graph, self.heap
+		num_adjacent, adjacent = self.num_adjacent, self.adjacent
+
+		if self.is_cycle_edge(v0, v1):
+			if num_adjacent(v0) >= 3:
 				graph.remove_edge(v0, v1)
+				v0 = v1
+				if num_adjacent(v0) == 1:
+					v1 = adjacent(v0)[0]
+
+			while num_adjacent(v0) == 1:
+				v1 = adjacent(v0)[0]
+				if self.is_cycle_edge(v0, v1):
+					heap.remove(v0)
+					graph.remove_edge(v0, v1)
+					graph.remove_node(v0)
+					v0 = v1
+				else:
+					break
+
+			if num_adjacent(v0) == 0:
+				heap.remove(v0)
 				graph.remove_node(v0)
+
+		else:
+			primitive = Primitive('FILAMENT')
+
+			if num_adjacent(v0) >= 3:
+				primitive.vertices.append(v0)
+				graph.remove_edge(v0, v1)
 				v0 = v1
-			else:
-				break
-		
-		if num_adjacent(graph, v0) == 0:
-			heap.remove(v0)
-			graph.remove_node(v0)
-	
-	else:
-		primitive = Primitive('FILAMENT')
-		
-		if num_adjacent(graph, v0) >= 3:
-			primitive.vertices.append(v0)
-			graph.remove_edge(v0, v1)
-			v0 = v1
-			if num_adjacent(graph, v0) == 1:
-				v1 = adjacent(graph, v0)[0]
+				if num_adjacent(v0) == 1:
+					v1 = adjacent(v0)[0]
 
-		while num_adjacent(graph, v0) == 1:
-			primitive.vertices.append(v0)
-			v1 = adjacent(graph, v0)[0]
-			heap.remove(v0)
-			graph.remove_edge(v0, v1)
-			graph.remove_node(v0)
-			v0 = v1
-		
-		primitive.vertices.append(v0)
-		if num_adjacent(graph, v0) == 0:
-			if v0 in heap:
+			while num_adjacent(v0) == 1:
+				primitive.vertices.append(v0)
+				v1 = adjacent(v0)[0]
 				heap.remove(v0)
+				graph.remove_edge(v0, v1)
 				graph.remove_node(v0)
+				v0 = v1
 
-		primitives.append(primitive)
+			primitive.vertices.append(v0)
+			if num_adjacent(v0) == 0:
+				if v0 in heap:
+					heap.remove(v0)
+					graph.remove_node(v0)
 
-def dot_perp(v0, v1):
-	x0, y0 = v0
-	x1, y1 = v1
-	return x0*y1 - x1*y0
+			self.primitives.append(primitive)
 
+	def get_clockwise_most(self, vprev, vcurr):
+		if self.num_adjacent(vcurr) == 0:
+			return None
 
-def get_clockwise_most(graph, vprev, vcurr):
-	if num_adjacent(graph, vcurr) == 0:
-		return None
-	
-	vnext = None
-
-	adj = adjacent(graph, vcurr)
-	for vadj in adj:
-		if vadj is not vprev:
-			vnext = vadj
-			break
-	if vnext is None:
-		return None
-		
-	if vprev is not None:
-		dcurr = (vcurr[0] - vprev[0], vcurr[1] - vprev[1])
-	else:
-		dcurr = (0, -1)
-	dnext = (vnext[0] - vcurr[0], vnext[1] - vcurr[1])
-	
-	vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
-
-	for vadj in adj:
-		dadj = (vadj[0] - vcurr[0], vadj[1] - vcurr[1])
-		if vcurrIsConvex:
-			if (dot_perp(dcurr, dadj) < 0) or (dot_perp(dnext, dadj) < 0):
+		vnext = None
+
+		adj = self.adjacent(vcurr)
+		for vadj in adj:
+			if vadj != vprev:
 				vnext = vadj
-				dnext = dadj
-				vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+				break
+		if vnext is None:
+			return None
+
+		point = self.graph.point
+		pcurr = point(vcurr)
+		if vprev is not None:
+			pprev = point(vprev)
+			dcurr = (pcurr[0] - pprev[0], pcurr[1] - pprev[1])
 		else:
-			if (dot_perp(dcurr, dadj) < 0) and (dot_perp(dnext, dadj) < 0):
-				vnext = vadj
-				dnext = dadj
-				vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
-	
-	return vnext
-
-
-def get_counterclockwise_most(graph, vprev, vcurr):
-	if num_adjacent(graph, vcurr) == 0:
-		return None
-	
-	vnext = None
-
-	adj = adjacent(graph, vcurr)
-	for vadj in adj:
-		if vadj is not vprev:
-			vnext = vadj
-			break
-	if vnext is None:
-		return None
-	
-	if vprev is not None:
-		dcurr = (vcurr[0] - vprev[0], vcurr[1] - vprev[1])
-	else:
-		dcurr = (0, -1)
-	dnext = (vnext[0] - vcurr[0], vnext[1] - vcurr[1])
-	
-	vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
-
-	for vadj in adj:
-		dadj = (vadj[0] - vcurr[0], vadj[1] - vcurr[1])
-		if vcurrIsConvex:
-			if (dot_perp(dcurr, dadj) > 0) and (dot_perp(dnext, dadj) > 0):
+			dcurr = (0, -1)
+		pnext = point(vnext)
+		dnext = (pnext[0] - pcurr[0], pnext[1] - pcurr[1])
+
+		vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+
+		for vadj in adj:
+			padj = point(vadj)
+			dadj = (padj[0] - pcurr[0], padj[1] - pcurr[1])
+			if vcurrIsConvex:
+				if (dot_perp(dcurr, dadj) < 0) or (dot_perp(dnext, dadj) < 0):
+					vnext = vadj
+					dnext = dadj
+					vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+			else:
+				if (dot_perp(dcurr, dadj) < 0) and (dot_perp(dnext, dadj) < 0):
+					vnext = vadj
+					dnext = dadj
+					vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+
+		return vnext
+
+	def get_counterclockwise_most(self, vprev, vcurr):
+		if self.num_adjacent(vcurr) == 0:
+			return None
+
+		vnext = None
+
+		adj = self.adjacent(vcurr)
+		for vadj in adj:
+			if vadj != vprev:
 				vnext = vadj
-				dnext = dadj
-				vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+				break
+		if vnext is None:
+			return None
+
+		point = self.graph.point
+		pcurr = point(vcurr)
+		if vprev is not None:
+			pprev = point(vprev)
+			dcurr = (pcurr[0] - pprev[0], pcurr[1] - pprev[1])
 		else:
-			if (dot_perp(dcurr, dadj) > 0) or (dot_perp(dnext, dadj) > 0):
-				vnext = vadj
-				dnext = dadj
-				vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
-	
-	return vnext
-
-
-
-def extract_primitive(graph, v0, heap, primitives):
-	visited = set()
-	sequence = [v0]
-	
-	v1 = get_clockwise_most(graph, None, v0)
-	vprev = v0
-	vcurr = v1
-		
-	while (vcurr != None) and (vcurr != v0) and (vcurr not in visited):
-		sequence.append(vcurr)
-		visited.add(vcurr)
-		vnext = get_counterclockwise_most(graph, vprev, vcurr)
-		vprev = vcurr
-		vcurr = vnext
-	
-	if vcurr is None:
-		extract_filament(graph, vprev, adjacent(graph, vprev)[0], heap, primitives)
-		
-	elif vcurr is v0:
-		primitive = Primitive('MINIMAL_CYCLE')
-		primitive.vertices = primitive.vertices + sequence
-		primitive.mark_cycle_edges(graph)
-		primitives.append(primitive)
-		graph.remove_edge(v0, v1)
-		if num_adjacent(graph, v0) == 1:
-			extract_filament(graph, v0, adjacent(graph, v0)[0], heap, primitives)
-		if num_adjacent(graph, v1) == 1:
-			extract_filament(graph, v1, adjacent(graph, v1)[0], heap, primitives)
-
-	else:
-		adj = adjacent(graph, v0)
-		while len(adj) == 2:
-			if adj[0] is not v1:
-				v1 = v0
-				v0 = adj[0]
+			dcurr = (0, -1)
+		pnext = point(vnext)
+		dnext = (pnext[0] - pcurr[0], pnext[1] - pcurr[1])
+
+		vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+
+		for vadj in adj:
+			padj = point(vadj)
+			dadj = (padj[0] - pcurr[0], padj[1] - pcurr[1])
+			if vcurrIsConvex:
+				if (dot_perp(dcurr, dadj) > 0) and (dot_perp(dnext, dadj) > 0):
+					vnext = vadj
+					dnext = dadj
+					vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
 			else:
-				v1 = v0
-				v0 = adj[1]
-			adj = adjacent(graph, v0)
-		extract_filament(graph, v0, v1, heap, primitives)
-
-
-def extract_primitives(graph, primitives):
-	heap = sorted(graph.nodes(), key=functools.cmp_to_key(vertex_cmp))
-	i = 0
-	while len(heap) > 0:
-		i += 1
-		if i > 1000:
-			break
-
-		vertex = heap[-1]
-		adj = adjacent(graph, vertex)
-		if len(adj) == 0:
-			extract_isolated_vertex(graph, vertex, heap, primitives)
-		elif len(adj) == 1:
-			extract_filament(graph, vertex, adj[0], heap, primitives)
+				if (dot_perp(dcurr, dadj) > 0) or (dot_perp(dnext, dadj) > 0):
+					vnext = vadj
+					dnext = dadj
+					vcurrIsConvex = (dot_perp(dnext, dcurr) <= 0)
+
+		return vnext
+
+	def extract_primitive(self, v0):
+		visited = set()
+		sequence = [v0]
+
+		v1 = self.get_clockwise_most(None, v0)
+		vprev = v0
+		vcurr = v1
+
+		while (vcurr is not None) and (vcurr != v0) and (vcurr not in visited):
+			sequence.append(vcurr)
+			visited.add(vcurr)
+			vnext = self.get_counterclockwise_most(vprev, vcurr)
+			vprev = vcurr
+			vcurr = vnext
+
+		if vcurr is None:
+			self.extract_filament(vprev, self.adjacent(vprev)[0])
+
+		elif vcurr == v0:
+			primitive = Primitive('MINIMAL_CYCLE')
+			primitive.vertices = primitive.vertices + sequence
+			self.mark_cycle_edges(primitive)
+			self.primitives.append(primitive)
+			self.graph.remove_edge(v0, v1)
+			if self.num_adjacent(v0) == 1:
+				self.extract_filament(v0, self.adjacent(v0)[0])
+			if self.num_adjacent(v1) == 1:
+				self.extract_filament(v1, self.adjacent(v1)[0])
+
 		else:
-			extract_primitive(graph, vertex, heap, primitives)
+			adj = self.adjacent(v0)
+			while len(adj) == 2:
+				if adj[0] != v1:
+					v1 = v0
+					v0 = adj[0]
+				else:
+					v1 = v0
+					v0 = adj[1]
+				adj = self.adjacent(v0)
+			self.extract_filament(v0, v1)
+
+	def extract_primitives(self):
+		heap = self.heap
+		# Each iteration removes at least one vertex or edge, so more iterations only happen on non-planar input
+		max_iterations = self.graph.number_of_nodes() + self.graph.number_of_edges() + 1
+		i = 0
+		while len(heap) > 0:
+			i += 1
+			if i > max_iterations:
+				break
+
+			vertex = heap[-1]
+			adj = self.adjacent(vertex)
+			if len(adj) == 0:
+				self.extract_isolated_vertex(vertex)
+			elif len(adj) == 1:
+				self.extract_filament(vertex, adj[0])
+			else:
+				self.extract_primitive(vertex)
 
 
 
+def planar_network_cycles(network):
+	"""Compute minimal cycle basis on roadnet.RoadNetwork.
+
+	Returns list of cycles, each given as list of node ids. The network is not modified."""
+	extractor = _Extractor(network.copy())
+	extractor.extract_primitives()
+	return [primitive.vertices for primitive in extractor.primitives if primitive.type == 'MINIMAL_CYCLE']
+
+
 def planar_graph_cycles(graph):
 	"""Compute minimal cycle basis on graph embedding.
-	
-	graph is given as an undirected NetworkX Graph object. Nodes must be (float, float) tuples
-	giving X, Y coordinates. Returns list of cycles. Each cycle given as list of nodes.
+
+	graph is given as roadnet.RoadNetwork, or as undirected NetworkX Graph object whose nodes are (float, float) tuples
+	giving X, Y coordinates. Returns list of cycles. Each cycle given as list of (float, float) points.
 	Minimal cycle basis means all other cycles in the graph can be constructed by XORing a subset
 	of these cycles. For the city street graph these correspond to the regions enclosed by roads."""
-	
-	primitives = []
-	cycles = []
-	extract_primitives(graph, primitives)
-	for primitive in primitives:
-		if primitive.type == 'MINIMAL_CYCLE':
-			cycles.append(primitive.vertices)
-	return cycles
\ No newline at end of file
+
+	if isinstance(graph, roadnet.RoadNetwork):
+		network = graph
+	else:
+		network = roadnet.RoadNetwork.from_networkx(graph)
+
+	cycles = planar_network_cycles(network)
+	return [[network.point(v) for v in cycle] for cycle in cycles]
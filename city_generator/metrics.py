@@ -0,0 +1,32 @@
+class Metrics(object):
+	"""Counters of events during city generation, by name.
+
+	Components count into the metrics of their city, e.g. city.metrics.count('blocks_invalid'). Counters are plain
+	integers in a dict, so they can be pickled with a cache stage, or sent back from a worker process as the
+	difference to the state before it did its work (see difference() and add())."""
+	counters = None # Dict name -> count
+
+	def __init__(self, counters=None):
+		self.counters = dict(counters or {})
+
+	def count(self, name, n=1):
+		"""Increment counter name by n."""
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def get(self, name):
+		return self.counters.get(name, 0)
+
+	def add(self, counters):
+		"""Add dict of counts to the counters."""
+		for name, n in counters.items():
+			self.count(name, n)
+
+	def difference(self, counters):
+		"""Dict of counts added since the counters were as in given dict."""
+		return dict((name, n - counters.get(name, 0)) for name, n in self.counters.items() if n != counters.get(name, 0))
+
+	def reset(self, counters=None):
+		self.counters = dict(counters or {})
+
+	def as_dict(self):
+		return dict(self.counters)
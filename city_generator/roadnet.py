@@ -0,0 +1,217 @@
+import numpy as np
+import networkx as nx
+
+class RoadNetwork(object):
+	"""Undirected planar road graph with integer node ids.
+
+	Node coordinates are stored in a (n, 2) array indexed by node id, and adjacency as one insertion-ordered dict
+	per node. So graph operations never need to hash coordinates. Nodes get consecutive ids in order of insertion.
+	Lookup of node by its coordinates is only done when explicitly requested with node_for_point(), used where
+	a network needs to be joined with other roads (e.g. primary roads points).
+	Compressed sparse row adjacency arrays for read-only algorithms are obtained using csr()."""
+
+	__coordinates = None # Array of node coordinates, with spare capacity
+	__alive = None # Bool array indicating for each node id whether node was not removed
+	__adjacency = None # List of dicts, keys are neighbor ids of each node
+	__count = 0 # Number of node ids in use
+	__point_index = None # Dict point tuple -> node id
+	__csr = None # Cached CSR arrays, reset on each modification
+
+	def __init__(self, capacity=64):
+		self.__coordinates = np.empty((capacity, 2))
+		self.__alive = np.zeros(capacity, dtype=bool)
+		self.__adjacency = []
+		self.__count = 0
+		self.__point_index = dict()
+
+	def __grow(self):
+		capacity = 2 * len(self.__coordinates)
+		coordinates = np.empty((capacity, 2))
+		coordinates[:self.__count] = self.__coordinates[:self.__count]
+		alive = np.zeros(capacity, dtype=bool)
+		alive[:self.__count] = self.__alive[:self.__count]
+		self.__coordinates = coordinates
+		self.__alive = alive
+
+	def add_node(self, p):
+		"""Add new node at point p. Returns its id."""
+		if self.__count == len(self.__coordinates):
+			self.__grow()
+		i = self.__count
+		self.__coordinates[i] = p
+		self.__alive[i] = True
+		self.__adjacency.append(dict())
+		self.__count += 1
+		self.__point_index.setdefault(tuple(p), i)
+		self.__csr = None
+		return i
+
+	def node_for_point(self, p):
+		"""Id of node at exactly point p, which is added if there is none."""
+		i = self.__point_index.get(tuple(p))
+		if (i is None) or not self.__alive[i]:
+			i = self.add_node(p)
+			self.__point_index[tuple(p)] = i
+		return i
+
+	def add_edge(self, i, j):
+		"""Add edge between nodes i and j. Self-loops are ignored."""
+		if i == j:
+			return
+		self.__adjacency[i][j] = None
+		self.__adjacency[j][i] = None
+		self.__csr = None
+
+	def remove_edge(self, i, j):
+		del self.__adjacency[i][j]
+		if i != j:
+			del self.__adjacency[j][i]
+		self.__csr = None
+
+	def remove_node(self, i):
+		for j in self.__adjacency[i]:
+			if j != i:
+				del self.__adjacency[j][i]
+		self.__adjacency[i] = dict()
+		self.__alive[i] = False
+		self.__csr = None
+
+	def has_node(self, i):
+		return (0 <= i < self.__count) and self.__alive[i]
+
+	def has_edge(self, i, j):
+		return j in self.__adjacency[i]
+
+	def neighbors(self, i):
+		"""List of neighbor ids of node i, in order of insertion of the edges."""
+		return list(self.__adjacency[i])
+
+	def degree(self, i):
+		return len(self.__adjacency[i])
+
+	def point(self, i):
+		"""Coordinates of node i, as (float, float) tuple."""
+		x, y = self.__coordinates[i]
+		return (float(x), float(y))
+
+	@property
+	def coordinates(self):
+		"""(n, 2) array of coordinates, indexed by node id. Contains entries for removed nodes."""
+		return self.__coordinates[:self.__count]
+
+	def node_ids(self):
+		"""Array of ids of nodes that were not removed, in increasing order."""
+		return np.flatnonzero(self.__alive[:self.__count])
+
+	def nodes(self):
+		return [int(i) for i in self.node_ids()]
+
+	def number_of_nodes(self):
+		return int(np.count_nonzero(self.__alive[:self.__count]))
+
+	def number_of_edges(self):
+		return sum(len(adj) for adj in self.__adjacency) // 2
+
+	def edges(self):
+		"""Iterator over edges (i, j). Each edge is given once."""
+		seen = set()
+		for i in range(self.__count):
+			for j in self.__adjacency[i]:
+				if j not in seen:
+					yield (i, j)
+			seen.add(i)
+
+	def edge_points(self):
+		"""Iterator over edges, given as pair of point tuples."""
+		for i, j in self.edges():
+			yield (self.point(i), self.point(j))
+
+	def csr(self):
+		"""Compressed sparse row adjacency (indptr, indices).
+
+		Neighbors of node i are indices[indptr[i]:indptr[i+1]]. Arrays are indexed by node id, removed nodes
+		have no neighbors. Result is cached until the network gets modified."""
+		if self.__csr is None:
+			degrees = np.array([len(adj) for adj in self.__adjacency], dtype=np.int64)
+			indptr = np.zeros(self.__count + 1, dtype=np.int64)
+			np.cumsum(degrees, out=indptr[1:])
+			indices = np.fromiter(
+				(j for adj in self.__adjacency for j in adj),
+				dtype=np.int64, count=indptr[-1]
+			)
+			self.__csr = (indptr, indices)
+		return self.__csr
+
+	def copy(self):
+		net = RoadNetwork(max(len(self.__coordinates), 1))
+		net.__coordinates[:self.__count] = self.__coordinates[:self.__count]
+		net.__alive[:self.__count] = self.__alive[:self.__count]
+		net.__adjacency = [dict(adj) for adj in self.__adjacency]
+		net.__count = self.__count
+		net.__point_index = dict(self.__point_index)
+		return net
+
+	def to_networkx(self):
+		"""NetworkX graph with the point tuples as nodes."""
+		graph = nx.Graph()
+		points = [self.point(i) for i in range(self.__count)]
+		for i in self.node_ids():
+			graph.add_node(points[i])
+		for i, j in self.edges():
+			graph.add_edge(points[i], points[j])
+		return graph
+
+	@staticmethod
+	def from_networkx(graph):
+		"""Road network from NetworkX graph whose nodes are (float, float) point tuples."""
+		net = RoadNetwork(max(graph.number_of_nodes(), 1))
+		for p in graph.adj:
+			net.node_for_point(p)
+		# Keep the neighbor order of the NetworkX adjacency
+		for p, neighbors in graph.adj.items():
+			adjacency = net.__adjacency[net.node_for_point(p)]
+			for q in neighbors:
+				adjacency[net.node_for_point(q)] = None
+		return net
+
+	@staticmethod
+	def from_polygon(polygon):
+		"""Road network of the cycle formed by the edges of given polygon."""
+		net = RoadNetwork(max(len(polygon), 1))
+		for a, b in polygon.edges_iter():
+			net.add_edge(net.node_for_point(a), net.node_for_point(b))
+		return net
+
+
+
+class NetworkBuilder(object):
+	"""Builds one road network by merging several networks and polylines in a single pass.
+
+	Nodes at exactly the same coordinates are merged, and edges given more than once are added only once.
+	So roads shared between several parts, such as primary roads between two city cells, appear once."""
+	__network = None
+
+	def __init__(self, capacity=64):
+		self.__network = RoadNetwork(capacity)
+
+	def add_network(self, net):
+		"""Add all nodes and edges of given RoadNetwork."""
+		result = self.__network
+		ids = dict((i, result.node_for_point(net.point(i))) for i in net.nodes())
+		for i, j in net.edges():
+			result.add_edge(ids[i], ids[j])
+
+	def add_polyline(self, points, closed=False):
+		"""Add edges joining successive points. If closed, also join last point to first."""
+		if len(points) < 2:
+			return
+		result = self.__network
+		ids = [result.node_for_point(p) for p in points]
+		for i, j in zip(ids[:-1], ids[1:]):
+			result.add_edge(i, j)
+		if closed:
+			result.add_edge(ids[-1], ids[0])
+
+	def network(self):
+		"""The merged RoadNetwork."""
+		return self.__network
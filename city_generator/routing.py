@@ -0,0 +1,285 @@
+import numpy as np
+import heapq
+import math
+
+class Router(object):
+	"""Shortest path queries on a roadnet.RoadNetwork, with edges weighted by their length.
+
+	Single queries use A* with the Euclidean distance to the target as heuristic. Batches of queries are grouped
+	by source, and answered with one Dijkstra search per source. Optionally, a contraction hierarchy can be
+	precomputed using contract(), after which single queries use bidirectional search on it instead of A*.
+	The router takes a snapshot of the network: it must be recreated when the network gets modified."""
+	network = None
+
+	__coordinates = None # List of (x, y) tuples, indexed by node id
+	__adjacency = None # List of lists of (neighbor, length) pairs, indexed by node id
+
+	__ch_upward = None # Contraction hierarchy: list of lists of (higher ranked neighbor, length)
+	__ch_middle = None # Dict (u, w) -> v: shortcut u-w replaces path u-v-w. Keys in both orders.
+
+	def __init__(self, network):
+		self.network = network
+		indptr, indices = network.csr()
+		coordinates = network.coordinates
+		rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+		lengths = np.hypot(*(coordinates[indices] - coordinates[rows]).T)
+
+		self.__coordinates = [tuple(p) for p in coordinates.tolist()]
+		indptr, indices, lengths = indptr.tolist(), indices.tolist(), lengths.tolist()
+		self.__adjacency = [
+			list(zip(indices[indptr[i]:indptr[i+1]], lengths[indptr[i]:indptr[i+1]]))
+			for i in range(len(indptr) - 1)
+		]
+
+	def nearest_node(self, p):
+		"""Id of network node nearest to point p."""
+		ids = self.network.node_ids()
+		d = self.network.coordinates[ids] - p
+		return int(ids[np.argmin(d[:, 0]**2 + d[:, 1]**2)])
+
+	@staticmethod
+	def __path(parents, node):
+		path = []
+		while node is not None:
+			path.append(node)
+			node = parents[node]
+		path.reverse()
+		return path
+
+
+	def shortest_path(self, src, dst):
+		"""Shortest path from node src to node dst, as list of node ids. None if they are not connected."""
+		if self.__ch_upward is not None:
+			return self.__ch_shortest_path(src, dst)
+
+		coordinates, adjacency = self.__coordinates, self.__adjacency
+		tx, ty = coordinates[dst]
+		heuristic = lambda v: math.hypot(coordinates[v][0] - tx, coordinates[v][1] - ty)
+
+		distances = { src: 0.0 }
+		parents = { src: None }
+		settled = set()
+		queue = [(heuristic(src), src)]
+		while queue:
+			_, u = heapq.heappop(queue)
+			if u == dst:
+				return self.__path(parents, dst)
+			if u in settled:
+				continue
+			settled.add(u)
+			du = distances[u]
+			for v, length in adjacency[u]:
+				dv = du + length
+				if dv < distances.get(v, np.inf):
+					distances[v] = dv
+					parents[v] = u
+					heapq.heappush(queue, (dv + heuristic(v), v))
+		return None
+
+	def __dijkstra(self, src, targets=None):
+		"""Dijkstra search from src. Stops once all targets (set of node ids) are settled, if given.
+
+		Returns (distances, parents) dicts."""
+		adjacency = self.__adjacency
+		remaining = set(targets) if targets is not None else None
+		distances = { src: 0.0 }
+		parents = { src: None }
+		settled = set()
+		queue = [(0.0, src)]
+		while queue:
+			du, u = heapq.heappop(queue)
+			if u in settled:
+				continue
+			settled.add(u)
+			if remaining is not None:
+				remaining.discard(u)
+				if not remaining:
+					break
+			for v, length in adjacency[u]:
+				dv = du + length
+				if dv < distances.get(v, np.inf):
+					distances[v] = dv
+					parents[v] = u
+					heapq.heappush(queue, (dv, v))
+		return (distances, parents)
+
+	def distance_matrix(self, sources, targets):
+		"""Shortest path lengths from each source to each target node, as (len(sources), len(targets)) array.
+
+		Unreachable pairs get infinite length."""
+		matrix = np.full((len(sources), len(targets)), np.inf)
+		for i, src in enumerate(sources):
+			distances, _ = self.__dijkstra(src, targets)
+			for j, dst in enumerate(targets):
+				matrix[i, j] = distances.get(dst, np.inf)
+		return matrix
+
+	def shortest_paths(self, pairs):
+		"""Shortest paths for list of (src, dst) node pairs. Returns list of paths (or None), in same order.
+
+		Pairs with the same source are answered by one single search."""
+		by_source = dict()
+		for k, (src, dst) in enumerate(pairs):
+			by_source.setdefault(src, []).append(k)
+
+		paths = [None] * len(pairs)
+		for src, ks in by_source.items():
+			_, parents = self.__dijkstra(src, [pairs[k][1] for k in ks])
+			for k in ks:
+				dst = pairs[k][1]
+				if dst in parents:
+					paths[k] = self.__path(parents, dst)
+		return paths
+
+	@staticmethod
+	def edge_usage(paths):
+		"""Number of times each edge is used by the paths. Dict (i, j) -> count, with i < j."""
+		usage = dict()
+		for path in paths:
+			if path is None:
+				continue
+			for i, j in zip(path[:-1], path[1:]):
+				key = (i, j) if i < j else (j, i)
+				usage[key] = usage.get(key, 0) + 1
+		return usage
+
+	def path_length(self, path):
+		coordinates = self.__coordinates
+		return sum(math.hypot(coordinates[j][0] - coordinates[i][0], coordinates[j][1] - coordinates[i][1])
+			for i, j in zip(path[:-1], path[1:]))
+
+
+	def __witness_exists(self, graph, contracted, src, dst, excluded, max_length, max_settled=60):
+		"""Limited Dijkstra search for path from src to dst not via excluded, with length at most max_length."""
+		distances = { src: 0.0 }
+		settled = 0
+		queue = [(0.0, src)]
+		while queue and settled < max_settled:
+			du, u = heapq.heappop(queue)
+			if du > max_length:
+				return False
+			if u == dst:
+				return True
+			if du > distances[u]:
+				continue
+			settled += 1
+			for v, length in graph[u].items():
+				if v == excluded or contracted[v]:
+					continue
+				dv = du + length
+				if dv < distances.get(v, np.inf):
+					distances[v] = dv
+					heapq.heappush(queue, (dv, v))
+		return False
+
+	def __shortcuts(self, graph, contracted, v):
+		"""Shortcuts needed when contracting v, as list of (u, w, length)."""
+		neighbors = [(u, length) for u, length in graph[v].items() if not contracted[u]]
+		shortcuts = []
+		for a, (u, uv) in enumerate(neighbors):
+			for w, vw in neighbors[a+1:]:
+				length = uv + vw
+				if not self.__witness_exists(graph, contracted, u, w, v, length):
+					shortcuts.append( (u, w, length) )
+		return shortcuts
+
+	def contract(self):
+		"""Precompute contraction hierarchy, to speed up subsequent shortest_path() queries.
+
+		Nodes are contracted in order of edge difference (shortcuts added minus edges removed), updated lazily."""
+		n = len(self.__adjacency)
+		graph = [dict() for i in range(n)]
+		for u, edges in enumerate(self.__adjacency):
+			for v, length in edges:
+				graph[u][v] = min(length, graph[u].get(v, np.inf))
+		contracted = [False] * n
+		middle = dict()
+
+		def priority(v):
+			degree = sum(1 for u in graph[v] if not contracted[u])
+			return len(self.__shortcuts(graph, contracted, v)) - degree
+
+		queue = [(priority(v), v) for v in range(n) if len(graph[v]) > 0]
+		heapq.heapify(queue)
+		rank = [n] * n
+		order = 0
+		while queue:
+			_, v = heapq.heappop(queue)
+			# Lazy update: re-insert if priority got worse than the next best node
+			p = priority(v)
+			if queue and p > queue[0][0]:
+				heapq.heappush(queue, (p, v))
+				continue
+
+			for u, w, length in self.__shortcuts(graph, contracted, v):
+				if length < graph[u].get(w, np.inf):
+					graph[u][w] = length
+					graph[w][u] = length
+					middle[(u, w)] = v
+					middle[(w, u)] = v
+			contracted[v] = True
+			rank[v] = order
+			order += 1
+
+		self.__ch_upward = [
+			[(w, length) for w, length in graph[u].items() if rank[w] > rank[u]]
+			for u in range(n)
+		]
+		self.__ch_middle = middle
+
+	def __unpack(self, u, w, path):
+		"""Append original path for hierarchy edge u-w to path, excluding u.
+
+		Uses an explicit stack, because shortcuts over long chains of degree-2 nodes can be nested very deeply."""
+		middle = self.__ch_middle
+		stack = [(u, w)]
+		while stack:
+			u, w = stack.pop()
+			v = middle.get((u, w))
+			if v is None:
+				path.append(w)
+			else:
+				# First half u-v is unpacked first
+				stack.append((v, w))
+				stack.append((u, v))
+
+	def __ch_shortest_path(self, src, dst):
+		upward = self.__ch_upward
+		distances = ({ src: 0.0 }, { dst: 0.0 })
+		parents = ({ src: None }, { dst: None })
+		queues = ([(0.0, src)], [(0.0, dst)])
+		best, meeting = np.inf, None
+
+		while queues[0] or queues[1]:
+			for side in (0, 1):
+				queue = queues[side]
+				if not queue:
+					continue
+				du, u = heapq.heappop(queue)
+				if du > distances[side][u]:
+					continue
+				if du >= best:
+					del queue[:]
+					continue
+				other = distances[1 - side].get(u)
+				if (other is not None) and (du + other < best):
+					best, meeting = du + other, u
+				for w, length in upward[u]:
+					dw = du + length
+					if dw < distances[side].get(w, np.inf):
+						distances[side][w] = dw
+						parents[side][w] = u
+						heapq.heappush(queue, (dw, w))
+
+		if meeting is None:
+			return None
+
+		# Hierarchy path src -> meeting -> dst, then unpack shortcuts
+		up = self.__path(parents[0], meeting)
+		down = self.__path(parents[1], meeting)
+		down.reverse()
+		hierarchy_path = up + down[1:]
+		path = [hierarchy_path[0]]
+		for u, w in zip(hierarchy_path[:-1], hierarchy_path[1:]):
+			self.__unpack(u, w, path)
+		return path
@@ -0,0 +1,96 @@
+import numpy as np
+
+from . import util
+
+class _Level(object):
+	"""Polygons of one level of the spatial index, packed with their bounding boxes."""
+	objects = None # List of the indexed objects
+	offsets = None # Packed polygon offsets, see util.pack_sequences()
+	coordinates = None # Packed polygon coordinates
+	boxes = None # (n, 4) array of bounding boxes (x_min, y_min, x_max, y_max)
+	children = None # Children of polygon i on next level are children[i]:children[i+1]. None on last level.
+
+	def __init__(self, objects, polygons):
+		self.objects = objects
+		self.offsets, self.coordinates = util.pack_sequences(polygons)
+		self.boxes = util.packed_bounding_boxes(self.offsets, self.coordinates)
+
+	def polygon(self, i):
+		return self.coordinates[self.offsets[i]:self.offsets[i+1]]
+
+
+class SpatialIndex(object):
+	"""Hierarchy of bounding boxes over the city cells, their blocks, and the lots of the blocks.
+	
+	Answers batched queries: which cell, block and lot contains each point, and which ones have their bounding
+	box intersect a rectangle. Candidates on each level are only looked for among the children of the previous
+	level, and points are tested against a polygon only if they are in its bounding box.
+	Indices returned by the queries refer to the cells, blocks and lots lists. Built from generated city cells,
+	use City.spatial_index()."""
+	cells = None # List of indexed city cells
+	blocks = None # List of blocks of all cells
+	lots = None # List of lots of all valid blocks
+	
+	__levels = None # List of _Level for cells, blocks and lots
+
+	def __init__(self, city_cells):
+		self.cells = list(city_cells)
+		cell_blocks = [(cell.blocks or []) if hasattr(cell, 'blocks') else [] for cell in self.cells]
+		self.blocks = [blk for blocks in cell_blocks for blk in blocks]
+		block_lots = [(blk.lots or []) if blk.valid else [] for blk in self.blocks]
+		self.lots = [lot for lots in block_lots for lot in lots]
+		
+		levels = [
+			_Level(self.cells, [cell.lo_cycle.vertices for cell in self.cells]),
+			_Level(self.blocks, [blk.cycle.vertices for blk in self.blocks]),
+			_Level(self.lots, [lot.outline.vertices for lot in self.lots])
+		]
+		for level, children in zip(levels, (cell_blocks, block_lots)):
+			level.children = np.zeros(len(children) + 1, dtype=np.int64)
+			np.cumsum([len(c) for c in children], out=level.children[1:])
+		self.__levels = levels
+
+	def locate(self, points):
+		"""Cell, block and lot containing each of the (n, 2) points.
+		
+		Returns (cells, blocks, lots) arrays of n indices, -1 where the point is not inside any."""
+		points = np.asarray(points, dtype=float).reshape(-1, 2)
+		results = []
+		# Each candidate is (point indices, first, end): points to look for in polygons first to end of the level
+		candidates = [(np.arange(len(points)), 0, len(self.cells))]
+		for level in self.__levels:
+			found = np.full(len(points), -1, dtype=np.int64)
+			next_candidates = []
+			for remaining, first, end in candidates:
+				for i in range(first, end):
+					if len(remaining) == 0:
+						break
+					x_min, y_min, x_max, y_max = level.boxes[i]
+					p = points[remaining]
+					in_box = (p[:, 0] >= x_min) & (p[:, 0] <= x_max) & (p[:, 1] >= y_min) & (p[:, 1] <= y_max)
+					in_box[in_box] = util.points_in_polygon(p[in_box], level.polygon(i))
+					inside = remaining[in_box]
+					remaining = remaining[~in_box] # Polygons of a level do not overlap
+					found[inside] = i
+					if (level.children is not None) and (len(inside) > 0):
+						next_candidates.append( (inside, level.children[i], level.children[i+1]) )
+			results.append(found)
+			candidates = next_candidates
+		return tuple(results)
+
+	def query_rectangle(self, x_min, y_min, x_max, y_max):
+		"""Cells, blocks and lots whose bounding box intersects given rectangle.
+		
+		Returns (cells, blocks, lots) arrays of indices."""
+		results = []
+		candidates = np.arange(len(self.cells))
+		for level in self.__levels:
+			boxes = level.boxes[candidates]
+			hits = candidates[
+				(boxes[:, 0] <= x_max) & (boxes[:, 2] >= x_min) & (boxes[:, 1] <= y_max) & (boxes[:, 3] >= y_min)
+			]
+			results.append(hits)
+			if level.children is not None:
+				ranges = [np.arange(level.children[i], level.children[i+1]) for i in hits]
+				candidates = np.concatenate(ranges) if len(ranges) > 0 else np.zeros(0, dtype=np.int64)
+		return tuple(results)
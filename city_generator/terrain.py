@@ -1,7 +1,11 @@
 import numpy as np
 import random
 import math
-import bpy
+
+try:
+	import bpy
+except ImportError:
+	bpy = None # Outside Blender: the height map can be used, but no Blender objects created
 
 from . import assets, util
 
@@ -16,6 +20,7 @@ class HeightMap(object):
 	
 	image_side_length = None # Image side length in pixel
 	image = None # Numpy ndarray of terrain, with shape (pixel_side_length, pixel_side_length)
+	pyramid = None # List of images, each half the resolution of the previous, starting with image. See build_pyramid().
 	
 	def __square(self, pos, r, d):
 		x, y = pos
@@ -49,22 +54,49 @@ class HeightMap(object):
 		return np.mean(values)
 	
 	
-	def __subdivide(self, full, d):
+	def __subdivide(self, full, d, progress=None):
 		half = full // 2
 		if(half < 1):
 			return
+		
+		# Fraction of pixels set before and after this level, for progress reports
+		n = float(self.image_side_length - 1)
+		done, next_done = (n / full)**2 / n**2, (n / half)**2 / n**2
 			
 		for y in range(half, self.image_side_length, full):
+			if progress is not None:
+				progress(done + (next_done - done) * y / (2.0 * self.image_side_length))
 			for x in range(half, self.image_side_length, full):
 				self.__square((x, y), half, d)
 
 		for y in range(0, self.image_side_length, half):
+			if progress is not None:
+				progress(done + (next_done - done) * (0.5 + y / (2.0 * self.image_side_length)))
 			for x in range((y + half)%full, self.image_side_length, full):
 				self.__diamond((x, y), half, d)
 		
-		self.__subdivide(half, d / 2.0)			
+		self.__subdivide(half, d / 2.0, progress)
+	
+	def build_pyramid(self, levels):
+		"""Build self.pyramid with given number of levels below the full resolution image.
+		
+		Each level is smoothed with a [1, 2, 1] / 4 filter and subsampled, so pixel i of a level lies on pixel 2*i
+		of the previous one. Sides of 2^n + 1 pixels stay of that form. The pyramid is not updated when the image
+		gets modified afterwards."""
+		pyramid = [self.image]
+		for level in range(levels):
+			image = pyramid[-1]
+			if image.shape[0] < 3:
+				break
+			padded = np.pad(image, 1, mode='edge')
+			rows = (padded[:-2] + 2.0*padded[1:-1] + padded[2:]) / 4.0
+			smooth = (rows[:, :-2] + 2.0*rows[:, 1:-1] + rows[:, 2:]) / 4.0
+			pyramid.append(smooth[::2, ::2])
+		self.pyramid = pyramid
+		return pyramid
 	
-	def generate(self):
+	def generate(self, progress=None):
+		"""Generate height map by diamond-square subdivision. progress(fraction done) is called for each row, if given."""
 		self.image_side_length = 2**self.resolution + 1
 		self.image = np.empty((self.image_side_length, self.image_side_length))
 		self.image.fill(np.nan)
@@ -74,7 +106,78 @@ class HeightMap(object):
 		self.image[-1, 0] = random.uniform(*self.initial_height_range)
 		self.image[-1, -1] = random.uniform(*self.initial_height_range)
 
-		self.__subdivide(self.image_side_length - 1, self.roughness)
+		self.__subdivide(self.image_side_length - 1, self.roughness, progress)
+
+
+
+def apply_edits(heights, indices, edits):
+	"""Apply edits (indices, scales, offsets) recorded by Terrain.record_edits() to given heights, in place.
+	
+	heights is the array of heights of the pixels at the sorted flat pixel indices. Pixels not in the edits are
+	unchanged."""
+	edit_indices, scales, offsets = edits
+	if len(edit_indices) == 0 or len(indices) == 0:
+		return
+	positions = np.minimum(np.searchsorted(edit_indices, indices), len(edit_indices) - 1)
+	edited = (edit_indices[positions] == indices)
+	positions = positions[edited]
+	heights[edited] = scales[positions] * heights[edited] + offsets[positions]
+
+
+def rtin_triangles(heights, max_error):
+	"""Right-triangulated irregular network (RTIN) on (n, n) grid of heights, with n = 2^k + 1.
+	
+	Starting from the two halves of the grid, triangles are split at the midpoint of their hypotenuse while the
+	height there differs by more than max_error from the linear interpolation, for the triangle or any triangle
+	below it. So neighboring triangles get split together, and there are no T-junctions. The error is only
+	measured at the midpoints, so elsewhere the mesh can deviate slightly more than max_error.
+	Returns (m, 3, 2) integer array of (x, y) grid coordinates of triangle corners, counter-clockwise."""
+	n = heights.shape[0]
+	size = n - 1
+	roots = (
+		np.array([[0, 0], [size, size]]), # a, b: ends of hypotenuse
+		np.array([[size, size], [0, 0]]),
+		np.array([[size, 0], [0, size]]) # c: right angle
+	)
+	def children(a, b, c):
+		m = (a + b) // 2
+		return (np.concatenate([c, b]), np.concatenate([a, c]), np.concatenate([m, m]))
+	
+	# Triangles on each level of the binary tree, down to those whose legs have length 1, which cannot be split
+	levels = []
+	a, b, c = roots
+	while np.abs(a[0] - c[0]).sum() > 1:
+		levels.append((a, b, c))
+		a, b, c = children(a, b, c)
+	
+	# Error at each hypotenuse midpoint, including the errors of the triangles below, computed from bottom up
+	errors = np.zeros((n, n))
+	at = lambda p: (p[:, 1], p[:, 0])
+	for level in reversed(range(len(levels))):
+		a, b, c = levels[level]
+		m = (a + b) // 2
+		error = np.abs((heights[at(a)] + heights[at(b)]) / 2.0 - heights[at(m)])
+		if level < len(levels) - 1:
+			error = np.maximum(error, errors[at((a + c) // 2)])
+			error = np.maximum(error, errors[at((b + c) // 2)])
+		np.maximum.at(errors, at(m), error)
+	
+	# Split triangles from top down
+	triangles = []
+	a, b, c = roots
+	for level in range(len(levels)):
+		split = errors[at((a + b) // 2)] > max_error
+		triangles.append(np.stack([a[~split], b[~split], c[~split]], axis=1))
+		a, b, c = children(a[split], b[split], c[split])
+	triangles.append(np.stack([a, b, c], axis=1))
+	triangles = np.concatenate(triangles)
+	
+	# Make counter-clockwise
+	u = triangles[:, 1] - triangles[:, 0]
+	v = triangles[:, 2] - triangles[:, 0]
+	clockwise = (u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]) < 0
+	triangles[clockwise] = triangles[clockwise][:, ::-1]
+	return triangles
 
 
 
@@ -84,10 +187,34 @@ class Terrain(HeightMap):
 	elevation = 50.0 # Elevation in Y direction
 	
 	pixel_side_length = None # Side length of one image pixel, i.e. side_length / image_side_length
+	mesh_max_error = 0.0 # Max elevation error (in m) of adaptive terrain mesh, see rtin_triangles(). 0 for dense grid with subdivision.
+	triangle_counts = None # (triangles in terrain mesh, triangles in dense grid), set by create_blender_mesh()
+	
+	__edits = None # While recording, dict flat pixel index -> (scale, offset). See record_edits().
+	
+	def create_adaptive_blender_mesh(self, name='terrain'):
+		"""Create blender mesh for the terrain, with fewer triangles where it is flat. See rtin_triangles()."""
+		sl = self.image_side_length
+		triangles = rtin_triangles(self.elevation * self.image, self.mesh_max_error)
+		
+		# Vertices only at the used grid points
+		grid_indices = triangles[:, :, 1] * sl + triangles[:, :, 0]
+		used, face_indices = np.unique(grid_indices.ravel(), return_inverse=True)
+		vertices = np.empty((len(used), 3))
+		vertices[:, 0] = (used % sl) * self.pixel_side_length
+		vertices[:, 1] = (used // sl) * self.pixel_side_length
+		vertices[:, 2] = self.elevation * self.image.ravel()[used]
+		
+		self.triangle_counts = (len(triangles), 2 * (sl - 1)**2)
+		return assets.create_mesh(name, vertices, 3 * np.arange(len(triangles) + 1), face_indices)
 	
 	def create_blender_mesh(self, name='terrain'):
 		"""Create blender mesh for the terrain."""
+		if self.mesh_max_error > 0.0:
+			return self.create_adaptive_blender_mesh(name)
+		
 		sl = self.image_side_length
+		self.triangle_counts = (2 * (sl - 1)**2, 2 * (sl - 1)**2)
 		
 		# Vertex for each point on the image
 		vertices = []		
@@ -148,23 +275,64 @@ class Terrain(HeightMap):
 		mtex.use_map_density = True
 		mtex.mapping = 'FLAT'
 		
-		# Add modifier
-		sub_modifier = terrain_obj.modifiers.new("Subdivision Surface", type='SUBSURF')
+		# Add modifier. Not for adaptive mesh, which is meant to have few faces.
+		if self.mesh_max_error <= 0.0:
+			sub_modifier = terrain_obj.modifiers.new("Subdivision Surface", type='SUBSURF')
 		
 		return terrain_obj
 	
 	
-	def generate(self):
-		super(Terrain, self).generate()
+	def generate(self, progress=None):
+		super(Terrain, self).generate(progress)
+		self.pixel_side_length = self.side_length / self.image_side_length
+	
+	def set_image(self, image):
+		"""Replace the height map by given image, for example one restored from cache."""
+		self.image = image
+		self.pyramid = None
+		self.image_side_length = image.shape[0]
 		self.pixel_side_length = self.side_length / self.image_side_length
 	
+	def record_edits(self):
+		"""Start recording the changes made by flatten_segment() and add_to_pixel(), see recorded_edits()."""
+		self.__edits = dict()
+	
+	def recorded_edits(self):
+		"""Stop recording, and return the changes as arrays (indices, scales, offsets), sorted by flat pixel index.
+		
+		The changes to a pixel are kept as the affine map they amount to: new height = scale * old height + offset.
+		So the edits made on the same terrain by several sources can be applied one after the other with
+		apply_edits(), giving the same heights as if the changes had been made in that order."""
+		edits = self.__edits
+		self.__edits = None
+		indices = np.array(sorted(edits), dtype=np.int64)
+		scales = np.array([edits[i][0] for i in indices], dtype=float).reshape(-1)
+		offsets = np.array([edits[i][1] for i in indices], dtype=float).reshape(-1)
+		return (indices, scales, offsets)
+	
+	def add_to_pixel(self, x_i, y_i, height):
+		"""Add height to the height map pixel at given image coordinates."""
+		self.image[y_i, x_i] += height
+		if self.__edits is not None:
+			i = y_i * self.image_side_length + x_i
+			scale, offset = self.__edits.get(i, (1.0, 0.0))
+			self.__edits[i] = (scale, offset + height)
+	
+	def blend_pixel(self, x_i, y_i, ratio, height):
+		"""Set the height map pixel at given image coordinates to ratio * its height + (1 - ratio) * height."""
+		self.image[y_i, x_i] = ratio*self.image[y_i, x_i] + (1.0 - ratio)*height
+		if self.__edits is not None:
+			i = y_i * self.image_side_length + x_i
+			scale, offset = self.__edits.get(i, (1.0, 0.0))
+			self.__edits[i] = (ratio*scale, ratio*offset + (1.0 - ratio)*height)
+	
 	def to_image(self, x, y):
 		"""From terrain coordinates to image pixel coordinates."""
 		x_ind = int(math.floor(x / self.pixel_side_length))
-		x_ind = min(x_ind, self.side_length - 1)
+		x_ind = min(x_ind, self.image_side_length - 1)
 		x_ind = max(x_ind, 0)			
 		y_ind = int(math.floor(y / self.pixel_side_length))
-		y_ind = min(y_ind, self.side_length - 1)
+		y_ind = min(y_ind, self.image_side_length - 1)
 		y_ind = max(y_ind, 0)
 		return (x_ind, y_ind)
 	
@@ -179,9 +347,21 @@ class Terrain(HeightMap):
 		x_ind, y_ind = self.to_image(x, y)
 		return self.elevation * self.image[y_ind, x_ind]
 
+	def elevations_at(self, points, level=0):
+		"""Terrain elevations at (n, 2) array of terrain coordinates, as array. Same as elevation_at() for each.
+		
+		If level > 0, elevations are taken from that level of the pyramid, which must have been built."""
+		points = np.asarray(points, dtype=float).reshape(-1, 2)
+		image = self.image if level == 0 else self.pyramid[level]
+		indices = np.floor(points / (self.pixel_side_length * 2**level)).astype(np.int64)
+		np.clip(indices, 0, image.shape[0] - 1, out=indices)
+		return self.elevation * image[indices[:, 1], indices[:, 0]]
+
 	def flatten_segment(self, a, b, a_el=None, b_el=None):
 		ab = (b[0] - a[0], b[1] - a[1])
 		ab_len = math.sqrt(ab[0]**2 + ab[1]**2)
+		if ab_len == 0:
+			return
 					
 		w = 4
 		emboss = 0.01 / self.elevation
@@ -219,11 +399,9 @@ class Terrain(HeightMap):
 				p_i = (x_i, y_i)
 				p = self.to_terrain(*p_i)
 				flat = flat_depth(p_i)
-				real = self.image[y_i, x_i]
 				d = abs(util.line_to_point_distance((a, b), p))
 				if d < w * self.pixel_side_length:
 					ratio = d / w
 					ratio = max(0.0, min(ratio, 1.0))**2.0
-					el = ratio*real + (1.0 - ratio)*flat
-					self.image[y_i, x_i] = el
+					self.blend_pixel(x_i, y_i, ratio, flat)
 		
\ No newline at end of file
@@ -1,10 +1,13 @@
 import math
 import numpy as np
+from fractions import Fraction
 
 def line_to_point_distance_sq(line, p):
 	a, b = line
 	num = ( (b[1] - a[1])*p[0] - (b[0] - a[0])*p[1] + b[0]*a[1] - b[1]*a[0] )**2
 	den = (b[1] - a[1])**2 + (b[0] - a[0])**2
+	if den == 0:
+		return np.inf # Degenerate line, never considered close
 	return num / den
 
 def line_to_point_distance(line, p):
@@ -35,6 +38,8 @@ def projection_is_on_segment(seg, p, seg_length=None):
 	"""Check if point p projected on line seg is on the segment."""
 	if seg_length is None:
 		seg_length = distance(*seg)
+	if seg_length == 0:
+		return False
 	a, b = seg
 	ap = (p[0] - a[0], p[1] - a[1])
 	ab = (b[0] - a[0], b[1] - a[1])
@@ -52,20 +57,53 @@ def project_on_line(l, p):
 	dot = ab[0]*ap[0] + ab[1]*ap[1]
 	return (a[0] + dot*ab[0], a[1] + dot*ab[1])
 
+_orientation_error_bound = (3.0 + 16.0 * 2.0**-53) * 2.0**-53 # Relative error bound of the float orientation determinant
+
+def orientation(a, b, c):
+	"""Exact orientation of points a, b, c: 1 if counter-clockwise, -1 if clockwise, 0 if collinear.
+	
+	Uses the float determinant when it is larger than its rounding error bound (Shewchuk's filter), and exact
+	rational arithmetic on the float coordinates otherwise."""
+	detleft = (a[0] - c[0]) * (b[1] - c[1])
+	detright = (a[1] - c[1]) * (b[0] - c[0])
+	det = detleft - detright
+	if abs(det) > _orientation_error_bound * (abs(detleft) + abs(detright)):
+		return 1 if det > 0 else -1
+	
+	ax, ay, bx, by, cx, cy = (Fraction(float(v)) for v in (a[0], a[1], b[0], b[1], c[0], c[1]))
+	det = (ax - cx) * (by - cy) - (ay - cy) * (bx - cx)
+	return (det > 0) - (det < 0)
+
+def _same_point(p, q):
+	return (p[0] == q[0]) and (p[1] == q[1])
+
 def segment_intersection(seg1, seg2):
-	"""Test whether two segments intersect.
-	 
+	"""Test whether two segments intersect, other than only at a shared endpoint.
+	
 	Segments given as tuple of two points. ((x1, y1), (x2, y2))
-	"""
-	seg1_len = distance(*seg1)
-	seg2_len = distance(*seg2)
-
-	test = lambda seg, seg_len, p: projection_is_on_segment(seg, p, seg_length=seg_len)
+	Touching (an endpoint on the other segment) and overlapping collinear segments count as intersecting.
+	Decided with exact orientation tests, so nearly touching or collinear segments are classified correctly."""
+	(p1, q1), (p2, q2) = seg1, seg2
+	o1 = orientation(p1, q1, p2)
+	o2 = orientation(p1, q1, q2)
+	o3 = orientation(p2, q2, p1)
+	o4 = orientation(p2, q2, q1)
+	if (o1 * o2 > 0) or (o3 * o4 > 0):
+		return False
 	
-	return test(seg1, seg1_len, seg2[0]) \
-		and test(seg1, seg1_len, seg2[1]) \
-		and test(seg2, seg2_len, seg1[0]) \
-		and test(seg2, seg2_len, seg1[1])
+	if (o1 == 0) and (o2 == 0):
+		# Collinear: compare the intervals on the axis along which the segments extend most
+		axis = 0 if abs(q1[0] - p1[0]) + abs(q2[0] - p2[0]) >= abs(q1[1] - p1[1]) + abs(q2[1] - p2[1]) else 1
+		lo1, hi1 = sorted((p1[axis], q1[axis]))
+		lo2, hi2 = sorted((p2[axis], q2[axis]))
+		return max(lo1, lo2) < min(hi1, hi2)
+	
+	# Segments cross or touch in one point. Not counted if that is an endpoint of both.
+	for p in (p1, q1):
+		for q in (p2, q2):
+			if _same_point(p, q):
+				return False
+	return True
 
 
 def line_intersection_point(l1, l2):
@@ -114,40 +152,249 @@ def cycle_pairs(items):
 	yield (prev, items[0])
 
 
+def pack_sequences(sequences, dimensions=2):
+	"""Pack list of point sequences into flat arrays (offsets, coordinates).
+	
+	Points of sequence i are coordinates[offsets[i]:offsets[i+1]]. coordinates has shape (n, dimensions)."""
+	offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+	np.cumsum([len(seq) for seq in sequences], out=offsets[1:])
+	coordinates = np.array([p for seq in sequences for p in seq], dtype=float).reshape(-1, dimensions)
+	return (offsets, coordinates)
+
+
+def unpack_sequences(offsets, coordinates):
+	"""Inverse of pack_sequences. Returns list of array views into coordinates."""
+	return [coordinates[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+
+
+def packed_polygon_successors(offsets):
+	"""For packed polygons with given offsets, arrays (polygons, nxt) with one entry per vertex.
+	
+	polygons gives the index of the polygon the vertex belongs to, and nxt the index of the next vertex in
+	that polygon, wrapping around from last to first."""
+	offsets = np.asarray(offsets)
+	counts = np.diff(offsets)
+	polygons = np.repeat(np.arange(len(counts)), counts)
+	nxt = np.arange(1, offsets[-1] + 1)
+	nonempty = (counts > 0)
+	nxt[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+	return (polygons, nxt)
+
+
+def packed_centers(offsets, coordinates):
+	"""Mean of vertices of each packed polygon, as (n, 2) array. Same as Polygon.center() for each."""
+	counts = np.diff(offsets)
+	polygons = np.repeat(np.arange(len(counts)), counts)
+	centers = np.zeros((len(counts), 2))
+	nonempty = (counts > 0)
+	for axis in (0, 1):
+		sums = np.bincount(polygons, weights=coordinates[:, axis], minlength=len(counts))
+		centers[nonempty, axis] = sums[nonempty] / counts[nonempty]
+	return centers
+
+
+def contract_packed_polygons(offsets, coordinates, dist, min_sin=1e-3, min_length=1e-9):
+	"""Contract polygons given as packed (offsets, coordinates) arrays. Returns new (offsets, coordinates).
+	
+	dist is one distance for all polygons, or array with one for each polygon. Each edge is moved by dist to its
+	right side (inwards for clockwise polygons), and the vertex joining two edges is replaced by the intersection
+	of their moved lines. Zero-length edges are removed first. Two successive edges that are near-parallel (sine
+	of angle below min_sin, independent of edge lengths) are merged into one edge: their joining vertex is
+	removed, instead of getting a far away or unstable intersection point. Result vertices are in same order
+	as input vertices, starting with the one for input vertex 1."""
+	offsets = np.asarray(offsets)
+	coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+	dist = np.broadcast_to(np.asarray(dist, dtype=float), (len(offsets) - 1,))
+	
+	# Remove vertices equal to their successor
+	polygons, nxt = packed_polygon_successors(offsets)
+	d = coordinates[nxt] - coordinates
+	keep = (np.hypot(d[:, 0], d[:, 1]) > min_length)
+	if not np.all(keep):
+		offsets = np.zeros(len(offsets), dtype=np.int64)
+		np.cumsum(np.bincount(polygons[keep], minlength=len(offsets) - 1), out=offsets[1:])
+		coordinates = coordinates[keep]
+		polygons, nxt = packed_polygon_successors(offsets)
+		d = coordinates[nxt] - coordinates
+	
+	# Moved line of each edge i: through p[i], with direction d[i]
+	length = np.hypot(d[:, 0], d[:, 1])
+	normal = np.empty_like(d)
+	normal[:, 0] = d[:, 1] / length
+	normal[:, 1] = -d[:, 0] / length
+	p = coordinates + dist[polygons, np.newaxis] * normal
+	
+	# Intersect moved lines of edges i and nxt[i]
+	da, db = d, d[nxt]
+	cross = da[:, 0]*db[:, 1] - da[:, 1]*db[:, 0]
+	w = p[nxt] - p
+	parallel = (np.abs(cross) <= min_sin * length * length[nxt])
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = (w[:, 0]*db[:, 1] - w[:, 1]*db[:, 0]) / cross
+	intersections = p + t[:, np.newaxis] * da
+	
+	# Merge near-parallel edges
+	kept = ~parallel
+	result_offsets = np.zeros(len(offsets), dtype=np.int64)
+	np.cumsum(np.bincount(polygons[kept], minlength=len(offsets) - 1), out=result_offsets[1:])
+	return (result_offsets, intersections[kept])
+
+
+def contract_polygons(polygons, dist):
+	"""Contract list of Polygon objects in one batch. Returns list of new Polygon objects.
+	
+	dist is one distance for all polygons, or list with one for each polygon. See contract_packed_polygons()."""
+	offsets, coordinates = pack_sequences([polygon.vertices for polygon in polygons])
+	offsets, coordinates = contract_packed_polygons(offsets, coordinates, dist)
+	return [Polygon([tuple(p) for p in coordinates[offsets[i]:offsets[i+1]].tolist()]) for i in range(len(polygons))]
+
+
+def trim_polyline(points, start, end):
+	"""Part of polyline given as (n, d) array, between arc lengths start and end from its first point.
+	
+	Ends are interpolated. Returns None if end <= start."""
+	if end <= start:
+		return None
+	lengths = np.zeros(len(points))
+	np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1), out=lengths[1:])
+	cuts = np.column_stack([np.interp([start, end], lengths, points[:, k]) for k in range(points.shape[1])])
+	inner = points[(lengths > start) & (lengths < end)]
+	return np.concatenate([cuts[0:1], inner, cuts[1:2]])
+
+
+def sweep_packed_polylines(offsets, points, profile, max_miter=3.0):
+	"""Mesh of cross-section swept along packed 3D polylines, as buffers (vertices, face_offsets, face_indices).
+	
+	profile is (k, 2) array of (offset to the left, height) points, ordered from right to left. At bends, the
+	offsets are scaled (up to max_miter) so that the width stays constant. Vertex j of the cross-section at point i
+	is vertices[i*k + j]. Each polyline must have at least 2 points."""
+	profile = np.asarray(profile, dtype=float)
+	k = len(profile)
+	n = len(points)
+	
+	# Unit directions of segments. Segments joining the last point of a polyline to the first of the next are
+	# not part of any polyline.
+	segments = np.diff(points[:, 0:2], axis=0)
+	segments /= np.maximum(np.hypot(segments[:, 0], segments[:, 1]), 1e-12)[:, np.newaxis]
+	within = np.ones(n - 1, dtype=bool)
+	within[offsets[1:-1] - 1] = False
+	segments[~within] = 0.0
+	
+	# Tangent at each point = mean of directions of adjacent segments. Its length is the cosine of half the bend angle.
+	tangents = np.zeros((n, 2))
+	tangents[:-1] += segments
+	tangents[1:] += segments
+	adjacent = np.full(n, 2.0)
+	adjacent[offsets[:-1]] = 1.0
+	adjacent[offsets[1:] - 1] = 1.0
+	tangents /= adjacent[:, np.newaxis]
+	cos = np.maximum(np.hypot(tangents[:, 0], tangents[:, 1]), 1e-12)
+	miter = 1.0 / np.maximum(cos, 1.0 / max_miter)
+	normals = np.column_stack([-tangents[:, 1], tangents[:, 0]]) * (miter / cos)[:, np.newaxis]
+	
+	vertices = np.repeat(points[:, np.newaxis, :], k, axis=1)
+	vertices[:, :, 0:2] += normals[:, np.newaxis, :] * profile[np.newaxis, :, 0, np.newaxis]
+	vertices[:, :, 2] += profile[:, 1]
+	
+	# Quad between successive cross-sections, for each segment and each edge of the cross-section
+	first = (np.flatnonzero(within)[:, np.newaxis] * k + np.arange(k - 1)).ravel()
+	face_indices = np.column_stack([first, first + k, first + k + 1, first + 1]).ravel()
+	face_offsets = 4 * np.arange(len(first) + 1, dtype=np.int64)
+	return (vertices.reshape(-1, 3), face_offsets, face_indices)
+
+
+def points_in_polygon(points, vertices):
+	"""Bool array telling for each of the (n, 2) points whether it is inside polygon with given (m, 2) vertices.
+	
+	Same even-odd rule as Polygon.contains_point(). Loops over the edges, each tested against all points at once."""
+	points = np.asarray(points, dtype=float).reshape(-1, 2)
+	vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+	x, y = points[:, 0], points[:, 1]
+	inside = np.zeros(len(points), dtype=bool)
+	for (ax, ay), (bx, by) in zip(vertices, np.roll(vertices, -1, axis=0)):
+		crosses = (by > y) != (ay > y)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			x_intersection = (ax - bx) * (y - by) / (ay - by) + bx
+		inside ^= crosses & (x < x_intersection)
+	return inside
+
+
+def packed_bounding_boxes(offsets, coordinates):
+	"""Bounding box (x_min, y_min, x_max, y_max) of each packed polygon, as (n, 4) array. Polygons must not be empty."""
+	boxes = np.empty((len(offsets) - 1, 4))
+	if len(boxes) > 0:
+		boxes[:, 0:2] = np.minimum.reduceat(coordinates, offsets[:-1])
+		boxes[:, 2:4] = np.maximum.reduceat(coordinates, offsets[:-1])
+	return boxes
+
+
+def pack_meshes(meshes):
+	"""Pack list of meshes into flat buffers (vertices, face_offsets, face_indices).
+	
+	Each mesh is given as (vertices, faces), where faces is list of vertex index lists. The vertex indices of
+	face i are face_indices[face_offsets[i]:face_offsets[i+1]], and refer to the packed (n, 3) vertices array."""
+	vertices = [np.asarray(v, dtype=float).reshape(-1, 3) for v, f in meshes]
+	vertex_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+	np.cumsum([len(v) for v in vertices], out=vertex_offsets[1:])
+	
+	face_lengths = [len(face) for v, f in meshes for face in f]
+	face_offsets = np.zeros(len(face_lengths) + 1, dtype=np.int64)
+	np.cumsum(face_lengths, out=face_offsets[1:])
+	face_indices = np.empty(face_offsets[-1], dtype=np.int64)
+	i = 0
+	for mesh_i, (v, faces) in enumerate(meshes):
+		for face in faces:
+			face_indices[i:i+len(face)] = face
+			face_indices[i:i+len(face)] += vertex_offsets[mesh_i]
+			i += len(face)
+	
+	if len(vertices) > 0:
+		vertices = np.concatenate(vertices)
+	else:
+		vertices = np.empty((0, 3))
+	return (vertices, face_offsets, face_indices)
+
+
 def turn_direction(a, b, c):
 	ba = (a[0] - b[0], a[1] - b[1])
 	bc = (c[0] - b[0], c[1] - b[1])
 	return ba[0]*bc[1] - ba[1]*bc[0]
 
 
+def convex_hull_indices(points):
+	"""Indices of the points on the convex hull of (n, 2) array points, in counter-clockwise order.
+	
+	Uses the monotone chain algorithm, on the points sorted by X and then Y. Points on the inside of hull
+	edges are not included."""
+	points = np.asarray(points, dtype=float).reshape(-1, 2)
+	n = len(points)
+	order = np.lexsort((points[:, 1], points[:, 0]))
+	if n < 3:
+		return order
+	xs, ys = points[order, 0].tolist(), points[order, 1].tolist()
+	
+	def chain(indices):
+		# Keep only left turns
+		hull = []
+		for i in indices:
+			while len(hull) >= 2:
+				a, b = hull[-2], hull[-1]
+				if (xs[b] - xs[a])*(ys[i] - ys[a]) - (ys[b] - ys[a])*(xs[i] - xs[a]) > 0:
+					break
+				hull.pop()
+			hull.append(i)
+		return hull
+	
+	lower = chain(range(n))
+	upper = chain(range(n - 1, -1, -1))
+	return order[lower[:-1] + upper[:-1]]
+
+
 def convex_hull(points):
-	points.sort(key=lambda p: p[0])
-	upper = []
-	upper.append(points[0])
-	upper.append(points[1])
-	for i in range(2, len(points)):
-		p = points[i]
-		upper.append(p)
-		l = len(upper) - 1
-		while (len(upper) > 2) and (turn_direction(upper[l-2], upper[l-1], upper[l]) > 0):
-			del upper[l - 1]
-			l = len(upper) - 1
-	
-	points.sort(key=lambda p: -p[0])
-	lower = []
-	lower.append(points[0])
-	lower.append(points[1])
-	for i in range(2, len(points)):
-		p = points[i]
-		lower.append(p)
-		l = len(lower) - 1
-		while (len(lower) > 2) and (turn_direction(lower[l-2], lower[l-1], lower[l]) > 0):
-			del lower[l - 1]
-			l = len(lower) - 1
-
-	poly = upper + lower[1:-2]
-	return Polygon(poly)
-			
+	"""Convex hull of list or (n, 2) array of points, as counter-clockwise Polygon."""
+	points = np.asarray(points, dtype=float).reshape(-1, 2)
+	return Polygon([tuple(p) for p in points[convex_hull_indices(points)].tolist()])
+
 
 
 class Polygon:
@@ -191,7 +438,7 @@ class Polygon:
 		c = False
 		for a, b in self.edges_iter():
 			if (b[1] > p[1]) != (a[1] > p[1]):
-				if p[0] < (a[0]-b[0])*(p[1]-b[1])/(a[1]-b[1]) + p[0]:
+				if p[0] < (a[0]-b[0])*(p[1]-b[1])/(a[1]-b[1]) + b[0]:
 					c = not c
 		return c
 
@@ -231,24 +478,9 @@ class Polygon:
 		return abs(area / 2.0)
 		
 	def contract(self, dist):
-		contracted_segments = []
-		for a, b in self.edges_iter():
-			ab = (b[0] - a[0], b[1] - a[1])
-			ap = (ab[1], -ab[0])
-			len_ap = math.sqrt(ap[0]**2 + ap[1]**2)
-			ap = (dist * ap[0] / len_ap, dist * ap[1] / len_ap)
-			p = (a[0] + ap[0], a[1] + ap[1])
-			q = (p[0] + ab[0], p[1] + ab[1])
-			seg = (p, q)
-			contracted_segments.append(seg)
-		
-		contracted_points = []
-		for e, f in cycle_pairs(contracted_segments):
-			p = line_intersection_point(e, f)
-			if p is not None:
-				contracted_points.append(p)
-		
-		self.vertices = contracted_points
+		"""Move all edges inwards by dist (for clockwise polygon). See contract_packed_polygons()."""
+		offsets, coordinates = contract_packed_polygons([0, len(self.vertices)], self.vertices, dist)
+		self.vertices = [tuple(p) for p in coordinates.tolist()]
 
 	def expand(self, dist):
 		self.contract(-dist)
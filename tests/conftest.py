@@ -0,0 +1,16 @@
+import os
+import sys
+import types
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# The add-on imports bpy, so the tests using it must run in Blender's Python, e.g.
+#   blender --background --python-expr "import pytest; pytest.main(['tests'])"
+# Elsewhere they are skipped, and the modules which do not need Blender get loaded without the add-on's __init__.py.
+try:
+	import bpy
+except ImportError:
+	package = types.ModuleType('city_generator')
+	package.__path__ = [os.path.join(root, 'city_generator')]
+	sys.modules['city_generator'] = package
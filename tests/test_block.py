@@ -0,0 +1,100 @@
+import multiprocessing
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip('bpy')
+
+from city_generator import block, building, city, util
+
+
+def _city(seed, workers):
+	cit = city.City()
+	cit.seed = seed
+	cit.terrain.side_length = 1000.0
+	cit.terrain.elevation = 10.0
+	cit.building_quantization = 1.0
+	cit.workers = workers
+	cit.generate()
+	return cit
+
+
+def _blocks(cit):
+	return [cell.blocks for cell in cit.city_cells if getattr(cell, 'blocks', None)]
+
+
+def _assert_same_blocks(blocks1, blocks2):
+	arrays1, arrays2 = block.pack_blocks(blocks1), block.pack_blocks(blocks2)
+	assert sorted(arrays1) == sorted(arrays2)
+	for name in arrays1:
+		assert np.array_equal(arrays1[name], arrays2[name], equal_nan=True), name
+	for block1, block2 in zip(blocks1, blocks2):
+		assert block1.cycle.vertices == block2.cycle.vertices
+		for lot1, lot2 in zip(block1.lots or [], block2.lots or []):
+			assert lot1.outer_edges == lot2.outer_edges
+			assert getattr(lot1.building, 'prototype', None) == getattr(lot2.building, 'prototype', None)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+@pytest.mark.parametrize('seed', [1, 2])
+def test_workers_give_same_blocks(seed):
+	serial, parallel = _city(seed, 1), _city(seed, 3)
+	assert len(_blocks(serial)) == len(_blocks(parallel)) > 0
+	for blocks1, blocks2 in zip(_blocks(serial), _blocks(parallel)):
+		_assert_same_blocks(blocks1, blocks2)
+	assert serial.metrics.as_dict() == parallel.metrics.as_dict()
+
+	library = parallel.building_prototypes
+	assert sorted(library.meshes) == sorted(serial.building_prototypes.meshes)
+	instances = [lot.building for blocks in _blocks(parallel) for b in blocks for lot in b.lots or []
+		if lot.building is not None and lot.building.prototype is not None]
+	assert len(instances) > len(library.meshes) > 0
+	for building in instances:
+		assert all(any(mesh is m for m in library.meshes[building.prototype]) for mesh in building.meshes())
+
+
+def test_unpacked_blocks_equal_packed_blocks():
+	cit = _city(1, 1)
+	for blocks in _blocks(cit):
+		cell = blocks[0].city_cell
+		unpacked = block.unpack_blocks(cell, [b.cycle.vertices for b in blocks], block.pack_blocks(blocks))
+		_assert_same_blocks(blocks, unpacked)
+		for block1, block2 in zip(blocks, unpacked):
+			assert block1.valid == block2.valid
+			assert (block1.lots is None) == (block2.lots is None)
+			for lot1, lot2 in zip(block1.lots or [], block2.lots or []):
+				assert lot1.outline.vertices == lot2.outline.vertices
+				assert type(lot1.building) is type(lot2.building)
+
+
+def _lot(outline, library):
+	terrain = types.SimpleNamespace(elevations_at=lambda points: np.zeros(len(points)))
+	cit = types.SimpleNamespace(terrain=terrain, building_prototypes=library)
+	return block.Lot(types.SimpleNamespace(city=cit), util.Polygon(outline), [])
+
+
+def test_prototype_footprint_is_set_back_like_batch_footprints():
+	library = building.PrototypeLibrary(1.0)
+	lots = [_lot([(0.0, 0.0), (0.0, 10.0), (20.0, 10.0), (20.0, 0.0)], library),
+		_lot([(50.0, 0.0), (50.0, 10.2), (70.3, 10.2), (70.3, 0.0)], library)]
+	assert np.allclose(lots[0].footprint_size(building.footprint_setback), (16.0, 6.0))
+	assert np.allclose(lots[0].rectangle_pose()[0], (16.0, 8.0))
+	
+	offices = []
+	for lot in lots:
+		office = building.Office(lot)
+		office.rectangle_pose = lot.rectangle_pose()
+		office.height = library.quantize(10.2)
+		office.make_instance(library)
+		offices.append(office)
+	assert offices[0].prototype == offices[1].prototype == ('Office', 6.0, 16.0, 10.0)
+	assert offices[0].mesh is offices[1].mesh
+	assert len(library.meshes) == 1
+	assert np.allclose(offices[1].center, (60.15, 5.1))
+	
+	# Same extents as the contracted footprint from generate_batch()
+	batch_office = building.Office(_lot([(0.0, 0.0), (0.0, 10.0), (20.0, 10.0), (20.0, 0.0)], library))
+	building._lot_footprints([batch_office], building.footprint_setback)
+	vertices = np.array(batch_office.outline.vertices)
+	assert np.allclose(np.sort(np.ptp(vertices, axis=0)), np.sort(np.ptp(np.array(offices[0].outline.vertices), axis=0)))
@@ -0,0 +1,23 @@
+from city_generator import building
+
+
+def test_quantize_keeps_at_least_one_step():
+	library = building.PrototypeLibrary(2.0)
+	assert library.enabled()
+	assert not building.PrototypeLibrary(0.0).enabled()
+	assert [library.quantize(value) for value in (0.0, 0.3, 0.9, 2.9, 3.1, 4.9, 5.2)] == [2.0, 2.0, 2.0, 2.0, 4.0, 4.0, 6.0]
+
+
+def test_prototype_meshes_are_generated_once_per_key():
+	library = building.PrototypeLibrary(1.0)
+	calls = []
+	def generate(key):
+		calls.append(key)
+		return [('mesh', key)]
+	first = library.get(('Office', 6.0, 16.0, 10.0), lambda: generate(1))
+	again = library.get(('Office', 6.0, 16.0, 10.0), lambda: generate(2))
+	other = library.get(('Office', 6.0, 16.0, 11.0), lambda: generate(3))
+	assert first is again
+	assert other is not first
+	assert calls == [1, 3]
+	assert sorted(library.meshes) == [('Office', 6.0, 16.0, 10.0), ('Office', 6.0, 16.0, 11.0)]
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+from city_generator import cache
+
+
+class _Shared(object):
+	"""Stands for an object shared with the city being generated, like the terrain."""
+	pass
+
+
+def test_key_depends_on_parameters_and_version(monkeypatch):
+	key = cache.StageCache.key('terrain', 1, 500.0, (0.0, 10.0))
+	assert key == cache.StageCache.key('terrain', 1, 500.0, (0.0, 10.0))
+	assert key != cache.StageCache.key('terrain', 2, 500.0, (0.0, 10.0))
+	assert key != cache.StageCache.key('terrain', 1, 500.0, (0.0, 10.5))
+	assert key != cache.StageCache.key(1, 'terrain', 500.0, (0.0, 10.0))
+	
+	# Keys of later stages include the key of the stage they depend on
+	assert cache.StageCache.key('roads', key) != cache.StageCache.key('roads', cache.StageCache.key('terrain', 2, 500.0, (0.0, 10.0)))
+	
+	monkeypatch.setattr(cache, 'version', cache.version + 1)
+	assert key != cache.StageCache.key('terrain', 1, 500.0, (0.0, 10.0))
+
+
+def test_store_and_load(tmp_path):
+	stage_cache = cache.StageCache(str(tmp_path / 'stages'))
+	key = stage_cache.key('cells', 3)
+	assert stage_cache.load('cells', key) is None
+	
+	shared = _Shared()
+	arrays = {'image': np.random.RandomState(1).uniform(size=(5, 5)), 'indices': np.arange(4, dtype=np.int64)}
+	objects = {'cells': [('lake', 1.5), ('urban', [shared, shared])], 'terrain': shared, 'random_state': (3, (1, 2), None)}
+	stage_cache.store('cells', key, arrays, objects, {'terrain': shared})
+	assert os.listdir(str(tmp_path / 'stages')) == ['cells-' + key + '.npz']
+	
+	other = _Shared()
+	loaded_arrays, loaded_objects = stage_cache.load('cells', key, {'terrain': other})
+	assert sorted(loaded_arrays) == ['image', 'indices']
+	for name, array in arrays.items():
+		assert loaded_arrays[name].dtype == array.dtype
+		assert np.array_equal(loaded_arrays[name], array)
+	assert loaded_objects['cells'][0] == ('lake', 1.5)
+	assert loaded_objects['terrain'] is other
+	assert loaded_objects['cells'][1][1] == [other, other]
+	assert loaded_objects['random_state'] == (3, (1, 2), None)
+	
+	# Other stage or key is not found, storing again replaces the result
+	assert stage_cache.load('blocks', key) is None
+	assert stage_cache.load('cells', stage_cache.key('cells', 4)) is None
+	stage_cache.store('cells', key, {}, 'replaced')
+	assert stage_cache.load('cells', key) == ({}, 'replaced')
+
+
+def test_clear_removes_only_stage_files(tmp_path):
+	stage_cache = cache.StageCache(str(tmp_path))
+	for i in range(3):
+		stage_cache.store('stage', stage_cache.key(i), {'a': np.zeros(i)}, i)
+	(tmp_path / 'notes.txt').write_text('kept')
+	stage_cache.clear()
+	assert os.listdir(str(tmp_path)) == ['notes.txt']
+	assert stage_cache.load('stage', stage_cache.key(0)) is None
+
+
+def test_dumps_and_loads_keep_references_by_name():
+	shared, other = _Shared(), _Shared()
+	data = cache.dumps({'a': shared, 'b': [1, shared]}, {'shared': shared})
+	result = cache.loads(data, {'shared': other})
+	assert result['a'] is other and result['b'][1] is other
+	
+	# Without the reference, the object is copied
+	copied = cache.loads(cache.dumps({'a': shared}))
+	assert isinstance(copied['a'], _Shared) and copied['a'] is not shared
@@ -0,0 +1,59 @@
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip('bpy')
+
+from city_generator import city
+
+
+def _city(seed, lazy):
+	cit = city.City()
+	cit.seed = seed
+	cit.terrain.side_length = 1000.0
+	cit.terrain.elevation = 10.0
+	cit.lazy = lazy
+	cit.generate()
+	return cit
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_lazy_terrain_does_not_depend_on_cell_order(seed):
+	eager = _city(seed, False)
+	for shuffle in (list.reverse, random.Random(seed).shuffle):
+		lazy = _city(seed, True)
+		cells = list(lazy.city_cells)
+		shuffle(cells)
+		for cell in cells:
+			cell.ensure_generated()
+		assert np.array_equal(lazy.terrain.image, eager.terrain.image)
+
+
+def test_stage_cache_restores_same_city(tmp_path):
+	from city_generator import cache
+	
+	def generate(seed, elevation):
+		cit = city.City()
+		cit.seed = seed
+		cit.terrain.side_length = 1000.0
+		cit.terrain.elevation = elevation
+		cit.cache = cache.StageCache(str(tmp_path))
+		cit.generate()
+		return cit
+	
+	first = generate(1, 10.0)
+	stored = dict((path.name, path.stat().st_mtime_ns) for path in tmp_path.iterdir())
+	assert len(stored) > 0
+	restored = generate(1, 10.0)
+	assert dict((path.name, path.stat().st_mtime_ns) for path in tmp_path.iterdir()) == stored
+	assert np.array_equal(restored.terrain.image, first.terrain.image)
+	assert restored.graph.number_of_edges() == first.graph.number_of_edges()
+	blocks = lambda cit: [len(cell.blocks) for cell in cit.city_cells if hasattr(cell, 'blocks')]
+	assert blocks(restored) == blocks(first)
+	
+	# Elevation only affects the stages after the terrain, which are generated and stored anew
+	generate(1, 12.0)
+	added = set(path.name for path in tmp_path.iterdir()) - set(stored)
+	assert len(added) > 0
+	assert not any(name.startswith('terrain-') for name in added)
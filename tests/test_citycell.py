@@ -0,0 +1,61 @@
+import types
+
+import pytest
+
+pytest.importorskip('bpy')
+
+from city_generator import citycell, roadnet, util
+
+
+def _roads_cell(points, edges):
+	"""URBAN roads cell (snap size 20) with hand-built secondary road network."""
+	city = types.SimpleNamespace(terrain=None)
+	outline = [(-100.0, -100.0), (200.0, -100.0), (200.0, 200.0), (-100.0, 200.0)]
+	cell = citycell.RoadsCell(city, util.Polygon(outline), util.Polygon(outline), 'URBAN')
+	cell.graph = roadnet.RoadNetwork()
+	ids = [cell.graph.add_node(p) for p in points]
+	for i, j in edges:
+		cell.graph.add_edge(ids[i], ids[j])
+	return cell
+
+
+def _edge_distance_test(cell, new_edge, join):
+	return cell._RoadsCell__edge_distance_test(new_edge, join)
+
+
+# Edge 0-1 comes first, and the new point does not project onto it. Edge 2-3 passes 10 from the new point.
+points = [(0.0, 0.0), (10.0, 0.0), (0.0, 50.0), (100.0, 50.0), (50.0, 0.0)]
+edges = [(0, 1), (2, 3)]
+
+
+def test_point_near_later_edge_is_rejected():
+	cell = _roads_cell(points, edges)
+	assert not _edge_distance_test(cell, (4, (50.0, 40.0)), False)
+	assert cell.graph.number_of_edges() == 2
+
+
+def test_point_far_from_edges_is_accepted():
+	cell = _roads_cell(points, edges)
+	assert _edge_distance_test(cell, (4, (50.0, 25.0)), True)
+	assert cell.graph.number_of_edges() == 2
+
+
+def test_projection_outside_segment_is_ignored():
+	cell = _roads_cell(points, edges)
+	assert _edge_distance_test(cell, (4, (110.0, 45.0)), True)
+
+
+def test_join_splits_edge_at_projection():
+	cell = _roads_cell(points, edges)
+	assert not _edge_distance_test(cell, (4, (50.0, 40.0)), True)
+	graph = cell.graph
+	split = graph.node_for_point((50.0, 50.0))
+	assert not graph.has_edge(2, 3)
+	assert graph.has_edge(2, split) and graph.has_edge(split, 3) and graph.has_edge(4, split)
+
+
+def test_join_from_endpoint_of_edge_does_not_split():
+	cell = _roads_cell(points, edges)
+	assert not _edge_distance_test(cell, (2, (50.0, 40.0)), True)
+	assert cell.graph.has_edge(2, 3)
+	assert cell.graph.number_of_edges() == 2
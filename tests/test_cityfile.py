@@ -0,0 +1,141 @@
+import json
+import math
+import types
+
+import numpy as np
+import pytest
+
+from city_generator import cityfile, terrain, util
+
+
+def _building(location, rotation):
+	vertices = np.array([(0.0, 0.0, 0.0), (2.0, 0.0, 0.0), (2.0, 1.0, 0.0), (0.0, 1.0, 3.0)])
+	faces = [np.array([0, 1, 2, 3]), np.array([0, 1, 3])]
+	return types.SimpleNamespace(transform=lambda: (location, rotation), meshes=lambda: [(vertices, faces)])
+
+
+def _square(x, y, size):
+	return util.Polygon([(x, y), (x, y + size), (x + size, y + size), (x + size, y)])
+
+
+def _city():
+	"""Stand-in for a generated city, with one lake cell and one cell with blocks."""
+	ter = terrain.Terrain()
+	ter.side_length = 200.0
+	ter.elevation = 12.0
+	ter.set_image(np.random.RandomState(1).uniform(0.0, 1.0, (17, 17)))
+	
+	lake = types.SimpleNamespace(lo_cycle=_square(0, 0, 100), water_outline=_square(10, 10, 50), level=4.5,
+		ensure_generated=lambda: None)
+	lots = [
+		types.SimpleNamespace(outline=_square(102, 2, 10), building=_building((107.0, 7.0, 1.0), math.pi / 2)),
+		types.SimpleNamespace(outline=_square(112, 2, 10), building=None),
+		types.SimpleNamespace(outline=_square(132, 2, 10), building=_building((137.0, 7.0, 2.0), 0.0))
+	]
+	blocks = [
+		types.SimpleNamespace(valid=True, contracted_cycle=_square(101, 1, 22), lots=lots[0:2]),
+		types.SimpleNamespace(valid=False, contracted_cycle=None, lots=None),
+		types.SimpleNamespace(valid=True, contracted_cycle=_square(131, 1, 12), lots=lots[2:3])
+	]
+	segments = np.arange(24, dtype=float).reshape(4, 2, 3)
+	roads_cell = types.SimpleNamespace(lo_cycle=_square(100, 0, 100), profile='URBAN', blocks=blocks,
+		road_segments=lambda: segments, ensure_generated=lambda: None)
+	
+	roads = {1: [(0.0, 0.0), (100.0, 0.0)], 2: [(100.0, 0.0), (100.0, 100.0), (200.0, 100.0)]}
+	return types.SimpleNamespace(seed=7, urbanization=0.5, terrain=ter, city_cells=[lake, roads_cell], roads=roads,
+		road_with_elevations=lambda road: np.array([(x, y, x / 100.0) for x, y in road]),
+		metrics_report=lambda: {'blocks': 3}, ensure_generated=lambda: None)
+
+
+def test_round_trip(tmp_path):
+	cit = _city()
+	path = str(tmp_path / 'city.bin')
+	cityfile.write_city(cit, path)
+	
+	city_file = cityfile.CityFile(path)
+	assert city_file.metadata['seed'] == 7
+	assert city_file.metadata['urbanization'] == 0.5
+	assert city_file.metadata['metrics'] == {'blocks': 3}
+	assert city_file.cells == [{'type': 'SimpleNamespace', 'level': 4.5}, {'type': 'SimpleNamespace', 'profile': 'URBAN'}]
+	
+	ter = city_file.terrain()
+	assert (ter.side_length, ter.elevation) == (200.0, 12.0)
+	assert np.array_equal(ter.image, cit.terrain.image.astype(np.float32))
+	del ter
+	
+	roads = [road.copy() for road in city_file.primary_roads()]
+	assert all(np.array_equal(road, cit.road_with_elevations(cit.roads[key])) for road, key in zip(roads, (1, 2)))
+	
+	assert np.array_equal(city_file.cell_array(0, 'outline'), np.array(cit.city_cells[0].lo_cycle.vertices))
+	assert np.array_equal(city_file.cell_array(0, 'water'), np.array(cit.city_cells[0].water_outline.vertices))
+	assert not city_file.has_array('cells/0/buildings/vertices')
+	assert np.array_equal(city_file.cell_array(1, 'roads'), cit.city_cells[1].road_segments())
+	
+	blocks = [blk.copy() for blk in city_file.blocks(1)]
+	assert [blk.tolist() for blk in blocks] == [[list(p) for p in _square(x, 1, size).vertices] for x, size in ((101, 22), (131, 12))]
+	lots = [lot.copy() for lot in city_file.lots(1)]
+	assert len(lots) == 3
+	assert city_file.cell_array(1, 'lots/block').tolist() == [0, 0, 1]
+	
+	# Buildings in city coordinates: the first one rotated by 90 degrees
+	assert city_file.cell_array(1, 'buildings/lot').tolist() == [0, 2]
+	assert city_file.cell_array(1, 'buildings/offsets').tolist() == [0, 2, 4]
+	vertices = city_file.cell_array(1, 'buildings/vertices').copy()
+	assert np.allclose(vertices[0:4], [(107.0, 7.0, 1.0), (107.0, 9.0, 1.0), (106.0, 9.0, 1.0), (106.0, 7.0, 4.0)])
+	assert np.allclose(vertices[4:8], [(137.0, 7.0, 2.0), (139.0, 7.0, 2.0), (139.0, 8.0, 2.0), (137.0, 8.0, 5.0)])
+	assert city_file.cell_array(1, 'buildings/face_offsets').tolist() == [0, 4, 7, 11, 14]
+	assert city_file.cell_array(1, 'buildings/face_indices').tolist() == [0, 1, 2, 3, 0, 1, 3, 4, 5, 6, 7, 4, 5, 7]
+	
+	view = city_file.cell_array(1, 'buildings/face_indices')
+	assert not view.flags.writeable
+	assert view.dtype == np.uint32
+	del view
+	city_file.close()
+
+
+def test_arrays_are_aligned_and_streamed(tmp_path):
+	path = str(tmp_path / 'arrays.bin')
+	arrays = {
+		'a': np.arange(5, dtype=np.uint8),
+		'b': np.random.RandomState(1).uniform(size=(7, 3)),
+		'c/d': np.zeros((0, 2)),
+		'e': np.asfortranarray(np.arange(12, dtype=np.int32).reshape(3, 4))
+	}
+	with cityfile.CityWriter(path) as writer:
+		writer.metadata['name'] = 'test'
+		for name, array in arrays.items():
+			writer.write_array(name, array)
+	
+	with cityfile.CityFile(path) as city_file:
+		assert city_file.metadata == {'name': 'test'}
+		for name, array in arrays.items():
+			assert city_file.has_array(name)
+			data = city_file.array(name)
+			assert (data.dtype, data.shape) == (array.dtype, array.shape)
+			assert np.array_equal(data, array)
+			del data
+		assert not city_file.has_array('f')
+	
+	with open(path, 'rb') as file:
+		content = file.read()
+	toc_position, toc_length, end = cityfile._footer.unpack_from(content, len(content) - cityfile._footer.size)
+	toc = json.loads(content[toc_position:toc_position+toc_length].decode('utf-8'))
+	assert all(offset % cityfile.alignment == 0 for offset, dtype, shape in toc['arrays'].values())
+
+
+def test_invalid_files_are_rejected(tmp_path):
+	path = str(tmp_path / 'city.bin')
+	with cityfile.CityWriter(path) as writer:
+		writer.write_array('a', np.arange(3))
+	with open(path, 'rb') as file:
+		content = file.read()
+	
+	for name, data, message in (
+		('magic.bin', b'XXXX' + content[4:], 'Not a city file'),
+		('truncated.bin', content[:-3], 'Incomplete'),
+		('version.bin', cityfile._header.pack(cityfile.magic, cityfile.format_version + 1) + content[8:], 'version')
+	):
+		with open(str(tmp_path / name), 'wb') as file:
+			file.write(data)
+		with pytest.raises(Exception, match=message):
+			cityfile.CityFile(str(tmp_path / name))
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('bpy')
+import networkx as nx
+
+from city_generator import city, citycell, dcel, roadnet
+
+
+def _grid(n):
+	graph = nx.Graph()
+	for i in range(n):
+		for j in range(n):
+			if i + 1 < n:
+				graph.add_edge((float(i), float(j)), (float(i+1), float(j)))
+			if j + 1 < n:
+				graph.add_edge((float(i), float(j)), (float(i), float(j+1)))
+	return graph
+
+
+def _add_cycle(graph, points):
+	for a, b in zip(points, points[1:] + points[:1]):
+		graph.add_edge(a, b)
+
+
+def _is_proper_embedding(network):
+	"""Whether no two edges of network cross, and no two edges leave a vertex in the same direction."""
+	indptr, indices = network.csr()
+	coordinates = network.coordinates
+	src = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+	d = coordinates[indices] - coordinates[src]
+	angles = np.round(np.arctan2(d[:, 1], d[:, 0]), 9)
+	if len(set(zip(src.tolist(), angles.tolist()))) < len(src):
+		return False
+
+	a, b = src[src < indices], indices[src < indices]
+	p, q = coordinates[a], coordinates[b]
+	side = lambda p, q, r: (q[..., 0] - p[..., 0])*(r[..., 1] - p[..., 1]) - (q[..., 1] - p[..., 1])*(r[..., 0] - p[..., 0])
+	for i in range(len(a)):
+		shared = (a == a[i]) | (a == b[i]) | (b == a[i]) | (b == b[i])
+		crossing = (side(p, q, p[i]) * side(p, q, q[i]) < 0) & (side(p[i], q[i], p) * side(p[i], q[i], q) < 0)
+		if np.any(crossing & ~shared):
+			return False
+	return True
+
+
+def test_grid_agrees():
+	assert dcel.cross_check(_grid(5)) == ([], [])
+	assert len(dcel.planar_graph_faces(_grid(5))) == 16
+
+
+def test_filaments_and_attached_parts_agree():
+	graph = _grid(4)
+	graph.add_edge((1.5, 3.0), (1.5, 3.5)) # Filament
+	_add_cycle(graph, [(3.0, 3.0), (5.0, 5.0), (6.0, 5.0)]) # Part attached at a vertex
+	_add_cycle(graph, [(6.0, 5.0), (7.0, 7.0), (8.0, 6.0)]) # Figure 8
+	graph.add_edge((8.0, 6.0), (9.0, 6.0)) # Bridge to separate part
+	_add_cycle(graph, [(9.0, 6.0), (10.0, 6.0), (10.0, 7.0)])
+	assert dcel.cross_check(graph) == ([], [])
+	assert len(dcel.planar_graph_faces(graph)) == 12
+
+
+@pytest.mark.parametrize('attachment', [None, ((1.0, 1.0), (1.2, 1.2)), ((2.0, 2.0), (1.5, 1.8))])
+def test_face_with_nested_part_is_dropped(attachment):
+	graph = _grid(4)
+	_add_cycle(graph, [(1.2, 1.2), (1.8, 1.2), (1.5, 1.8)])
+	if attachment is not None:
+		graph.add_edge(*attachment)
+	square = dcel._cycle_edges([(1.0, 1.0), (2.0, 1.0), (2.0, 2.0), (1.0, 2.0)])
+	faces = [dcel._cycle_edges(face) for face in dcel.planar_graph_faces(graph)]
+	assert len(faces) == 9
+	assert square not in faces
+
+	# mcb keeps or drops the square depending on the attachment, and agrees otherwise
+	missing, extra = dcel.cross_check(graph)
+	assert extra == []
+	assert [dcel._cycle_edges(cycle) for cycle in missing] in ([], [square])
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_generated_cells_agree(seed):
+	cit = city.City()
+	cit.seed = seed
+	cit.terrain.side_length = 1000.0
+	cit.terrain.elevation = 10.0
+	cit.generate()
+
+	networks = [roadnet.RoadNetwork.from_networkx(cit.graph)]
+	networks += [cell.full_graph_low() for cell in cit.city_cells if isinstance(cell, citycell.BlocksCell)]
+	proper = [network for network in networks if _is_proper_embedding(network)]
+	assert len(proper) > len(networks) // 2
+	for network in proper:
+		assert dcel.cross_check(network) == ([], [])
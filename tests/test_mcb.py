@@ -0,0 +1,79 @@
+import pytest
+
+nx = pytest.importorskip('networkx')
+from city_generator import mcb, roadnet
+
+
+def _network(*polylines):
+	builder = roadnet.NetworkBuilder()
+	for points, closed in polylines:
+		builder.add_polyline(points, closed)
+	return builder.network()
+
+
+def _cycle_set(cycles):
+	"""Cycles as set of undirected edge sets, independent of start vertex and direction."""
+	return set(frozenset(frozenset((a, b)) for a, b in zip(cycle, cycle[1:] + cycle[:1])) for cycle in cycles)
+
+
+square = [(0.0, 0.0), (2.0, 0.0), (2.0, 2.0), (0.0, 2.0)]
+right_square = [(2.0, 0.0), (4.0, 0.0), (4.0, 2.0), (2.0, 2.0)]
+triangle = [(0.5, 0.5), (1.5, 0.5), (1.0, 1.5)]
+
+
+def test_single_cycle():
+	assert _cycle_set(mcb.planar_graph_cycles(_network((square, True)))) == _cycle_set([square])
+
+
+def test_adjacent_cycles():
+	net = _network((square, True), (right_square, True))
+	assert _cycle_set(mcb.planar_graph_cycles(net)) == _cycle_set([square, right_square])
+
+
+def test_diagonal_splits_cycle():
+	net = _network((square, True), ([(0.0, 0.0), (2.0, 2.0)], False))
+	expected = [[(0.0, 0.0), (2.0, 0.0), (2.0, 2.0)], [(0.0, 0.0), (2.0, 2.0), (0.0, 2.0)]]
+	assert _cycle_set(mcb.planar_graph_cycles(net)) == _cycle_set(expected)
+
+
+def test_filaments_are_not_cycles():
+	net = _network(
+		(square, True),
+		([(2.0, 2.0), (3.0, 3.0), (4.0, 3.0)], False), # Outside
+		([(0.0, 0.0), (0.5, 0.7)], False) # Inside
+	)
+	assert _cycle_set(mcb.planar_graph_cycles(net)) == _cycle_set([square])
+
+
+def test_cycles_joined_by_vertex_and_bridge():
+	other = [(5.0, 0.0), (6.0, 0.0), (6.0, 1.0)]
+	touching = [(2.0, 2.0), (3.0, 2.0), (3.0, 3.0)]
+	net = _network((square, True), (touching, True), (other, True), ([(4.0, 0.0), (5.0, 0.0)], False),
+		([(2.0, 0.0), (4.0, 0.0)], False))
+	assert _cycle_set(mcb.planar_graph_cycles(net)) == _cycle_set([square, touching, other])
+
+
+def test_nested_cycle():
+	net = _network((square, True), (triangle, True))
+	assert _cycle_set(mcb.planar_graph_cycles(net)) == _cycle_set([square, triangle])
+
+
+def test_trees_and_isolated_nodes_have_no_cycles():
+	net = _network(([(0.0, 0.0), (1.0, 0.0), (2.0, 1.0)], False), ([(1.0, 0.0), (1.0, -1.0)], False))
+	net.add_node((5.0, 5.0))
+	assert mcb.planar_graph_cycles(net) == []
+	assert mcb.planar_graph_cycles(roadnet.RoadNetwork()) == []
+
+
+def test_networkx_input_and_network_unchanged():
+	graph = nx.Graph()
+	for a, b in zip(square, square[1:] + square[:1]):
+		graph.add_edge(a, b)
+	graph.add_edge((0.0, 0.0), (2.0, 2.0))
+	cycles = mcb.planar_graph_cycles(graph)
+	assert len(cycles) == 2
+	assert all(isinstance(p, tuple) and len(p) == 2 for cycle in cycles for p in cycle)
+
+	net = roadnet.RoadNetwork.from_networkx(graph)
+	mcb.planar_network_cycles(net)
+	assert net.number_of_edges() == 5
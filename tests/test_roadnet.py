@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+nx = pytest.importorskip('networkx')
+from city_generator import roadnet
+
+
+def test_nodes_and_edges():
+	net = roadnet.RoadNetwork(capacity=2)
+	a = net.add_node((0.0, 0.0))
+	b = net.node_for_point((1.0, 0.0))
+	c = net.node_for_point((1.0, 1.0))
+	assert (a, b, c) == (0, 1, 2)
+	assert net.node_for_point((1.0, 0.0)) == b
+	net.add_edge(a, b)
+	net.add_edge(b, c)
+	net.add_edge(c, a)
+	net.add_edge(a, a) # Ignored
+	net.add_edge(b, a) # Already there
+	assert net.number_of_nodes() == 3
+	assert net.number_of_edges() == 3
+	assert sorted(net.edges()) == [(0, 1), (0, 2), (1, 2)]
+	assert net.neighbors(a) == [b, c]
+	assert net.point(c) == (1.0, 1.0)
+
+	net.remove_edge(c, a)
+	assert not net.has_edge(a, c) and not net.has_edge(c, a)
+	net.remove_node(b)
+	assert not net.has_node(b)
+	assert net.nodes() == [a, c]
+	assert net.number_of_edges() == 0
+	# Removed node is not found by its point any more
+	assert net.node_for_point((1.0, 0.0)) == 3
+
+
+def test_csr_follows_modifications():
+	net = roadnet.RoadNetwork()
+	ids = [net.add_node((float(i), 0.0)) for i in range(4)]
+	for i, j in zip(ids[:-1], ids[1:]):
+		net.add_edge(i, j)
+	indptr, indices = net.csr()
+	assert indptr.tolist() == [0, 1, 3, 5, 6]
+	assert [sorted(indices[indptr[i]:indptr[i+1]].tolist()) for i in ids] == [[1], [0, 2], [1, 3], [2]]
+	net.remove_edge(1, 2)
+	indptr, indices = net.csr()
+	assert indptr.tolist() == [0, 1, 2, 3, 4]
+
+
+def test_copy_is_independent():
+	net = roadnet.RoadNetwork.from_networkx(nx.Graph([((0.0, 0.0), (1.0, 0.0)), ((1.0, 0.0), (1.0, 1.0))]))
+	copy = net.copy()
+	copy.add_edge(copy.node_for_point((0.0, 0.0)), copy.node_for_point((1.0, 1.0)))
+	assert net.number_of_edges() == 2
+	assert copy.number_of_edges() == 3
+	assert net.number_of_nodes() == 3
+
+
+def test_networkx_round_trip():
+	graph = nx.Graph()
+	graph.add_edge((0.0, 0.0), (2.0, 0.0))
+	graph.add_edge((2.0, 0.0), (2.0, 3.5))
+	graph.add_node((5.0, 5.0))
+	net = roadnet.RoadNetwork.from_networkx(graph)
+	assert net.number_of_nodes() == 3 + 1
+	result = net.to_networkx()
+	assert set(result.nodes()) == set(graph.nodes())
+	assert set(frozenset(e) for e in result.edges()) == set(frozenset(e) for e in graph.edges())
+
+
+def test_builder_merges_shared_roads():
+	builder = roadnet.NetworkBuilder()
+	square = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0)]
+	builder.add_polyline(square, closed=True)
+	builder.add_polyline([(1.0, 0.0), (2.0, 0.0), (2.0, 1.0), (1.0, 1.0)], closed=True)
+	part = roadnet.RoadNetwork()
+	part.add_edge(part.node_for_point((0.0, 0.0)), part.node_for_point((1.0, 0.0)))
+	builder.add_network(part)
+	net = builder.network()
+	assert net.number_of_nodes() == 6
+	assert net.number_of_edges() == 7
+	assert np.array_equal(net.coordinates[0], [0.0, 0.0])
@@ -0,0 +1,89 @@
+import math
+import random
+import sys
+
+import pytest
+
+pytest.importorskip('bpy')
+import networkx as nx
+
+from city_generator import city, roadnet, routing
+
+
+def _grid_network(n, seed):
+	"""Jittered n x n grid with some edges removed, so that shortest paths are not trivial."""
+	rng = random.Random(seed)
+	net = roadnet.RoadNetwork()
+	ids = [[net.add_node((x * 10.0 + rng.uniform(-3, 3), y * 10.0 + rng.uniform(-3, 3))) for y in range(n)] for x in range(n)]
+	for x in range(n):
+		for y in range(n):
+			if x + 1 < n and rng.random() < 0.8:
+				net.add_edge(ids[x][y], ids[x+1][y])
+			if y + 1 < n and rng.random() < 0.8:
+				net.add_edge(ids[x][y], ids[x][y+1])
+	return net
+
+
+def _reference_graph(net):
+	graph = nx.Graph()
+	for i, j in net.edges():
+		a, b = net.point(i), net.point(j)
+		graph.add_edge(i, j, weight=((a[0] - b[0])**2 + (a[1] - b[1])**2)**0.5)
+	return graph
+
+
+def _check_against_dijkstra(net, number_of_pairs, seed):
+	graph = _reference_graph(net)
+	rng = random.Random(seed)
+	nodes = sorted(graph.nodes())
+	pairs = [tuple(rng.sample(nodes, 2)) for k in range(number_of_pairs)]
+
+	router = routing.Router(net)
+	contracted = routing.Router(net)
+	contracted.contract()
+	results = (
+		[router.shortest_path(a, b) for a, b in pairs],
+		router.shortest_paths(pairs),
+		[contracted.shortest_path(a, b) for a, b in pairs]
+	)
+
+	for k, (a, b) in enumerate(pairs):
+		try:
+			expected = nx.dijkstra_path_length(graph, a, b)
+		except nx.NetworkXNoPath:
+			expected = None
+		for paths in results:
+			path = paths[k]
+			if expected is None:
+				assert path is None
+			else:
+				assert path[0] == a and path[-1] == b
+				assert all(net.has_edge(i, j) for i, j in zip(path[:-1], path[1:]))
+				assert router.path_length(path) == pytest.approx(expected, abs=1e-6)
+
+
+def test_grid_matches_dijkstra():
+	_check_against_dijkstra(_grid_network(20, 1), 300, 2)
+
+
+def test_generated_city_matches_dijkstra():
+	cit = city.City()
+	cit.seed = 3
+	cit.terrain.side_length = 1000.0
+	cit.terrain.elevation = 10.0
+	cit.generate()
+	_check_against_dijkstra(cit.full_network(), 300, 5)
+
+
+def test_long_chain_unpacks_without_recursion():
+	# Nodes on a ring get contracted one after the other, so that each shortcut nests the previous one
+	net = roadnet.RoadNetwork()
+	length = 4 * sys.getrecursionlimit()
+	angles = [2.0 * math.pi * i / length for i in range(length)]
+	ids = [net.add_node((1000.0 * math.cos(a), 1000.0 * math.sin(a))) for a in angles]
+	for i, j in zip(ids, ids[1:] + ids[:1]):
+		net.add_edge(i, j)
+	router = routing.Router(net)
+	router.contract()
+	dst = length // 3
+	assert router.shortest_path(ids[-1], ids[dst]) == ids[-1:] + ids[:dst+1]
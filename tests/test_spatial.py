@@ -0,0 +1,80 @@
+import random
+import types
+
+import numpy as np
+
+from city_generator import spatial, util
+
+
+def _quad(rng, x0, y0, x1, y1, jitter):
+	"""Clockwise quadrilateral near the rectangle, with corners moved inwards by up to jitter."""
+	corners = [(x0, y0), (x0, y1), (x1, y1), (x1, y0)]
+	directions = [(1, 1), (1, -1), (-1, -1), (-1, 1)]
+	return util.Polygon([(x + dx * rng.uniform(0, jitter), y + dy * rng.uniform(0, jitter))
+		for (x, y), (dx, dy) in zip(corners, directions)])
+
+
+def _city_cells(seed):
+	"""3 x 3 cells of 2 x 2 blocks with 2 lots each. Some cells have no blocks, some blocks are invalid."""
+	rng = random.Random(seed)
+	cells = []
+	for i in range(3):
+		for j in range(3):
+			cell = types.SimpleNamespace(lo_cycle=_quad(rng, 100*i, 100*j, 100*i + 100, 100*j + 100, 5.0))
+			if (i, j) == (1, 1):
+				cells.append(cell) # Cell type without blocks
+				continue
+			cell.blocks = []
+			for k in range(2):
+				for l in range(2):
+					x0, y0 = 100*i + 10 + 42*k, 100*j + 10 + 42*l
+					blk = types.SimpleNamespace(cycle=_quad(rng, x0, y0, x0 + 38, y0 + 38, 3.0), valid=(k, l) != (1, 0))
+					blk.lots = [
+						types.SimpleNamespace(outline=_quad(rng, x0 + 4, y0 + 4, x0 + 18, y0 + 34, 2.0)),
+						types.SimpleNamespace(outline=_quad(rng, x0 + 20, y0 + 4, x0 + 34, y0 + 34, 2.0))
+					] if blk.valid else None
+					cell.blocks.append(blk)
+			cells.append(cell)
+	return cells
+
+
+def _brute_force_locate(index, point):
+	result = []
+	for objects, polygon in ((index.cells, lambda cell: cell.lo_cycle), (index.blocks, lambda blk: blk.cycle),
+		(index.lots, lambda lot: lot.outline)):
+		found = [i for i, obj in enumerate(objects) if polygon(obj).contains_point(point)]
+		assert len(found) <= 1
+		result.append(found[0] if found else -1)
+	return result
+
+
+def test_locate_agrees_with_brute_force():
+	cells = _city_cells(1)
+	index = spatial.SpatialIndex(cells)
+	assert (len(index.cells), len(index.blocks), len(index.lots)) == (9, 32, 48)
+	
+	rng = np.random.RandomState(1)
+	points = rng.uniform(-20, 320, (3000, 2))
+	located = np.stack(index.locate(points), axis=1)
+	expected = np.array([_brute_force_locate(index, tuple(p)) for p in points.tolist()])
+	assert np.array_equal(located, expected)
+	assert np.all(located.min(axis=0) == -1) and np.all(located.max(axis=0) >= 0)
+	assert np.array_equal(np.stack(index.locate(points[:0]), axis=1), np.zeros((0, 3)))
+
+
+def test_query_rectangle_agrees_with_brute_force():
+	index = spatial.SpatialIndex(_city_cells(2))
+	polygons = (
+		[cell.lo_cycle for cell in index.cells], [blk.cycle for blk in index.blocks], [lot.outline for lot in index.lots]
+	)
+	rng = random.Random(2)
+	for i in range(200):
+		x0, y0 = rng.uniform(-50, 300), rng.uniform(-50, 300)
+		x1, y1 = x0 + rng.uniform(0, 80), y0 + rng.uniform(0, 80)
+		for hits, level in zip(index.query_rectangle(x0, y0, x1, y1), polygons):
+			expected = []
+			for k, polygon in enumerate(level):
+				(bx0, by0), (bx1, by1) = polygon.bounding_box()
+				if bx0 <= x1 and bx1 >= x0 and by0 <= y1 and by1 >= y0:
+					expected.append(k)
+			assert sorted(hits.tolist()) == expected
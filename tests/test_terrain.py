@@ -0,0 +1,123 @@
+import numpy as np
+
+from city_generator import terrain
+
+
+def _terrain(seed, resolution=33):
+	ter = terrain.Terrain()
+	ter.side_length = 100.0
+	ter.elevation = 10.0
+	ter.set_image(np.random.RandomState(seed).uniform(0.0, 1.0, (resolution, resolution)))
+	return ter
+
+
+def _flatten_cell(ter):
+	ter.flatten_segment((10.0, 10.0), (60.0, 40.0), 3.0, 5.0)
+	ter.flatten_segment((60.0, 40.0), (60.0, 90.0), 5.0, 2.0)
+
+
+def _emboss_and_flatten_cell(ter):
+	for x_i in range(10, 20):
+		for y_i in range(8, 14):
+			ter.add_to_pixel(x_i, y_i, -0.05)
+	ter.flatten_segment((20.0, 60.0), (80.0, 20.0), 4.0, 4.0)
+
+
+def test_composed_edits_equal_sequential_edits():
+	cells = [_flatten_cell, _emboss_and_flatten_cell]
+	sequential = _terrain(1)
+	for cell in cells:
+		cell(sequential)
+
+	# Each cell edits the base terrain, in reverse order
+	ter = _terrain(1)
+	base = ter.image.copy()
+	cell_edits = dict()
+	for i in reversed(range(len(cells))):
+		ter.set_image(base.copy())
+		ter.record_edits()
+		cells[i](ter)
+		cell_edits[i] = ter.recorded_edits()
+	overlap = np.intersect1d(cell_edits[0][0], cell_edits[1][0])
+	assert len(overlap) > 0
+
+	# Then their edits are applied in cell order
+	indices = np.union1d(cell_edits[0][0], cell_edits[1][0])
+	heights = base.flat[indices]
+	for i in range(len(cells)):
+		terrain.apply_edits(heights, indices, cell_edits[i])
+	composed = base.copy()
+	composed.flat[indices] = heights
+	assert np.allclose(composed, sequential.image, rtol=0.0, atol=1e-12)
+
+
+def test_recorded_edits_of_one_cell():
+	ter = _terrain(2)
+	base = ter.image.copy()
+	ter.record_edits()
+	_emboss_and_flatten_cell(ter)
+	indices, scales, offsets = ter.recorded_edits()
+	assert np.all(np.diff(indices) > 0)
+	assert np.allclose(ter.image.flat[indices], scales * base.flat[indices] + offsets)
+	unchanged = np.setdiff1d(np.arange(base.size), indices)
+	assert np.array_equal(ter.image.flat[unchanged], base.flat[unchanged])
+
+
+def _smooth_heights(seed, n=33):
+	y, x = np.mgrid[0:n, 0:n] / float(n - 1)
+	noise = np.random.RandomState(seed).uniform(-0.05, 0.05, (n, n))
+	return np.sin(3.0 * x) * np.cos(2.0 * y) + noise
+
+
+def _check_mesh(triangles, n):
+	"""Assert that triangles are counter-clockwise, cover the (n, n) grid, and have no T-junctions."""
+	u = triangles[:, 1] - triangles[:, 0]
+	v = triangles[:, 2] - triangles[:, 0]
+	doubled_areas = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+	assert np.all(doubled_areas > 0)
+	assert doubled_areas.sum() == 2 * (n - 1)**2
+	
+	vertices = set(map(tuple, triangles.reshape(-1, 2).tolist()))
+	for triangle in triangles.tolist():
+		for k in range(3):
+			p, q = np.array(triangle[k]), np.array(triangle[(k + 1) % 3])
+			steps = np.gcd(*np.abs(q - p))
+			for i in range(1, steps):
+				assert tuple((p + (q - p) * i // steps).tolist()) not in vertices
+
+
+def _hypotenuse_errors(heights, triangles):
+	"""Interpolation error at the hypotenuse midpoint of each triangle which has one on the grid."""
+	errors = []
+	for triangle in triangles:
+		lengths = [np.square(triangle[(k + 1) % 3] - triangle[k]).sum() for k in range(3)]
+		k = int(np.argmax(lengths))
+		a, b = triangle[k], triangle[(k + 1) % 3]
+		if np.all((a + b) % 2 == 0):
+			m = (a + b) // 2
+			errors.append(abs((heights[a[1], a[0]] + heights[b[1], b[0]]) / 2.0 - heights[m[1], m[0]]))
+	return np.array(errors)
+
+
+def test_rtin_full_grid_and_plane():
+	n = 17
+	heights = np.random.RandomState(1).uniform(0.0, 1.0, (n, n))
+	triangles = terrain.rtin_triangles(heights, 0.0)
+	assert len(triangles) == 2 * (n - 1)**2
+	_check_mesh(triangles, n)
+	
+	y, x = np.mgrid[0:n, 0:n]
+	triangles = terrain.rtin_triangles(0.3 * x - 0.7 * y + 2.0, 1e-9)
+	assert len(triangles) == 2
+	_check_mesh(triangles, n)
+
+
+def test_rtin_error_bound_and_no_cracks():
+	heights = _smooth_heights(2)
+	counts = []
+	for max_error in (0.2, 0.05, 0.01):
+		triangles = terrain.rtin_triangles(heights, max_error)
+		_check_mesh(triangles, len(heights))
+		assert np.all(_hypotenuse_errors(heights, triangles) <= max_error)
+		counts.append(len(triangles))
+	assert 2 < counts[0] < counts[1] < counts[2] < 2 * 32**2
@@ -0,0 +1,230 @@
+import math
+import random
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from city_generator import util
+
+
+def _exact_orientation(a, b, c):
+	ax, ay, bx, by, cx, cy = (Fraction(v) for v in (a[0], a[1], b[0], b[1], c[0], c[1]))
+	det = (ax - cx) * (by - cy) - (ay - cy) * (bx - cx)
+	return (det > 0) - (det < 0)
+
+
+# Nearly collinear with a and b, on their left, but the float determinant of (a, b, c) is negative
+_a, _b, _c = (12.0, 12.0), (24.0, 24.0), (0.5 + 41 * 2.0**-53, 0.5 + 48 * 2.0**-53)
+
+
+def test_orientation_is_exact_where_float_determinant_has_wrong_sign():
+	det = (_a[0] - _c[0]) * (_b[1] - _c[1]) - (_a[1] - _c[1]) * (_b[0] - _c[0])
+	assert det < 0
+	assert util.orientation(_a, _b, _c) == _exact_orientation(_a, _b, _c) == 1
+	assert util.orientation(_b, _c, _a) == util.orientation(_c, _a, _b) == 1
+	assert util.orientation(_b, _a, _c) == -1
+
+
+def test_orientation_of_simple_cases():
+	assert util.orientation((0.0, 0.0), (1.0, 0.0), (0.0, 1.0)) == 1
+	assert util.orientation((0.0, 0.0), (0.0, 1.0), (1.0, 0.0)) == -1
+	assert util.orientation((0.0, 0.0), (1.0, 1.0), (3.0, 3.0)) == 0
+	assert util.orientation((0.0, 0.0), (0.1, 0.1), (0.3, 0.3)) == 0
+
+
+def test_orientation_agrees_with_exact_arithmetic():
+	rng = random.Random(1)
+	for i in range(2000):
+		a, b = (rng.uniform(-10, 10), rng.uniform(-10, 10)), (rng.uniform(-10, 10), rng.uniform(-10, 10))
+		t = rng.uniform(-2, 3)
+		c = (a[0] + t * (b[0] - a[0]) + rng.randint(-3, 3) * 2.0**-50, a[1] + t * (b[1] - a[1]))
+		assert util.orientation(a, b, c) == _exact_orientation(a, b, c)
+
+
+@pytest.mark.parametrize('seg1, seg2, expected', [
+	# Crossing, disjoint, parallel
+	(((0.0, 0.0), (2.0, 2.0)), ((0.0, 2.0), (2.0, 0.0)), True),
+	(((0.0, 0.0), (1.0, 0.0)), ((0.0, 1.0), (1.0, 2.0)), False),
+	(((0.0, 0.0), (2.0, 0.0)), ((0.0, 1.0), (2.0, 1.0)), False),
+	# Shared endpoint only
+	(((0.0, 0.0), (1.0, 0.0)), ((1.0, 0.0), (1.0, 1.0)), False),
+	(((0.0, 0.0), (1.0, 0.0)), ((1.0, 0.0), (2.0, 0.0)), False),
+	(((0.0, 0.0), (1.0, 1.0)), ((0.0, 0.0), (-1.0, 1.0)), False),
+	# Endpoint touching the interior of the other segment
+	(((0.0, 0.0), (2.0, 0.0)), ((1.0, 0.0), (1.0, 1.0)), True),
+	(((1.0, 0.0), (1.0, 1.0)), ((0.0, 0.0), (2.0, 0.0)), True),
+	# Collinear overlapping, contained, and disjoint
+	(((0.0, 0.0), (2.0, 0.0)), ((1.0, 0.0), (3.0, 0.0)), True),
+	(((0.0, 0.0), (0.0, 3.0)), ((0.0, 2.0), (0.0, 1.0)), True),
+	(((0.0, 0.0), (1.0, 1.0)), ((2.0, 2.0), (3.0, 3.0)), False),
+	(((0.0, 0.0), (2.0, 2.0)), ((0.0, 0.0), (1.0, 1.0)), True),
+	# Nearly collinear: passes alongside, but only meets the line of seg1 at (36, 36)
+	((_a, _b), (_c, (36.0, 36.0)), False),
+	((_a, _b), (_c, (18.0, 18.0)), True),
+])
+def test_segment_intersection(seg1, seg2, expected):
+	assert util.segment_intersection(seg1, seg2) == expected
+	assert util.segment_intersection(seg2, seg1) == expected
+	assert util.segment_intersection(seg1[::-1], seg2[::-1]) == expected
+
+
+def _old_contract(vertices, dist):
+	"""Polygon.contract() before it was vectorized, one edge pair at a time."""
+	contracted_segments = []
+	for a, b in util.Polygon(vertices).edges_iter():
+		ab = (b[0] - a[0], b[1] - a[1])
+		ap = (ab[1], -ab[0])
+		len_ap = math.sqrt(ap[0]**2 + ap[1]**2)
+		ap = (dist * ap[0] / len_ap, dist * ap[1] / len_ap)
+		p = (a[0] + ap[0], a[1] + ap[1])
+		q = (p[0] + ab[0], p[1] + ab[1])
+		contracted_segments.append((p, q))
+	
+	contracted_points = []
+	for e, f in util.cycle_pairs(contracted_segments):
+		p = util.line_intersection_point(e, f)
+		if p is not None:
+			contracted_points.append(p)
+	return contracted_points
+
+
+def _random_polygon(rng):
+	"""Clockwise star-shaped polygon, with no angle near 180 degrees."""
+	while True:
+		n = rng.randint(3, 12)
+		angles = sorted((rng.uniform(0, 2 * math.pi) for i in range(n)), reverse=True)
+		center = (rng.uniform(-100, 100), rng.uniform(-100, 100))
+		vertices = [(center[0] + r * math.cos(a), center[1] + r * math.sin(a))
+			for a, r in zip(angles, (rng.uniform(10, 50) for i in range(n)))]
+		edges = list(util.Polygon(vertices).edges_iter())
+		sines = [((e[1][0] - e[0][0]) * (f[1][1] - f[0][1]) - (e[1][1] - e[0][1]) * (f[1][0] - f[0][0]))
+			/ (util.distance(*e) * util.distance(*f)) for e, f in util.cycle_pairs(edges)]
+		if min(util.distance(*e) for e in edges) > 3.0 and min(abs(sine) for sine in sines) > 0.05:
+			return vertices
+
+
+def test_contract_agrees_with_old_implementation():
+	rng = random.Random(1)
+	for i in range(300):
+		vertices = _random_polygon(rng)
+		dist = rng.uniform(-3, 3)
+		polygon = util.Polygon(list(vertices))
+		polygon.contract(dist)
+		assert np.allclose(polygon.vertices, _old_contract(vertices, dist), rtol=0, atol=1e-9)
+
+
+def test_contract_packed_polygons_agrees_with_old_implementation():
+	rng = random.Random(2)
+	polygons = [_random_polygon(rng) for i in range(50)]
+	dists = [rng.uniform(0, 3) for polygon in polygons]
+	offsets, coordinates = util.pack_sequences(polygons)
+	offsets, coordinates = util.contract_packed_polygons(offsets, coordinates, dists)
+	for contracted, polygon, dist in zip(util.unpack_sequences(offsets, coordinates), polygons, dists):
+		assert np.allclose(contracted, _old_contract(polygon, dist), rtol=0, atol=1e-9)
+	
+	contracted = util.contract_polygons([util.Polygon(polygon) for polygon in polygons], 1.5)
+	for polygon, old in zip(contracted, polygons):
+		assert np.allclose(polygon.vertices, _old_contract(old, 1.5), rtol=0, atol=1e-9)
+
+
+def test_contract_rectangle():
+	polygon = util.Polygon([(0.0, 0.0), (0.0, 10.0), (20.0, 10.0), (20.0, 0.0)])
+	polygon.contract(2.0)
+	assert np.allclose(polygon.vertices, [(2.0, 8.0), (18.0, 8.0), (18.0, 2.0), (2.0, 2.0)])
+	polygon.expand(2.0)
+	assert np.allclose(polygon.vertices, [(20.0, 10.0), (20.0, 0.0), (0.0, 0.0), (0.0, 10.0)])
+
+
+def test_contract_merges_near_parallel_edges_and_drops_repeated_vertices():
+	# Vertex (10, 10.001) nearly on the line between its neighbours, and (20, 10) repeated
+	vertices = [(0.0, 0.0), (0.0, 10.0), (10.0, 10.001), (20.0, 10.0), (20.0, 10.0), (20.0, 0.0)]
+	polygon = util.Polygon(vertices)
+	polygon.contract(2.0)
+	assert len(polygon.vertices) == 4
+	assert np.allclose(polygon.vertices, [(2.0, 8.0), (18.0, 8.0), (18.0, 2.0), (2.0, 2.0)], atol=1e-2)
+	
+	# Without the repeated vertex, which the old implementation could not handle, both drop the near-straight corner
+	vertices = [(0.0, 0.0), (0.0, 10.0), (10.0, 10.001), (20.0, 10.0), (20.0, 0.0)]
+	polygon = util.Polygon(list(vertices))
+	polygon.contract(2.0)
+	assert np.allclose(polygon.vertices, _old_contract(vertices, 2.0), rtol=0, atol=1e-3)
+
+
+def _pointwise_sweep(polylines, profile, max_miter=3.0):
+	"""Cross-section vertices swept along each polyline, computed point by point."""
+	vertices = []
+	for points in polylines:
+		directions = [(b[0:2] - a[0:2]) / np.hypot(*(b[0:2] - a[0:2])) for a, b in zip(points[:-1], points[1:])]
+		for i, point in enumerate(points):
+			adjacent = directions[max(i - 1, 0):i + 1]
+			tangent = sum(adjacent) / len(adjacent)
+			cos = np.hypot(*tangent)
+			scale = min(1.0 / cos, max_miter) / cos
+			normal = np.array([-tangent[1], tangent[0]]) * scale
+			for offset, height in profile:
+				vertices.append((point[0] + offset * normal[0], point[1] + offset * normal[1], point[2] + height))
+	return np.array(vertices)
+
+
+def _random_polyline(rng, n):
+	angles = np.cumsum(rng.uniform(-1.2, 1.2, n - 1))
+	steps = rng.uniform(1.0, 20.0, n - 1)[:, np.newaxis] * np.column_stack([np.cos(angles), np.sin(angles)])
+	points = np.zeros((n, 3))
+	points[1:, 0:2] = np.cumsum(steps, axis=0)
+	points[:, 2] = rng.uniform(0, 10, n)
+	return points + rng.uniform(-100, 100, 3)
+
+
+_profile = [(-6.0, -0.4), (-4.5, 0.1), (4.5, 0.1), (6.0, -0.4)]
+
+
+def test_sweep_packed_polylines_agrees_with_pointwise_sweep():
+	rng = np.random.RandomState(1)
+	polylines = [_random_polyline(rng, n) for n in (2, 3, 7, 20)]
+	offsets, points = util.pack_sequences(polylines, dimensions=3)
+	vertices, face_offsets, face_indices = util.sweep_packed_polylines(offsets, points, _profile)
+	assert np.allclose(vertices, _pointwise_sweep(polylines, _profile), rtol=0, atol=1e-9)
+	
+	# One quad per segment and cross-section edge, joining the sections of successive points of the same polyline
+	k = len(_profile)
+	assert len(face_offsets) - 1 == sum(len(p) - 1 for p in polylines) * (k - 1)
+	assert np.array_equal(face_offsets, 4 * np.arange(len(face_offsets)))
+	quads = face_indices.reshape(-1, 4)
+	sections = quads // k
+	assert np.array_equal(sections, sections[:, 0:1] + [0, 1, 1, 0])
+	assert np.array_equal(quads % k, (quads % k)[:, 0:1] + [0, 0, 1, 1])
+	assert not np.any(np.isin(sections[:, 0], offsets[1:] - 1))
+
+
+def test_sweep_keeps_width_at_bends_and_limits_miter():
+	# Right angle bend: the outer vertices stay at the cross-section offsets from both segments
+	points = np.array([(0.0, 0.0, 0.0), (10.0, 0.0, 0.0), (10.0, 10.0, 0.0)])
+	vertices, _, _ = util.sweep_packed_polylines(np.array([0, 3]), points, _profile)
+	assert np.allclose(vertices[4:8, 0:2], [(16.0, -6.0), (14.5, -4.5), (5.5, 4.5), (4.0, 6.0)])
+	assert np.allclose(vertices[0:4, 0:2], [(0.0, -6.0), (0.0, -4.5), (0.0, 4.5), (0.0, 6.0)])
+	assert np.allclose(vertices[:, 2], np.tile([-0.4, 0.1, 0.1, -0.4], 3))
+	
+	# Hairpin bend: offsets are scaled by at most max_miter
+	points = np.array([(0.0, 0.0, 0.0), (10.0, 0.0, 0.0), (0.0, 0.5, 0.0)])
+	vertices, _, _ = util.sweep_packed_polylines(np.array([0, 3]), points, _profile, max_miter=3.0)
+	assert np.allclose(np.hypot(*(vertices[7, 0:2] - points[1, 0:2])), 18.0)
+
+
+def test_trim_polyline():
+	rng = np.random.RandomState(2)
+	points = _random_polyline(rng, 10)
+	lengths = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+	assert util.trim_polyline(points, 3.0, 3.0) is None
+	assert util.trim_polyline(points, 5.0, 2.0) is None
+	assert np.array_equal(util.trim_polyline(points, 0.0, lengths[-1]), points)
+	
+	for start, end in ((1.0, lengths[-1] - 1.0), (lengths[2], lengths[5]), (lengths[3] + 0.5, lengths[3] + 0.7)):
+		trimmed = util.trim_polyline(points, start, end)
+		assert np.isclose(np.sum(np.linalg.norm(np.diff(trimmed, axis=0), axis=1)), end - start)
+		for cut, position in ((trimmed[0], start), (trimmed[-1], end)):
+			i = min(np.searchsorted(lengths, position, side='right') - 1, len(points) - 2)
+			t = (position - lengths[i]) / (lengths[i+1] - lengths[i])
+			assert np.allclose(cut, points[i] + t * (points[i+1] - points[i]))
+		inner = [p for p, length in zip(points, lengths) if start < length < end]
+		assert np.array_equal(trimmed[1:-1], np.array(inner).reshape(-1, 3))